@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of datemike: https://github.com/angstwad/datemike
+#
+# Copyright 2014 Paul Durivage
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Rows per second through the datemike command line tool, and its peak
+memory, at 10k, 100k and 1M rows of JSON lines and CSV.
+
+The input files are written first; each run then reads one in a fresh
+interpreter, writing YAML to /dev/null, so its peak RSS is its own.  Peak
+RSS levels off once the emitter's cache of rendered strings is full (at
+100k strings) and should then stay flat as the row count grows.
+
+    PYTHONPATH=. python benchmarks/cli_throughput.py [--sizes 10000,100000]
+"""
+
+import argparse
+import csv
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+from timeit import default_timer
+
+SIZES = (10000, 100000, 1000000)
+COLUMNS = ('hostname', 'flavor', 'image', 'region', 'group')
+ARGS = ['--module', 'CloudServer', '--map', 'name=hostname',
+        '--group-by', 'region']
+
+
+def peak_rss():
+    """ Peak resident set size of this process in bytes """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def rows(count):
+    """ Rows sorted by region, as the tool expects for grouping """
+    regions = ('DFW', 'IAD', 'ORD')
+    per_region = count // len(regions) + 1
+    for i in range(count):
+        yield ('web%d' % i, 'performance1-%d' % (i % 4 + 1), 'ubuntu-1204',
+               regions[i // per_region], 'web')
+
+
+def write_inputs(directory, count):
+    """ Write count rows as JSON lines and CSV
+
+    :return: dict of input format to filepath
+    """
+    paths = {'jsonl': os.path.join(directory, '%d.jsonl' % count),
+             'csv': os.path.join(directory, '%d.csv' % count)}
+    with open(paths['jsonl'], 'w') as f:
+        for row in rows(count):
+            f.write(json.dumps(dict(zip(COLUMNS, row))) + '\n')
+    with open(paths['csv'], 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows(rows(count))
+    return paths
+
+
+def run(path):
+    """ Convert one input file
+
+    :return: dict of seconds, base_rss and peak_rss
+    """
+    from datemike import cli
+    results = {'base_rss': peak_rss()}
+    with open(os.devnull, 'w') as out:
+        start = default_timer()
+        status = cli.main(ARGS + [path], stdout=out)
+        results['seconds'] = default_timer() - start
+    if status:
+        raise SystemExit(status)
+    results['peak_rss'] = peak_rss()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)),
+                        help='comma-separated row counts')
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run(args.run)))
+        return
+    tmp = tempfile.mkdtemp(prefix='datemike-cli-')
+    try:
+        print('%10s %6s %12s %10s %16s' % ('rows', 'input', 'rows/s',
+                                          'seconds', 'peak RSS (MiB)'))
+        for size in (int(s) for s in args.sizes.split(',')):
+            paths = write_inputs(tmp, size)
+            for fmt in ('jsonl', 'csv'):
+                out = subprocess.check_output(
+                    [sys.executable, os.path.abspath(__file__), '--run',
+                     paths[fmt]])
+                result = json.loads(out.decode('utf-8'))
+                print('%10d %6s %12.0f %10.2f %16.1f' % (
+                    size, fmt, size / result['seconds'], result['seconds'],
+                    result['peak_rss'] / 1048576.0))
+                os.remove(paths[fmt])
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of datemike: https://github.com/angstwad/datemike
+#
+# Copyright 2014 Paul Durivage
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare stages.py results between two revisions.
+
+Each side is a git revision, which is checked out to a temporary directory
+and timed with the current stages.py, or a JSON file written by
+stages.py --json.
+
+    python benchmarks/compare.py baseline HEAD [--sizes 1000,10000]
+    python benchmarks/compare.py before.json after.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from stages import SIZES, STAGES  # noqa: E402
+
+
+def results_for(source, sizes):
+    """ Load a results file, or run stages.py against a git revision
+
+    :param source: Path to a JSON file or a git revision
+    :return: dict of size to stage results
+    """
+    if os.path.isfile(source):
+        with open(source) as f:
+            return json.load(f)
+    tmp = tempfile.mkdtemp(prefix='datemike-bench-')
+    try:
+        archive = os.path.join(tmp, 'tree.tar')
+        with open(archive, 'wb') as f:
+            subprocess.check_call(['git', 'archive', source], stdout=f,
+                                  cwd=os.path.dirname(HERE))
+        with tarfile.open(archive) as tar:
+            tar.extractall(tmp)
+        env = dict(os.environ, PYTHONPATH=tmp)
+        out = os.path.join(tmp, 'results.json')
+        subprocess.check_call(
+            [sys.executable, os.path.join(HERE, 'stages.py'),
+             '--sizes', ','.join(map(str, sizes)), '--json', out],
+            env=env, stdout=sys.stderr)
+        with open(out) as f:
+            return json.load(f)
+    finally:
+        shutil.rmtree(tmp)
+
+
+def cell(before, after):
+    if before is None or after is None:
+        return '%24s' % 'failed'
+    return '%10.4f %8.4f %4.1fx' % (before, after,
+                                   before / after if after else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('before', help='git revision or results file')
+    parser.add_argument('after', help='git revision or results file')
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)),
+                        help='comma-separated task counts, for revisions')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    before = results_for(args.before, sizes)
+    after = results_for(args.after, sizes)
+    common = sorted(set(before) & set(after), key=int)
+    print('seconds: %s -> %s (speedup)' % (args.before, args.after))
+    for size in common:
+        print('\n%s tasks' % size)
+        for name, label in STAGES:
+            print('  %-34s %s' % (label, cell(before[size].get(name),
+                                              after[size].get(name))))
+        growth = [(r[size]['peak_rss'] - r[size]['base_rss']) / 1048576.0
+                  for r in (before, after)]
+        print('  %-34s %10.1f %8.1f MiB' % ('peak RSS growth',
+                                            growth[0], growth[1]))
+
+if __name__ == '__main__':
+    main()
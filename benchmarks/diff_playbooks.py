@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of datemike: https://github.com/angstwad/datemike
+#
+# Copyright 2014 Paul Durivage
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Seconds datemike.diff takes to compare two playbooks of 10k, 100k and 300k
+tasks, where the second has its tasks shuffled and one in a thousand
+changed: as Playbook objects, and as JSON files.
+
+    PYTHONPATH=. python benchmarks/diff_playbooks.py [--sizes 10000,100000]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+from timeit import default_timer
+
+from datemike import ansible, diff
+from datemike.providers import rackspace
+
+SIZES = (10000, 100000, 300000)
+PLAYS = 4
+
+
+def playbook(count, changed=False):
+    """ count tasks split over PLAYS plays; if changed, shuffled and with
+    every thousandth server's flavor changed
+    """
+    book = ansible.Playbook()
+    rng = random.Random(count)
+    for p in range(PLAYS):
+        play = ansible.Play('Play %d' % p, hosts='localhost')
+        order = list(range(count // PLAYS))
+        if changed:
+            rng.shuffle(order)
+        for i in order:
+            flavor = 'performance1-%d' % (2 if changed and not i % 1000
+                                          else 1)
+            play.add_task(ansible.Task(rackspace.CloudServer(
+                'web%d-%d' % (p, i), flavor, 'ubuntu', region='IAD'),
+                True, register='web'))
+        book.add_play(play)
+    return book
+
+
+def timed(func):
+    start = default_timer()
+    result = func()
+    return default_timer() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)),
+                        help='comma-separated task counts')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='datemike-diff-')
+    try:
+        print('%10s %10s %12s %10s' % ('tasks', 'objects', 'JSON files',
+                                       'changed'))
+        for size in (int(s) for s in args.sizes.split(',')):
+            old, new = playbook(size), playbook(size, True)
+            paths = [os.path.join(tmp, name) for name in ('a.json',
+                                                          'b.json')]
+            old.to_json_file(paths[0])
+            new.to_json_file(paths[1])
+            objects, result = timed(lambda: diff(old, new))
+            files, _ = timed(lambda: diff(*paths))
+            print('%10d %10.2f %12.2f %10d' % (
+                size, objects, files, result.summary()['tasks_changed']))
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of datemike: https://github.com/angstwad/datemike
+#
+# Copyright 2014 Paul Durivage
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Time spent importing datemike, as reported by python -X importtime.
+
+Each statement runs in a fresh interpreter; the best of several runs is
+shown along with whether PyYAML ended up imported.  Point PYTHONPATH at
+another checkout to time it instead.
+
+    PYTHONPATH=. python benchmarks/importtime.py [--repeat N]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+STATEMENTS = (
+    'import datemike',
+    'from datemike.providers.rackspace import *',
+    'from datemike import providers; providers.CloudServer',
+    'import datemike; from datemike.providers import rackspace; '
+    'str(datemike.Task(rackspace.CloudServer("web", "1", "ubuntu")))',
+)
+
+
+def environment():
+    """ The environment to run statements in: bytecode caching on, as in
+    production, and PYTHONPATH made absolute since they run elsewhere (so
+    the current directory can't shadow it)
+    """
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    paths = env.get('PYTHONPATH', '').split(os.pathsep)
+    env['PYTHONPATH'] = os.pathsep.join(os.path.abspath(p)
+                                        for p in paths if p)
+    return env
+
+
+def import_times(statement, env):
+    """ Run statement with -X importtime
+
+    :return: tuple of (microseconds importing datemike and everything it
+    imported, whether yaml was imported), or None if the statement failed
+    (such as on a checkout predating the API it uses)
+    """
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime', '-c',
+                             statement], stderr=subprocess.PIPE, env=env,
+                            cwd=tempfile.gettempdir())
+    err = proc.communicate()[1].decode('utf-8')
+    if proc.returncode:
+        return None
+    total = 0
+    yaml = False
+    for line in err.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        # Top-level entries have no indentation beyond the column's space
+        if name.startswith(' datemike'):
+            total += int(cumulative)
+        yaml = yaml or name.strip() == 'yaml'
+    return total, yaml
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='runs per statement; the fastest is shown')
+    args = parser.parse_args()
+
+    env = environment()
+    # Write the bytecode caches first
+    import_times(STATEMENTS[-1], env)
+    print('%10s  %-5s  %s' % ('ms', 'yaml', 'statement'))
+    for statement in STATEMENTS:
+        runs = [import_times(statement, env) for _ in range(args.repeat)]
+        if None in runs:
+            print('%10s  %-5s  %s' % ('failed', '', statement))
+            continue
+        best = min(total for total, _ in runs)
+        print('%10.2f  %-5s  %s' % (best / 1000.0, runs[0][1], statement))
+
+if __name__ == '__main__':
+    main()
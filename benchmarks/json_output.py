@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of datemike: https://github.com/angstwad/datemike
+#
+# Copyright 2014 Paul Durivage
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Emit time and output size of a playbook as JSON against YAML, and how long
+each takes to parse back.
+
+The YAML is written by pretty_yaml with each engine; the JSON by
+pretty_json with the encoder it picks ('auto', orjson when installed) and
+the standard library's.  Parse times use the same loaders Ansible would:
+json.loads and PyYAML's CSafeLoader (or SafeLoader).
+
+    PYTHONPATH=. python benchmarks/json_output.py [--tasks 10000]
+"""
+
+import argparse
+import gc
+import json
+from timeit import default_timer
+
+import yaml
+
+from datemike import ansible, utils
+from datemike.providers import rackspace
+
+
+def build(count):
+    play = ansible.Play('Servers', hosts='localhost', gather_facts=False)
+    play.add_task(ansible.Task(rackspace.CloudServer(
+        'web%d' % i, 'performance1-1', 'ubuntu', region='IAD', count=1,
+        meta={'group': 'web', 'index': i}), register='web')
+        for i in range(count))
+    return play.as_obj()
+
+
+def best(func, repeat):
+    """ Fastest of repeat calls to func, and its last result """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = default_timer()
+        result = func()
+        times.append(default_timer() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--tasks', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    obj = build(args.tasks)
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    emitters = [
+        ('yaml (%s)' % engine,
+         lambda engine=engine: utils.pretty_yaml([obj], engine=engine),
+         lambda text: yaml.load(text, Loader=loader))
+        for engine in utils.ENGINES]
+    emitters += [
+        ('json (%s)' % engine,
+         lambda engine=engine: utils.pretty_json([obj], engine=engine),
+         json.loads)
+        for engine in utils.JSON_ENGINES]
+
+    print('%d tasks' % args.tasks)
+    print('%-16s %10s %10s %12s' % ('output', 'emit s', 'parse s', 'bytes'))
+    for label, emit, parse in emitters:
+        seconds, text = best(emit, args.repeat)
+        parsed, _ = best(lambda: parse(text), args.repeat)
+        print('%-16s %10.4f %10.4f %12d' % (label, seconds, parsed,
+                                            len(text.encode('utf-8'))))
+
+if __name__ == '__main__':
+    main()
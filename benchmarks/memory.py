@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of datemike: https://github.com/angstwad/datemike
+#
+# Copyright 2014 Paul Durivage
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Bytes per instance of the Rackspace module classes.
+
+Each class is measured as it is now (slots, including those for change
+tracking, no per-instance __dict__, module dicts only created when the
+module is rendered) and as it was before: the same attributes held in an
+instance __dict__ next to empty module and module_args dicts.
+
+    PYTHONPATH=. python benchmarks/memory.py [--count N]
+"""
+
+import argparse
+import gc
+import tracemalloc
+
+from datemike.base import ModuleBase, _slots
+from datemike.providers import rackspace
+
+# Constructor arguments for instance i of each class
+SAMPLES = {
+    rackspace.CloudServer: lambda i: (
+        ('web%d' % i, 'performance1-1', 'ubuntu-1204'),
+        dict(region='IAD', credentials='~/.rackspace_cloud_credentials',
+             count=1)),
+    rackspace.CloudLoadBal: lambda i: (
+        ('lb%d' % i,), dict(region='IAD', port=80, protocol='HTTP')),
+    rackspace.CloudLoadBalNodes: lambda i: (
+        ('node%d' % i, 1234),
+        dict(address='10.0.0.%d' % (i % 255), port=80, region='IAD')),
+    rackspace.CloudDnsRecord: lambda i: (
+        ('example.com', 'host%d.example.com' % i, '10.0.0.%d' % (i % 255)),
+        dict(region='IAD', type_='A')),
+    rackspace.CloudServersAddHosts: lambda i: (('web',), {}),
+}
+
+
+class DictBacked(object):
+    """ Stand-in for a module object stored in an instance __dict__ """
+
+
+def dict_backed(obj):
+    """ Copy of obj laid out the way module objects used to be """
+    legacy = DictBacked()
+    for klass in reversed(type(obj).__mro__):
+        for name in _slots(klass):
+            if name not in ModuleBase.__slots__:
+                setattr(legacy, name, getattr(obj, name, None))
+    legacy.module = dict()
+    legacy.module_args = dict()
+    legacy.module_name = obj.module_name
+    legacy.display_name = obj.display_name
+    return legacy
+
+
+def measure(factory, count):
+    """ Average bytes allocated per object built by factory(i) """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objs = [factory(i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # Don't count the list holding the objects
+    size = after - before - (64 + 8 * count)
+    del objs
+    return size / float(count)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--count', type=int, default=10000,
+                        help='instances to build per class')
+    args = parser.parse_args()
+
+    # Arguments and the objects copied into the old layout are built up
+    # front, so both layouts share the same strings and only the module
+    # objects themselves are measured.
+    print('%-22s %10s %10s %8s' % ('class', 'before', 'after', 'saved'))
+    for cls, sample in SAMPLES.items():
+        specs = [sample(i) for i in range(args.count)]
+        originals = [cls(*a, **kw) for a, kw in specs]
+        after = measure(lambda i: cls(*specs[i][0], **specs[i][1]),
+                        args.count)
+        before = measure(lambda i: dict_backed(originals[i]), args.count)
+        print('%-22s %10.0f %10.0f %7.0f%%' % (
+            cls.__name__, before, after, 100 * (1 - after / before)))
+
+if __name__ == '__main__':
+    main()
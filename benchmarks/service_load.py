@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of datemike: https://github.com/angstwad/datemike
+#
+# Copyright 2014 Paul Durivage
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Requests per second of the render service (datemike.service).
+
+Starts a local instance in this process, or uses the one at --url, and
+posts specs from several client threads.  --distinct sets how many
+different specs are cycled through, so the cache's share of the work can
+be varied; --distinct 0 makes every spec unique (all misses).
+
+    PYTHONPATH=. python benchmarks/service_load.py [--requests 2000]
+"""
+
+import argparse
+import json
+import threading
+from timeit import default_timer
+
+try:
+    from http.client import HTTPConnection
+    from urllib.parse import urlparse
+except ImportError:  # Python 2
+    from httplib import HTTPConnection
+    from urlparse import urlparse
+
+from datemike import service
+
+
+def spec(n, tasks):
+    return [{'name': 'Web %d' % n, 'hosts': 'localhost',
+             'tasks': [{'module': 'CloudServer',
+                        'args': {'name': 'web%d-%d' % (n, i),
+                                 'flavor': 'performance1-1',
+                                 'image': 'ubuntu', 'region': 'IAD'},
+                        'local_action': True, 'register': 'web'}
+                       for i in range(tasks)]}]
+
+
+def client(url, bodies, latencies):
+    parsed = urlparse(url)
+    conn = HTTPConnection(parsed.hostname, parsed.port)
+    for body in bodies:
+        start = default_timer()
+        conn.request('POST', '/render', body,
+                     {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError('Render failed: %s' % response.status)
+        latencies.append(default_timer() - start)
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--url', help='service to test, e.g. '
+                                      'http://127.0.0.1:8080; default: start '
+                                      'one')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--distinct', type=int, default=20,
+                        help='different specs to cycle through')
+    parser.add_argument('--tasks', type=int, default=50,
+                        help='tasks per spec')
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        server = service.make_server(port=0)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        url = 'http://%s:%d' % server.server_address[:2]
+
+    count = args.distinct or args.requests
+    specs = [json.dumps(spec(n, args.tasks)) for n in range(count)]
+    bodies = [specs[i % count] for i in range(args.requests)]
+    latencies = []
+    threads = [threading.Thread(target=client,
+                                args=(url, bodies[i::args.clients],
+                                      latencies))
+               for i in range(args.clients)]
+    start = default_timer()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = default_timer() - start
+
+    conn = HTTPConnection(urlparse(url).hostname, urlparse(url).port)
+    conn.request('GET', '/metrics')
+    metrics = json.loads(conn.getresponse().read().decode('utf-8'))
+    latencies.sort()
+    print('%d requests, %d clients, %d tasks per spec' %
+          (len(latencies), args.clients, args.tasks))
+    print('requests/s       %10.1f' % (len(latencies) / elapsed))
+    print('median latency   %10.2f ms' %
+          (latencies[len(latencies) // 2] * 1000))
+    print('99th percentile  %10.2f ms' %
+          (latencies[int(len(latencies) * 0.99)] * 1000))
+    print('cache            %s' % json.dumps(metrics, sort_keys=True))
+    if server is not None:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of datemike: https://github.com/angstwad/datemike
+#
+# Copyright 2014 Paul Durivage
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Seconds spent in each stage of building and rendering a playbook, and the
+peak memory of doing so, at 1k, 10k, 100k and 1M tasks.
+
+Each size runs in a fresh interpreter so its peak RSS is its own.  Only the
+public API present since the first release is used, so the same script can
+time older revisions (see compare.py).
+
+    PYTHONPATH=. python benchmarks/stages.py [--sizes 1000,10000] [--json F]
+"""
+
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+from timeit import default_timer
+
+from datemike import ansible, utils
+from datemike.providers import rackspace
+
+SIZES = (1000, 10000, 100000, 1000000)
+# Stages in the order they run; each works on the output of the last
+STAGES = (
+    ('construct', 'CloudServer.__init__'),
+    ('make_dict', 'module as_obj (_make_dict)'),
+    ('task', 'Task.__init__ + as_obj'),
+    ('task_local', 'Task(local_action=True) + as_obj'),
+    ('add_task', 'Play.add_task, one at a time'),
+    ('play_obj', 'Play.as_obj'),
+    ('pretty_yaml', 'pretty_yaml(play.as_obj())'),
+    ('to_yaml', 'Playbook.to_yaml'),
+)
+
+
+def peak_rss():
+    """ Peak resident set size of this process in bytes """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run(count):
+    """ Time every stage for count tasks
+
+    :return: dict of stage name to seconds (None if it failed), plus
+    'peak_rss' and 'base_rss' in bytes
+    """
+    results = {'base_rss': peak_rss()}
+    state = {}
+
+    def construct():
+        state['servers'] = [
+            rackspace.CloudServer('web%d' % i, 'performance1-1', 'ubuntu',
+                                  region='IAD', count=1)
+            for i in range(count)]
+
+    def make_dict():
+        for server in state['servers']:
+            server.as_obj()
+
+    def task():
+        state['tasks'] = [ansible.Task(s, register='web')
+                          for s in state['servers']]
+        for t in state['tasks']:
+            t.as_obj()
+
+    def task_local():
+        for s in state['servers']:
+            ansible.Task(s, local_action=True).as_obj()
+
+    def add_task():
+        state['play'] = play = ansible.Play('Servers', gather_facts=False)
+        play.add_host('localhost')
+        for t in state['tasks']:
+            play.add_task(t)
+
+    def play_obj():
+        state['obj'] = state['play'].as_obj()
+
+    def pretty_yaml():
+        utils.pretty_yaml(state['obj'])
+
+    def to_yaml():
+        book = ansible.Playbook()
+        book.add_play(state['play'])
+        book.to_yaml()
+
+    funcs = locals()
+    for name, _ in STAGES:
+        gc.collect()
+        start = default_timer()
+        try:
+            funcs[name]()
+        except Exception:
+            results[name] = None
+        else:
+            results[name] = default_timer() - start
+    results['peak_rss'] = peak_rss()
+    return results
+
+
+def collect(sizes, python=sys.executable):
+    """ Run each size in its own interpreter
+
+    :return: dict of size (as a string) to the results of run()
+    """
+    results = {}
+    for size in sizes:
+        out = subprocess.check_output(
+            [python, os.path.abspath(__file__), '--run', str(size)])
+        results[str(size)] = json.loads(out.decode('utf-8'))
+    return results
+
+
+def report(results):
+    sizes = sorted(results, key=int)
+    print('%-34s' % 'stage' + ''.join('%12s' % s for s in sizes))
+    for name, label in STAGES:
+        row = [results[s].get(name) for s in sizes]
+        print('%-34s' % label + ''.join(
+            '%12s' % ('failed' if t is None else '%.4f' % t) for t in row))
+    print('%-34s' % 'peak RSS growth (MiB)' + ''.join(
+        '%12.1f' % ((results[s]['peak_rss'] - results[s]['base_rss']) /
+                    1048576.0) for s in sizes))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)),
+                        help='comma-separated task counts')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--run', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run(args.run)))
+        return
+    results = collect(int(s) for s in args.sizes.split(','))
+    report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
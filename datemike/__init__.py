@@ -24,7 +24,16 @@ datemike
 Create Ansible tasks, plays, and playbooks in pure Python.
 """
 
-from datemike.ansible import Task, Play, Playbook  # NOQA
+from datemike.ansible import Task, Play, Playbook, PlaybookWriter  # NOQA
 from datemike.base import ModuleBase  # NOQA
+from datemike.hosts import HostSet  # NOQA
 
 __version__ = '0.1.1'
+
+
+def diff(old, new, key_args=None):
+    """ Compare two playbooks; see datemike.delta.diff, which is only
+    imported (with the loader and providers) when this is first called
+    """
+    from datemike import delta
+    return delta.diff(old, new, key_args)
@@ -19,11 +19,49 @@
 
 import os
 from collections import OrderedDict
+from types import MappingProxyType
 
-from datemike.utils import pretty_yaml
+from datemike import utils
+from datemike.base import (_gc_paused, link_parent, ModuleBase, parents_of,
+                           unlink_parent)
+from datemike.hosts import HostSet
+from datemike.utils import (fast_yaml, fast_yaml_entries, fast_yaml_entry,
+                            Fragment, JsonStream, pretty_json, pretty_yaml,
+                            YamlStream)
 
+# Tasks per job when a play is rendered in worker processes
+_TASK_CHUNK = 1000
+# Name of the file of content hashes kept next to incremental output, and
+# the version of the hashes it holds
+MANIFEST = '.datemike-manifest.json'
+MANIFEST_FORMAT = 2
+# Stands in for a play's tasks while the rest of the play is rendered
+_TASKS_MARKER = '\0\n'
+# Task arguments that stop a task from being folded into a loop: it loops
+# already, or its result would change shape
+_UNFOLDABLE = ('register', 'loop', 'loop_control', 'until')
+# Seconds async tasks may run when their modules set no wait_timeout, and
+# the time allowed on top of a module's own wait_timeout
+_ASYNC_TIMEOUT = 600
+_ASYNC_MARGIN = 60
+
+
+def _combine(kind, *parts):
+    """ Hash of a node from its kind and the hashes of its parts """
+    import hashlib
+    digest = hashlib.sha1(kind.encode('ascii'))
+    for part in parts:
+        digest.update(b'\0' + part.encode('ascii'))
+    return digest.hexdigest()
+
+
+class Task(Fragment):
+    # Module argument values the play supplies as module_defaults, left out
+    # of this task where its own values are the same; set by Play.hoist()
+    defaults = None
+    # See fingerprint()
+    _fingerprint = None
 
-class Task(object):
     def __init__(self, module, local_action=False, **kwargs):
         """ A task wraps a module object following the Ansible
         Task < Play < Playbook hierarchy
@@ -36,139 +74,1367 @@ class Task(object):
         self.module = module
         self.task_args = kwargs
         self.local_action = local_action
-        self.task = OrderedDict(name=module.display_name)
-        self.task.update(kwargs)
-        if local_action:
-            module_name = module.as_obj().keys()[0]
-            new_module = OrderedDict(module=module_name)
-            new_module.update(module.as_obj()[module_name])
-            self.task['local_action'] = new_module
-        else:
-            self.task.update(module.as_obj())
+        # Built from the module on first use; see as_obj()
+        self._task = None
+        self._dirty = True
+        self._parents = None
+        self._fragments = None
+        link_parent(module, self)
+
+    @classmethod
+    def bulk(cls, module_cls, columns, constants=None, local_action=False,
+             **kwargs):
+        """ Build one task per row of column-oriented module arguments
+
+            Task.bulk(CloudDnsRecord,
+                      {'fqdn': names, 'data': addresses},
+                      constants={'domain_name': 'example.com',
+                                 'credentials': CREDS},
+                      local_action=True)
+
+        :param module_cls: ModuleBase derivative to instantiate for each row
+        :param columns: dict mapping module constructor argument names to
+        lists, tuples or NumPy arrays of equal length
+        :param constants: dict of module constructor arguments shared by
+        every row
+        :param local_action: Sets task local_action if True
+        :param kwargs: Task-level arguments shared by every task
+        :return: list of Task objects
+        """
+        modules = module_cls._iter_bulk(columns, constants or {})
+        if cls.__init__ is not Task.__init__:
+            with _gc_paused():
+                return [cls(module, local_action, **kwargs)
+                        for module in modules]
+        tasks = []
+        append = tasks.append
+        new = object.__new__
+        with _gc_paused():
+            # One pass, setting up each task as __init__ would
+            for module in modules:
+                task = new(cls)
+                task.module = module
+                task.task_args = dict(kwargs)
+                task.local_action = local_action
+                task._task = None
+                task._dirty = True
+                task._parents = None
+                task._fragments = None
+                module._parents = task
+                append(task)
+        return tasks
 
     def __str__(self):
         return self.to_yaml()
 
-    def init_task(self):
+    @property
+    def task(self):
+        """ A read-only view of the task, built on first access.  Change
+        the task through module and task_args, then call invalidate().
+        """
+        return MappingProxyType(self.as_obj())
+
+    def _make_dict(self):
+        """ (Re)build the task dictionary in place, so plays holding it see
+        the new contents
+        """
+        module = self.module
+        task = self._task
+        if task is None:
+            task = self._task = OrderedDict()
+        task.clear()
+        if module.display_name is not None:
+            task['name'] = module.display_name
+        task.update(self.task_args)
+        module_obj = module.as_obj()
+        if self.defaults:
+            module_name = next(iter(module_obj))
+            module_obj = {module_name: OrderedDict(
+                (k, v) for k, v in module_obj[module_name].items()
+                if not self._hoisted(k, v))}
         if self.local_action:
-            self.task['local_action'] = self.module.as_obj()
-        if self.task_args:
-            self.task.update(self.task_args)
+            module_name = next(iter(module_obj))
+            new_module = OrderedDict(module=module_name)
+            new_module.update(module_obj[module_name])
+            task['local_action'] = new_module
+        else:
+            task.update(module_obj)
+        self._dirty = False
+
+    def _hoisted(self, key, value):
+        """ Whether an argument can be left to the play's module_defaults """
+        defaults = self.defaults
+        return key in defaults and defaults[key] == value
+
+    def _child_changed(self, module):
+        self.invalidate()
+
+    def invalidate(self):
+        """ Mark this task as changed: it is rebuilt from its module on next
+        use, and the plays holding it re-render it.  Called automatically
+        when an attribute of the module is set; call it directly after
+        changing task_args or the module's values in place.
+        """
+        self._fragments = None
+        # Parents that took a fingerprint must hear of changes too
+        notify = not self._dirty or self._fingerprint is not None
+        self._dirty = True
+        self._fingerprint = None
+        if notify:
+            for parent in parents_of(self):
+                parent._child_changed(self)
+
+    def fingerprint(self):
+        """ Hash of this task, combined from its module's fingerprint and
+        its own arguments, and kept until either changes
+
+        :return: str (hex digest)
+        """
+        if self._fingerprint is None:
+            self._fingerprint = _combine('task', self.module.fingerprint(),
+                                         self._own_hash())
+        return self._fingerprint
+
+    def _own_hash(self):
+        # Task arguments are written in the order they were given
+        return utils.content_hash((bool(self.local_action),
+                                   tuple(self.task_args.items()),
+                                   self.defaults))
+
+    def init_task(self):
+        """ Rebuild the task from its module and task_args """
+        self.invalidate()
 
     def as_obj(self):
-        return self.task
+        if self._dirty:
+            self._make_dict()
+        return self._task
+
+    def yaml_fragment(self, indent):
+        if self._dirty:
+            self._make_dict()
+        if self._fragments is None:
+            self._fragments = {}
+        try:
+            return self._fragments[indent]
+        except KeyError:
+            fragment = fast_yaml_entry(self._task, indent)
+            self._fragments[indent] = fragment
+            return fragment
 
     def to_yaml(self):
-        return pretty_yaml(self.task)
+        return pretty_yaml(self.as_obj())
+
+    def to_json(self, indent=None):
+        return pretty_json(self.as_obj(), indent=indent)
+
+
+class AsyncStatus(ModuleBase):
+    __slots__ = ('mod_jid', 'mod_mode')
+
+    def __init__(self, jid, mode=None, display_name='Wait for async jobs'):
+        """ Ansible's async_status module, which reports on (or cleans up)
+        a job started by an async task
+
+        :param jid: Job id, usually templated from the registered result
+        :param mode: 'status' (default) or 'cleanup'
+        :param display_name: Task name
+        """
+        super(AsyncStatus, self).__init__()
+        self.display_name = display_name
+        self.module_name = 'async_status'
+        self.mod_jid = jid
+        self.mod_mode = mode
+
+
+class LoopTask(Task):
+    def __init__(self, tasks):
+        """ A single task that runs a module over with_items, standing in
+        for several tasks of the same module that differ only in some module
+        arguments; built by Play.optimize().  Arguments that vary become
+        '{{ item }}' (or '{{ item.name }}' when several vary, or when the
+        one that varies holds lists or dicts, which with_items would
+        flatten into the loop), and the name and task arguments are those
+        of the first task.  Changes to the tasks, or their modules, rebuild
+        the loop.
+
+        :param tasks: list of Task objects
+        """
+        self.tasks = list(tasks)
+        first = self.tasks[0]
+        super(LoopTask, self).__init__(first.module, first.local_action,
+                                       **first.task_args)
+        unlink_parent(first.module, self)
+        for task in self.tasks:
+            link_parent(task, self)
+
+    def _make_dict(self):
+        module_name = None
+        rows = []
+        for task in self.tasks:
+            # Building each task's dict also lets it report changes again
+            task.as_obj()
+            module_obj = task.module.as_obj()
+            module_name = next(iter(module_obj))
+            rows.append(module_obj[module_name])
+        keys = []
+        for row in rows:
+            keys.extend(k for k in row if k not in keys)
+        missing = object()
+        varying = [k for k in keys if any(
+            row.get(k, missing) != rows[0].get(k, missing) for row in rows)]
+        # A lone varying argument can be the item itself, unless its values
+        # are lists (or dicts) that with_items would flatten
+        bare = len(varying) == 1 and all(
+            varying[0] in row and
+            not isinstance(row[varying[0]], (list, dict)) for row in rows)
+        args = OrderedDict()
+        for key in keys:
+            if key not in varying:
+                if self.defaults and self._hoisted(key, rows[0][key]):
+                    continue
+                args[key] = rows[0][key]
+            elif bare:
+                args[key] = '{{ item }}'
+            elif all(key in row for row in rows):
+                args[key] = '{{ item.%s }}' % key
+            else:
+                args[key] = '{{ item.%s | default(omit) }}' % key
+        if bare:
+            items = [row[varying[0]] for row in rows]
+        else:
+            items = [OrderedDict((k, row[k]) for k in varying if k in row)
+                     for row in rows]
+
+        first = self.tasks[0]
+        task = self._task
+        if task is None:
+            task = self._task = OrderedDict()
+        task.clear()
+        if first.module.display_name is not None:
+            task['name'] = first.module.display_name
+        task.update(self.task_args)
+        if first.local_action:
+            new_module = OrderedDict(module=module_name)
+            new_module.update(args)
+            task['local_action'] = new_module
+        else:
+            task[module_name] = args
+        task['with_items'] = items
+        self._dirty = False
+
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = _combine(
+                'loop', self._own_hash(),
+                *[task.fingerprint() for task in self.tasks])
+        return self._fingerprint
+
+
+class RawTask(Task):
+    def __init__(self, obj):
+        """ A task kept as the dict it was read as, for tasks that don't
+        map to a single module (blocks, includes, free-form arguments);
+        built by datemike.loader.  Call invalidate() after changing the
+        dict in place.
+
+        :param obj: Task as a dict
+        """
+        self.module = None
+        self.task_args = {}
+        self.local_action = False
+        self._task = obj
+        self._dirty = False
+        self._parents = None
+        self._fragments = None
+
+    def _make_dict(self):
+        self._dirty = False
+
+    def module_names(self):
+        """ Names of the modules this task runs, including those of the
+        tasks in its blocks.  The tasks of included files aren't known.
 
+        :return: set of str
+        """
+        from datemike.loader import _RAW_KEYS, task_module
+        names = set()
+        pending = [self._task]
+        while pending:
+            obj = pending.pop()
+            if not isinstance(obj, dict):
+                continue
+            for key in ('block', 'rescue', 'always'):
+                if isinstance(obj.get(key), list):
+                    pending.extend(obj[key])
+            module = task_module(obj)[0]
+            if module is not None and not _RAW_KEYS.intersection(obj):
+                names.add(module)
+            # action: and local_action: in their free-form spelling
+            for key in ('action', 'local_action'):
+                action = obj.get(key)
+                if isinstance(action, dict):
+                    action = action.get('module')
+                if isinstance(action, str) and action.split():
+                    names.add(action.split()[0])
+        return names
+
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = utils.content_hash(self._task)
+        return self._fingerprint
+
+
+def _fold_key(task):
+    """ What tasks must share to be folded into one loop, or None if the
+    task can't be folded
+    """
+    if isinstance(task, (LoopTask, RawTask)):
+        return None
+    args = task.task_args
+    if any(k in _UNFOLDABLE or k.startswith('with_') for k in args):
+        return None
+    module_obj = task.module.as_obj()
+    module_name = next(iter(module_obj))
+    module_args = module_obj[module_name]
+    for value in module_args.values():
+        # Would refer to the loop's item rather than whatever it did
+        if isinstance(value, str) and 'item' in value and '{{' in value:
+            return None
+    return (module_name, bool(task.local_action), task.module.display_name,
+            tuple(module_args))
 
-class Play(object):
+
+class Play(Fragment):
     def __init__(self, name, **kwargs):
         """ A play consists of a task or several tasks, following the Ansible
-        Task < Play < Playbook hierarchy
+        Task < Play < Playbook hierarchy.  Tasks are held as Task objects and
+        only turned into dicts when the play is rendered.
 
         :param name:
         :param kwargs:
         """
         self.play_args = kwargs
-        self.play = OrderedDict(name=name)
-        self.play.update(kwargs)
+        # The play with its tasks as Task objects
+        self._play = OrderedDict(name=name)
+        self._play.update(kwargs)
+        # The play with its tasks as dicts, built by as_obj()
+        self._obj = None
+        # Tasks that changed since the play was last built
+        self._changed = set()
+        self._dirty = False
+        self._parents = None
+        self._fragments = None
+        self._yaml = None
+        self._json = None
+        self._fingerprint = None
+        # Batches added by add_async_tasks(), for naming their results
+        self._async_batches = 0
+        # The hosts, for finding duplicates; built by add_host()
+        self._hosts = None
 
     def __str__(self):
         return self.to_yaml()
 
+    @property
+    def play(self):
+        """ A read-only view of the play, built on first access.  Use
+        set_key() to set a play keyword.
+        """
+        return MappingProxyType(self.as_obj())
+
+    def _child_changed(self, task):
+        self._changed.add(task)
+        self._invalidate_yaml()
+
+    def _invalidate_yaml(self):
+        self._fragments = None
+        self._yaml = None
+        self._json = None
+        # Parents that took a fingerprint must hear of changes too
+        notify = not self._dirty or self._fingerprint is not None
+        self._dirty = True
+        self._fingerprint = None
+        if notify:
+            for parent in parents_of(self):
+                parent._child_changed(self)
+
+    def invalidate(self):
+        """ Rebuild this play on next use and tell the playbooks holding
+        it.  Called automatically when its tasks, hosts or roles change;
+        call it directly after changing play_args values in place.
+        """
+        self._obj = None
+        self._invalidate_yaml()
+
+    def _extend(self, key, value, kind):
+        """ Add an item, or every item of an iterable, to a list entry
+
+        :return: list of the items added
+        """
+        if not self._play.get(key):
+            self._play[key] = []
+        items = [value] if isinstance(value, kind) else list(value)
+        self._play[key].extend(items)
+        self.invalidate()
+        return items
+
     def add_task(self, task):
         """ Add a task to this play
 
-        :param task: Task as an object
+        :param task: Task as an object, or a list, generator or other
+        iterable of Task objects
         """
-        if not self.play.get('tasks'):
-            self.play['tasks'] = []
-        if isinstance(task, Task):
-            self.play['tasks'].append(task.as_obj())
-        elif isinstance(task, list):
-            lst = [t.as_obj() for t in task]
-            self.play['tasks'].extend(lst)
+        for t in self._extend('tasks', task, Task):
+            link_parent(t, self)
+
+    def add_async_tasks(self, task, timeout=None, delay=10, register=None):
+        """ Add tasks that all start at once and are then waited for
+        together.  Each task runs with async and poll: 0 and registers its
+        job, and a single async_status task follows that loops over the
+        jobs until all have finished, so slow provisioning (such as
+        creating servers and load balancers with wait=True) runs
+        concurrently rather than one task after another.
+
+        Tasks must not register results or run asynchronously already, and
+        must all run on the same host(s) (all as local_action, or all with
+        the same delegate_to), since async_status has to run where the job
+        did.  LoopTasks (see optimize) can be added too: each of their items
+        is a job.
+
+        :param task: Task object, or an iterable of Task objects
+        :param timeout: Seconds each task may run; defaults to the longest
+        wait_timeout of the tasks' modules plus a minute, or ten minutes
+        :param delay: Seconds between checks on the jobs
+        :param register: Prefix of the variables the jobs are registered
+        as; defaults to async_<n>, numbered per play
+        :return: The async_status Task, or None if there were no tasks
+        """
+        tasks = [task] if isinstance(task, Task) else list(task)
+        if not tasks:
+            return None
+        first = tasks[0]
+        host = (bool(first.local_action), first.task_args.get('delegate_to'))
+        timeouts = []
+        for t in tasks:
+            if isinstance(t, RawTask):
+                raise ValueError('Only tasks of modules can run '
+                                 'asynchronously')
+            if (bool(t.local_action), t.task_args.get('delegate_to')) != host:
+                raise ValueError('Async tasks must all run on the same hosts')
+            if any(k in t.task_args for k in ('register', 'async', 'poll')):
+                raise ValueError('Task %r already registers a result or runs '
+                                 'asynchronously' % t.module.display_name)
+            module_obj = t.module.as_obj()
+            wait = module_obj[next(iter(module_obj))].get('wait_timeout')
+            if wait is not None:
+                timeouts.append(int(wait))
+        if timeout is None:
+            timeout = (max(timeouts) + _ASYNC_MARGIN if timeouts
+                       else _ASYNC_TIMEOUT)
+        if register is None:
+            register = 'async_%d' % self._async_batches
+        self._async_batches += 1
+
+        jobs = []
+        for n, t in enumerate(tasks):
+            name = '%s_%d' % (register, n)
+            t.task_args.update([('async', timeout), ('poll', 0),
+                                ('register', name)])
+            t.invalidate()
+            if isinstance(t, LoopTask):
+                # with_items flattens each loop's results into its jobs
+                name += '.results'
+            jobs.append('{{ %s }}' % name)
+        status = register + '_status'
+        task_args = OrderedDict([
+            ('register', status),
+            ('until', status + '.finished'),
+            ('retries', timeout // delay + 1),
+            ('delay', delay),
+            ('with_items', jobs),
+        ])
+        if host[1] is not None:
+            task_args['delegate_to'] = host[1]
+        wait = Task(AsyncStatus('{{ item.ansible_job_id }}',
+                                display_name='Wait for %s' %
+                                first.module.display_name),
+                    host[0], **task_args)
+        self.add_task(tasks + [wait])
+        return wait
+
+    def hoist(self, args=None):
+        """ Move module arguments that have the same value in every task of
+        a module (by default its shared_args, such as credentials and
+        region) into this play's module_defaults, and leave them out of the
+        tasks.  Call it once the play's tasks are added: the defaults apply
+        to every task of the module in the play, so a task added afterwards
+        that doesn't set one of these arguments would get it too.  For the
+        same reason, modules that any RawTask runs are left alone.
+
+        :param args: Names of the arguments to consider, for every module;
+        defaults to each module class's shared_args
+        :return: Number of arguments moved to module_defaults
+        """
+        tasks = self._play.get('tasks')
+        if not tasks:
+            return 0
+        common = OrderedDict()
+        raw_modules = set()
+        for task in tasks:
+            if isinstance(task, RawTask):
+                raw_modules.update(task.module_names())
+                continue
+            members = task.tasks if isinstance(task, LoopTask) else [task]
+            for member in members:
+                module_obj = member.module.as_obj()
+                module_name = next(iter(module_obj))
+                values = module_obj[module_name]
+                names = args if args is not None else member.module.shared_args
+                found = dict((k, values[k]) for k in names if k in values)
+                if module_name not in common:
+                    common[module_name] = found
+                else:
+                    current = common[module_name]
+                    for key in list(current):
+                        if key not in found or found[key] != current[key]:
+                            del current[key]
+
+        module_defaults = self._play.get('module_defaults') or OrderedDict()
+        hoisted = 0
+        for module_name, found in common.items():
+            if module_name in raw_modules:
+                continue
+            defaults = module_defaults.get(module_name)
+            if defaults is None:
+                defaults = OrderedDict()
+            for key, value in found.items():
+                if key not in defaults:
+                    defaults[key] = value
+                    hoisted += 1
+            if defaults:
+                module_defaults[module_name] = defaults
+        if not hoisted:
+            return 0
+
+        for task in tasks:
+            if isinstance(task, RawTask):
+                continue
+            members = task.tasks if isinstance(task, LoopTask) else [task]
+            module_obj = members[0].module.as_obj()
+            task.defaults = module_defaults.get(next(iter(module_obj)))
+            task.invalidate()
+        # module_defaults goes before the tasks it applies to
+        self.set_key('module_defaults', module_defaults)
+        return hoisted
+
+    def set_key(self, key, value):
+        """ Set a play keyword, placing a new one before the tasks
+
+        :param key: Play keyword, e.g. 'vars' or 'serial'
+        :param value: Its value
+        """
+        if key in self._play or 'tasks' not in self._play:
+            self._play[key] = value
+        else:
+            play = OrderedDict()
+            for k, v in self._play.items():
+                if k == 'tasks':
+                    play[key] = value
+                play[k] = v
+            self._play = play
+        self.invalidate()
+
+    def plan(self, hosts=None, forks=5, rate=None, task_seconds=10.0,
+             calls_per_task=1, rolling=False, apply=True):
+        """ Choose this play's strategy, serial batches and throttle from
+        the number of hosts it runs on; see datemike.planner
+
+        :param hosts: Number of hosts; estimated from the play's hosts if
+        None (use Playbook.plan to count the hosts of add_host groups)
+        :param forks: Forks Ansible is run with
+        :param rate: Most API requests per second, or None for no limit
+        :param task_seconds: Seconds a task takes on one host
+        :param calls_per_task: API requests a task makes on one host
+        :param rolling: Go through the hosts in batches, starting with one
+        :param apply: Set the chosen keywords on the play, and remove those
+        the plan leaves at their defaults
+        :return: ConcurrencyPlan
+        """
+        from datemike import planner
+        if hosts is None:
+            hosts = planner.host_counts([self])[0]
+        result = planner.plan(hosts, planner.task_runs(self.as_obj()),
+                              forks, rate, task_seconds, calls_per_task,
+                              rolling)
+        if apply:
+            args = result.play_args()
+            for key in planner.PLAY_KEYWORDS:
+                if key in args:
+                    self.set_key(key, args[key])
+                elif key in self._play:
+                    # Left over from an earlier plan
+                    del self._play[key]
+                    self.invalidate()
+        return result
+
+    def optimize(self, min_run=2):
+        """ Fold each run of consecutive tasks that run the same module,
+        with the same name, task arguments and module argument names, into
+        a single LoopTask over with_items.  Ansible then runs one task in
+        place of many, and the playbook gets much smaller.
+
+        Tasks that register a result, or loop or retry already, are left
+        as they are, as are tasks whose arguments refer to a loop item.
+
+        :param min_run: Shortest run of tasks worth folding
+        :return: Number of tasks removed from the play
+        """
+        tasks = self._play.get('tasks')
+        if not tasks:
+            return 0
+        folded = []
+        run = []
+        run_key = None
+        for task in tasks + [None]:
+            key = None if task is None else _fold_key(task)
+            if (key is not None and key == run_key and
+                    task.task_args == run[0].task_args):
+                run.append(task)
+                continue
+            if len(run) >= max(min_run, 2):
+                loop = LoopTask(run)
+                for t in run:
+                    unlink_parent(t, self)
+                link_parent(loop, self)
+                folded.append(loop)
+            else:
+                folded.extend(run)
+            run = [] if task is None else [task]
+            run_key = key
+        removed = len(tasks) - len(folded)
+        if removed:
+            self._play['tasks'] = folded
+            self._changed.clear()
+            self.invalidate()
+        return removed
 
     def add_host(self, host):
-        """ Add host(s) to this play
+        """ Add host(s) to this play.  Hosts already in the play are not
+        added again.
 
-        :param host: A host as a string or hosts as a list of strings
+        :param host: A host as a string or hosts as a list, HostSet (or
+        other iterable) of strings
         """
-        if not self.play.get('hosts'):
-            self.play['hosts'] = []
-        if isinstance(host, str):
-            self.play['hosts'].append(host)
-        elif isinstance(host, list):
-            self.play['hosts'].extend(host)
+        if self._hosts is None:
+            hosts = self._play.get('hosts')
+            if isinstance(hosts, str):
+                self._play['hosts'] = hosts = [hosts]
+            self._hosts = HostSet(hosts or ())
+        added = self._hosts.update(host)
+        if added:
+            self._extend('hosts', added, str)
+
+    def host_set(self):
+        """ The hosts of this play
+
+        :return: HostSet (a copy; use add_host to change the play)
+        """
+        hosts = self._play.get('hosts') or ()
+        return HostSet(hosts)
 
     def add_role(self, role):
         """ Add role(s) to this play
 
-        :param role: A role as a string or roles as a list of strings
+        :param role: A role as a string or roles as a list (or other
+        iterable) of strings
         """
-        if not self.play.get('roles'):
-            self.play['roles'] = []
-        if isinstance(role, str):
-            self.play['roles'].append(role)
-        elif isinstance(role, list):
-            self.play['roles'].extend(role)
+        self._extend('roles', role, str)
 
     def as_obj(self):
         """ Get the object representation of a play
 
         :return: dict
         """
-        return self.play
+        if self._obj is None:
+            obj = OrderedDict()
+            for key, value in self._play.items():
+                if key == 'tasks':
+                    value = [t.as_obj() for t in value]
+                obj[key] = value
+            self._obj = obj
+        elif self._changed:
+            # Changed tasks rebuild their dicts in place
+            for task in self._changed:
+                task.as_obj()
+        self._changed.clear()
+        self._dirty = False
+        return self._obj
 
-    def to_yaml(self):
-        """ Get the YAML representation of a play
+    def fingerprint(self):
+        """ Hash of this play, combined from its tasks' fingerprints and
+        its other values, and kept until the play or any task changes.
+        Unlike hashing the rendered play, unchanged tasks cost nothing.
+
+        :return: str (hex digest)
+        """
+        if self._fingerprint is None:
+            parts = []
+            for key, value in self._play.items():
+                if key == 'tasks':
+                    parts.append(_combine(
+                        'tasks', *[t.fingerprint() for t in value]))
+                else:
+                    parts.append(utils.content_hash((key, value)))
+            self._fingerprint = _combine('play', *parts)
+        return self._fingerprint
+
+    def yaml_fragment(self, indent):
+        if self._fragments is None:
+            self._fragments = {}
+        try:
+            return self._fragments[indent]
+        except KeyError:
+            fragment = fast_yaml_entry(self._play, indent)
+            self._fragments[indent] = fragment
+            self._dirty = False
+            return fragment
 
+    def to_yaml(self, dedup=False):
+        """ Get the YAML representation of a play.  Only the tasks that
+        changed since the last call are rendered again.
+
+        :param dedup: Write repeated mappings and lists once, as a YAML
+        anchor, and then as aliases, and merge arguments that tasks share
+        in from one mapping (see utils.dedup)
+        :return: str
+        """
+        mode = (utils.default_engine, dedup)
+        if self._yaml is None or self._yaml[0] != mode:
+            text = None
+            if dedup:
+                text = pretty_yaml(utils.dedup(self.as_obj()))
+            elif mode[0] == 'auto':
+                text = fast_yaml(self._play)
+            if text is None:
+                text = pretty_yaml(self.as_obj())
+            self._yaml = (mode, text)
+            self._dirty = False
+        return self._yaml[1]
+
+    def to_json(self, indent=None):
+        """ Get the JSON representation of a play, which Ansible also reads
+        as YAML.  Compact JSON is kept until the play changes.
+
+        :param indent: Spaces to indent by; compact if None
         :return: str
         """
-        return pretty_yaml(self.play)
+        if indent is not None:
+            return pretty_json(self.as_obj(), indent=indent)
+        if self._json is None:
+            self._json = pretty_json(self.as_obj())
+        return self._json
+
+
+class _TasksMarker(Fragment):
+    """ Placeholder for the tasks of a play whose tasks are rendered
+    separately
+    """
+    def __init__(self):
+        self.indent = None
+
+    def yaml_fragment(self, indent):
+        self.indent = indent
+        return _TASKS_MARKER, frozenset()
+
+
+def _play_shell(play):
+    """ Render a play with its tasks left out
+
+    :param play: play as a dict
+    :return: tuple of (text before the tasks, text after the tasks, indent
+    of the tasks), or None if the play can't be rendered this way
+    """
+    marker = _TasksMarker()
+    shell = OrderedDict(play)
+    shell['tasks'] = [marker]
+    rendered = fast_yaml_entry(shell, 0)
+    if rendered is None or marker.indent is None:
+        return None
+    head, tail = rendered[0].split(_TASKS_MARKER)
+    return head, tail, marker.indent
+
+
+def _split_plays(plays, shards):
+    """ Split plays into at most shards runs of about the same number of
+    tasks, in order
+
+    :param plays: list of Play objects
+    :param shards: int
+    :return: list of lists of plays
+    """
+    weights = [1 + len(p._play.get('tasks') or ()) for p in plays]
+    total = sum(weights)
+    groups = []
+    group = []
+    done = 0
+    for play, weight in zip(plays, weights):
+        group.append(play)
+        done += weight
+        if (len(groups) < shards - 1 and
+                done * shards >= total * (len(groups) + 1)):
+            groups.append(group)
+            group = []
+    if group:
+        groups.append(group)
+    return groups
+
+
+def _render_job(job):
+    """ Render one piece of a playbook; runs in a worker process
+
+    :param job: ('tasks', list of tasks, indent) or ('plays', list of
+    plays, engine, dedup, anchor template)
+    :return: str (YAML), or None if the tasks need anchors
+    """
+    if job[0] == 'tasks':
+        return fast_yaml_entries(job[1], job[2])
+    plays, engine, dedup, anchors = job[1:]
+    if dedup:
+        plays = utils.dedup(plays)
+    return pretty_yaml(plays, engine=engine, anchors=anchors)
+
+
+def _run_jobs(jobs, processes):
+    """ Render jobs in worker processes
+
+    :param jobs: list of jobs for _render_job
+    :param processes: Number of worker processes; None for one per CPU
+    :return: generator of the results, in the order of jobs
+    """
+    if processes == 1:
+        for job in jobs:
+            yield _render_job(job)
+        return
+    import multiprocessing
+    pool = multiprocessing.Pool(processes)
+    try:
+        for text in pool.imap(_render_job, jobs):
+            yield text
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+class _Manifest(object):
+    def __init__(self, directory):
+        """ Content hashes of the files written to a directory, kept in a
+        small JSON file (MANIFEST) next to them
+
+        :param directory: Directory of the output files
+        """
+        import json
+        self.path = os.path.join(directory, MANIFEST)
+        self.changed = False
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.entries = {}
+
+    def current(self, filepath, digest):
+        """ Whether filepath is still as it was written for digest """
+        entry = self.entries.get(os.path.basename(filepath))
+        if not entry or entry.get('hash') != digest:
+            return False
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return False
+        return [stat.st_size, stat.st_mtime] == entry.get('stat')
+
+    def record(self, filepath, digest):
+        stat = os.stat(filepath)
+        self.entries[os.path.basename(filepath)] = {
+            'hash': digest, 'stat': [stat.st_size, stat.st_mtime]}
+        self.changed = True
+
+    def save(self):
+        if self.changed:
+            import json
+            with utils.atomic_write(self.path) as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+            self.changed = False
 
 
 class Playbook(object):
     def __init__(self):
         """ A playbook is a list of Ansible Plays, following the Ansible
-        Task < Play < Playbook hierarchy.
+        Task < Play < Playbook hierarchy.  Plays are held as Play objects
+        and only turned into dicts when the playbook is rendered.
         """
-        self.playbook = []
+        self._plays = []
+        self._yaml = None
 
     def __str__(self):
         return self.to_yaml()
 
+    @property
+    def playbook(self):
+        """ The playbook as a read-only tuple of dicts; use add_play() to
+        add a play
+        """
+        return tuple(self.as_obj())
+
+    def _child_changed(self, play):
+        self.invalidate()
+
+    def invalidate(self):
+        """ Drop this playbook's rendered YAML.  Called automatically when
+        its plays change.
+        """
+        self._yaml = None
+
     def add_play(self, play):
         """ Add a play to this playbook
 
-        :param play: Play object or list of play objects
+        :param play: Play object, or a list, generator or other iterable of
+        play objects
         """
         if isinstance(play, Play):
-            self.playbook.append(play.as_obj())
-        elif isinstance(play, list):
-            lst = [p.as_obj() for p in play]
-            self.playbook.extend(lst)
+            play = [play]
+        for p in play:
+            self._plays.append(p)
+            link_parent(p, self)
+        self.invalidate()
 
     def as_obj(self):
         """ Get the object representation of this playbook
 
         :return: list
         """
-        return self.playbook
+        return [p.as_obj() for p in self._plays]
 
-    def to_yaml(self):
-        """ Get the YAML representation of this playbook
+    def fingerprint(self):
+        """ Hash of this playbook, combined from its plays' fingerprints
 
+        :return: str (hex digest)
+        """
+        return _combine('playbook', *[p.fingerprint() for p in self._plays])
+
+    @classmethod
+    def from_yaml_file(cls, filepath):
+        """ Read a playbook back into Play and Task objects, one play at a
+        time; see datemike.loader.iter_plays
+
+        :param filepath: Filepath as a string, or an open file object
+        :return: Playbook
+        """
+        from datemike.loader import iter_plays
+        book = cls()
+        book.add_play(iter_plays(filepath))
+        return book
+
+    def hoist(self, args=None):
+        """ Hoist shared module arguments into each play's module_defaults;
+        see Play.hoist
+
+        :param args: Names of the arguments to consider
+        :return: Number of arguments moved to module_defaults
+        """
+        return sum(play.hoist(args) for play in self._plays)
+
+    def plan(self, forks=5, rate=None, task_seconds=10.0, calls_per_task=1,
+             rolling=False, apply=True):
+        """ Choose each play's concurrency settings; see Play.plan.  Host
+        counts include the servers earlier plays create and add to groups.
+
+        :return: list of ConcurrencyPlan, one per play
+        """
+        from datemike.planner import host_counts
+        return [play.plan(hosts, forks, rate, task_seconds, calls_per_task,
+                          rolling, apply)
+                for play, hosts in zip(self._plays,
+                                       host_counts(self._plays))]
+
+    def to_json(self, indent=None):
+        """ Get the JSON representation of this playbook, which Ansible
+        also reads as YAML.  Compact JSON is built from each play's, so only
+        the plays that changed since the last call are encoded again.
+
+        :param indent: Spaces to indent by; compact if None
+        :return: str
+        """
+        if indent is not None:
+            return pretty_json(self.as_obj(), indent=indent)
+        return '[%s]' % ','.join(p.to_json() for p in self._plays)
+
+    def to_json_file(self, filepath, indent=None):
+        """ Write this playbook to disk as JSON, one play at a time.  The
+        file is replaced atomically.
+
+        :param filepath: Filepath as a string
+        :param indent: Spaces to indent by; compact if None
+        """
+        if indent is not None:
+            with utils.atomic_write(filepath) as f:
+                f.write(self.to_json(indent) + '\n')
+            return
+        with utils.atomic_write(filepath) as f:
+            f.write('[')
+            for i, play in enumerate(self._plays):
+                if i:
+                    f.write(',')
+                f.write(play.to_json())
+            f.write(']\n')
+
+    def to_yaml(self, dedup=False):
+        """ Get the YAML representation of this playbook.  Only the plays
+        and tasks that changed since the last call are rendered again.
+
+        :param dedup: Write repeated mappings and lists once, as a YAML
+        anchor, and then as aliases, and merge arguments that tasks share
+        in from one mapping (see utils.dedup)
         :return: str
         """
-        return pretty_yaml(self.playbook)
+        mode = (utils.default_engine, dedup)
+        if self._yaml is None or self._yaml[0] != mode:
+            text = None
+            if dedup:
+                text = pretty_yaml(utils.dedup(self.as_obj()))
+            elif mode[0] == 'auto':
+                text = fast_yaml(self._plays)
+            if text is None:
+                text = pretty_yaml(self.as_obj())
+            self._yaml = (mode, text)
+        return self._yaml[1]
+
+    def _digest(self, plays, *options):
+        """ Content hash of the output for some of this playbook's plays,
+        written with the given options
+        """
+        import hashlib
+        digest = hashlib.sha1(repr((MANIFEST_FORMAT, utils.default_engine) +
+                                   options).encode('utf-8'))
+        for play in plays:
+            digest.update(play.fingerprint().encode('ascii'))
+        return digest.hexdigest()
 
-    def to_yaml_file(self, filepath):
-        """ Write this playbook to disk
+    def to_yaml_file(self, filepath, dedup=False, processes=None,
+                     incremental=False):
+        """ Write this playbook to disk.  The file is replaced atomically,
+        so readers see either the old or the new playbook.
 
         :param filepath: Filepath as a string
+        :param dedup: Write repeated mappings and lists as YAML aliases,
+        and shared arguments as merges (see utils.dedup)
+        :param processes: Render plays, and large plays in chunks of tasks,
+        in this many worker processes (see to_yaml_files).  The file is the
+        same for any number of processes, and the same as to_yaml except
+        that objects shared between plays are written out again rather
+        than as aliases, and anchors are named per play.
+        :param incremental: Skip rendering and writing if the plays haven't
+        changed since the file was last written with incremental=True,
+        going by content hashes kept in a manifest file in the same
+        directory
+        :return: True if the file was written, False if it was up to date
         """
         filepath = os.path.abspath(os.path.expanduser(filepath))
-        with open(filepath, 'w') as f:
-            pretty_yaml(self.playbook, f)
+        if incremental:
+            manifest = _Manifest(os.path.dirname(filepath))
+            digest = self._digest(self._plays, dedup, processes is None)
+            if manifest.current(filepath, digest):
+                return False
+        with utils.atomic_write(filepath) as f:
+            if processes is None:
+                f.write(self.to_yaml(dedup))
+            else:
+                for text in self._render_parallel(dedup, processes):
+                    f.write(text)
+        if incremental:
+            manifest.record(filepath, digest)
+            manifest.save()
+        return True
+
+    def _render_parallel(self, dedup, processes):
+        """ Render this playbook in worker processes
+
+        :return: generator of str (YAML), to be written in order
+        """
+        engine = utils.default_engine
+        if not self._plays:
+            yield pretty_yaml([], engine=engine)
+            return
+        plan = []
+        jobs = []
+        for i, play in enumerate(self._plays):
+            obj = play.as_obj()
+            anchors = 'id%03d' if i == 0 else 'id%d_%%03d' % i
+            tasks = obj.get('tasks')
+            shell = None
+            if (engine == 'auto' and not dedup and
+                    isinstance(tasks, list) and len(tasks) > _TASK_CHUNK):
+                shell = _play_shell(obj)
+            if shell is None:
+                plan.append((obj, anchors, None, 1))
+                jobs.append(('plays', [obj], engine, dedup, anchors))
+            else:
+                chunks = range(0, len(tasks), _TASK_CHUNK)
+                plan.append((obj, anchors, shell, len(chunks)))
+                jobs.extend(('tasks', tasks[n:n + _TASK_CHUNK], shell[2])
+                            for n in chunks)
+        results = _run_jobs(jobs, processes)
+        for obj, anchors, shell, count in plan:
+            pieces = [next(results) for _ in range(count)]
+            if None in pieces:
+                # Tasks sharing objects need anchors, so render them together
+                yield pretty_yaml([obj], engine=engine, anchors=anchors)
+            elif shell is None:
+                yield pieces[0]
+            else:
+                yield shell[0]
+                for text in pieces:
+                    yield text
+                yield shell[1]
+
+    def to_yaml_files(self, directory, shards, processes=None,
+                      index='site.yml', dedup=False, incremental=False):
+        """ Write this playbook as up to `shards` playbooks, rendered in
+        worker processes, and an index playbook importing them in order.
+        Plays are split between the shards by number of tasks, so the files
+        depend only on the number of shards, not on the number of
+        processes.
+
+        :param directory: Directory to write to; created if missing
+        :param shards: Maximum number of playbooks to split the plays into
+        :param processes: Number of worker processes; defaults to one per CPU
+        :param index: Filename of the index; shards are named after it, as
+        site-000.yml, site-001.yml, etc.
+        :param dedup: Write repeated mappings and lists within each shard as
+        YAML aliases, and shared arguments as merges
+        :param incremental: Only render and write the files whose plays
+        changed since they were last written with incremental=True (see
+        to_yaml_file); every file is replaced atomically
+        :return: list of the playbook's filepaths, index first
+        """
+        directory = os.path.abspath(os.path.expanduser(directory))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        engine = utils.default_engine
+        groups = _split_plays(self._plays, shards)
+        stem = os.path.splitext(index)[0]
+        names = ['%s-%03d.yml' % (stem, n) for n in range(len(groups))]
+        paths = [os.path.join(directory, name) for name in [index] + names]
+        manifest = _Manifest(directory) if incremental else None
+        pending = []
+        for path, group in zip(paths[1:], groups):
+            digest = self._digest(group, dedup) if incremental else None
+            if not incremental or not manifest.current(path, digest):
+                pending.append((path, group, digest))
+        jobs = [('plays', [p.as_obj() for p in group], engine, dedup, None)
+                for _, group, _ in pending]
+        for (path, _, digest), text in zip(pending,
+                                           _run_jobs(jobs, processes)):
+            with utils.atomic_write(path) as f:
+                f.write(text)
+            if incremental:
+                manifest.record(path, digest)
+        imports = [OrderedDict(import_playbook=name) for name in names]
+        digest = utils.content_hash((MANIFEST_FORMAT, engine, imports))
+        if not incremental or not manifest.current(paths[0], digest):
+            with utils.atomic_write(paths[0]) as f:
+                f.write(pretty_yaml(imports, engine=engine))
+            if incremental:
+                manifest.record(paths[0], digest)
+                manifest.save()
+        return paths
+
+    def stream_to(self, file_, format='yaml'):
+        """ Stream this playbook to disk, followed by any plays added to the
+        returned writer
+
+        :param file_: Filepath as a string or an open, writable file object
+        :param format: 'yaml' or 'json'
+        :return: PlaybookWriter
+        """
+        writer = PlaybookWriter(file_, format)
+        writer.prelude = list(self._plays)
+        return writer
+
+
+class PlaybookWriter(object):
+    # Stream class of each output format
+    FORMATS = {'yaml': YamlStream, 'json': JsonStream}
+
+    def __init__(self, file_, format='yaml'):
+        """ Write a playbook to disk one play (or one task) at a time, so
+        memory use does not grow with the size of the playbook. Use as a
+        context manager:
+
+            with PlaybookWriter('site.yml') as writer:
+                writer.add_play(plays_generator())
+                with writer.play(Play('Build servers')) as play:
+                    play.add_task(tasks_generator())
+
+        The output is the same as Playbook.to_yaml for the same plays,
+        except that objects shared between separately written plays or
+        tasks are written out again rather than as YAML aliases.  With
+        format='json' it is the same as Playbook.to_json_file.  If the
+        with block raises, the writer is aborted rather than closed.
+
+        :param file_: Filepath as a string or an open, writable file object
+        :param format: 'yaml' or 'json'
+        """
+        if format not in self.FORMATS:
+            raise ValueError('Unknown playbook format: %s' % format)
+        self.file_ = file_
+        self.format = format
+        self.prelude = []
+        self._f = None
+        self._stream = None
+        self._open_play = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def open(self):
+        """ Open the output file and start the playbook """
+        if isinstance(self.file_, str):
+            filepath = os.path.abspath(os.path.expanduser(self.file_))
+            self._f = open(filepath, 'w')
+            self._stream = self.FORMATS[self.format](self._f)
+        else:
+            self._stream = self.FORMATS[self.format](self.file_)
+        self._stream.open()
+        self._stream.start_sequence()
+        for play in self.prelude:
+            self._stream.write(play.as_obj())
+
+    def close(self):
+        """ Finish the playbook and close the output file if it was opened
+        by this writer
+        """
+        if self._open_play is not None:
+            self._open_play.close()
+        self._stream.end_sequence()
+        self._stream.close()
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def abort(self):
+        """ Stop writing without finishing the playbook, so that what was
+        written doesn't pass for a complete one: an output file opened by
+        this writer is closed and removed, and nothing more is written to
+        a file object it was given.
+        """
+        self._open_play = None
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+            os.remove(os.path.abspath(os.path.expanduser(self.file_)))
+
+    def add_play(self, play):
+        """ Write a play, or every play from a list or generator of plays
+
+        :param play: Play object or iterable of play objects
+        """
+        if self._open_play is not None:
+            raise ValueError('Cannot add a play while another play is open')
+        if isinstance(play, Play):
+            self._stream.write(play.as_obj())
+        else:
+            for p in play:
+                self._stream.write(p.as_obj())
+
+    def play(self, play):
+        """ Start writing a play whose tasks are added afterwards
+
+        :param play: Play object; tasks it already holds are written first
+        :return: PlayWriter
+        """
+        if self._open_play is not None:
+            raise ValueError('Cannot add a play while another play is open')
+        self._open_play = PlayWriter(self, play)
+        return self._open_play
+
+
+class PlayWriter(object):
+    def __init__(self, writer, play):
+        """ Streams the tasks of a single play; created by
+        PlaybookWriter.play()
+
+        :param writer: PlaybookWriter this play is written to
+        :param play: Play object
+        """
+        self.writer = writer
+        self._stream = writer._stream
+        # Tasks already in the play are built and written one at a time
+        play_obj = self._play_obj = play._play
+        keys = list(play_obj.keys())
+        if 'tasks' in play_obj:
+            index = keys.index('tasks')
+        else:
+            index = len(keys)
+        # Everything else is written when the play is closed, including
+        # keys added to the play meanwhile
+        self._written = set(keys[:index])
+        self._written.add('tasks')
+        self._tasks_started = False
+
+        self._stream.start_mapping()
+        for key in keys[:index]:
+            self._stream.write(key)
+            self._stream.write(play_obj[key])
+        if 'tasks' in play_obj:
+            self._start_tasks()
+            for task in play_obj['tasks']:
+                self._stream.write(task.as_obj())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _start_tasks(self):
+        self._stream.write('tasks')
+        self._stream.start_sequence()
+        self._tasks_started = True
+
+    def add_task(self, task):
+        """ Write a task, or every task from a list or generator of tasks
+
+        :param task: Task object or iterable of task objects
+        """
+        if self.writer._open_play is not self:
+            raise ValueError('This play has already been closed')
+        if isinstance(task, Task):
+            task = [task]
+        for t in task:
+            if not self._tasks_started:
+                self._start_tasks()
+            self._stream.write(t.as_obj())
+
+    def close(self):
+        """ Finish the play; called automatically when used as a context
+        manager
+        """
+        if self.writer._open_play is not self:
+            return
+        if self._tasks_started:
+            self._stream.end_sequence()
+        for key, value in self._play_obj.items():
+            if key not in self._written:
+                self._stream.write(key)
+                self._stream.write(value)
+        self._stream.end_mapping()
+        self.writer._open_play = None
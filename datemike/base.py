@@ -17,10 +17,174 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from datemike.utils import pretty_yaml
+import gc
+from operator import attrgetter
 
+from datemike.utils import content_hash, pretty_json, pretty_yaml
+
+
+# Argument tables for each module class, keyed by the attribute layout of
+# its instances; see ModuleBase._arg_table()
+_arg_tables = {}
+# attrgetter fetching every attribute of an argument table at once
+_arg_getters = {}
+# Attributes that hold the constructed module rather than its arguments
+_cache_attrs = frozenset(['module', 'module_args', '_parents',
+                          '_fingerprint'])
+# The one copy of each argument value passed through shared(), keyed by
+# type and value so that 1 and True stay apart
+_flyweights = {}
+
+
+def _slots(cls):
+    """ Names declared in the __slots__ of cls itself (not its bases) """
+    slots = cls.__dict__.get('__slots__', ())
+    if isinstance(slots, str):
+        return (slots,)
+    return slots
+
+
+def shared(value):
+    """ The single object used for all values equal to value, so arguments
+    repeated across thousands of modules (credentials, regions and the
+    like) are held in memory once
+
+    :param value: Argument value; unhashable values are returned as is
+    :return: object equal to value
+    """
+    if value is None:
+        return None
+    try:
+        return _flyweights.setdefault((type(value), value), value)
+    except TypeError:
+        return value
+
+
+def _rows(columns):
+    """ Turn a dict of equal-length columns (lists, tuples or NumPy arrays)
+    into one dict of keyword arguments per row
+
+    :param columns: dict mapping argument names to sequences of values
+    :return: generator of dicts
+    """
+    names = list(columns)
+    values = []
+    for name in names:
+        column = columns[name]
+        # NumPy arrays convert to lists of native Python scalars, which is
+        # both faster to iterate and what the YAML emitters understand
+        tolist = getattr(column, 'tolist', None)
+        values.append(tolist() if tolist is not None else column)
+    lengths = set(len(column) for column in values)
+    if len(lengths) > 1:
+        raise ValueError('Columns must all have the same length')
+    for row in zip(*values):
+        yield dict(zip(names, row))
+
+
+def link_parent(child, parent):
+    """ Record that parent (a Task, Play or Playbook) contains child, so
+    child can tell it when it changes.  A single parent is stored as is to
+    keep the common case small.
+    """
+    parents = child._parents
+    if parents is None:
+        child._parents = parent
+    elif type(parents) is list:
+        parents.append(parent)
+    else:
+        child._parents = [parents, parent]
+
+
+def unlink_parent(child, parent):
+    """ Undo one link_parent(child, parent) """
+    parents = child._parents
+    if parents is parent:
+        child._parents = None
+    elif type(parents) is list and parent in parents:
+        parents.remove(parent)
+        if len(parents) == 1:
+            child._parents = parents[0]
+
+
+def parents_of(child):
+    """ Parents recorded by link_parent()
+
+    :return: list
+    """
+    parents = child._parents
+    if parents is None:
+        return []
+    if type(parents) is list:
+        return parents
+    return [parents]
+
+
+class _gc_paused(object):
+    """ Pause the cyclic garbage collector while building many objects at
+    once.  Modules and the tasks wrapping them are long-lived, so the
+    collections their allocations would trigger only cost time.
+    """
+    def __enter__(self):
+        self.enabled = gc.isenabled()
+        gc.disable()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.enabled:
+            gc.enable()
+
+
+def _setattr_tracking(self, name, value):
+    """ ModuleBase.__setattr__: once the module dict has been built, setting
+    an argument throws it away and tells the tasks holding the module
+    """
+    object.__setattr__(self, name, value)
+    if name not in _cache_attrs and \
+            getattr(self, 'module', None) is not None:
+        self.invalidate()
+
+
+class _ModuleType(type):
+    """ Metaclass of module classes.  Each class gets a twin subclass
+    without the tracking __setattr__, and instances are constructed as the
+    twin and switched to the class itself once __init__ returns, so the
+    attribute writes of constructors cost no more than on a plain object.
+    Classes with their own __setattr__ are constructed as usual.
+    """
+    def __init__(cls, name, bases, namespace):
+        super(_ModuleType, cls).__init__(name, bases, namespace)
+        if '_tracked' in namespace:
+            return
+        untracked = cls
+        if cls.__setattr__ is _setattr_tracking:
+            untracked = type(cls)(name, (cls,), {
+                '__slots__': (),
+                '__module__': cls.__module__,
+                '__qualname__': cls.__qualname__,
+                '__setattr__': object.__setattr__,
+                '_tracked': cls,
+            })
+        type.__setattr__(cls, '_constructing', untracked)
+
+    def __call__(cls, *args, **kwargs):
+        obj = type.__call__(cls._constructing, *args, **kwargs)
+        obj.__class__ = cls
+        return obj
+
+
+class ModuleBase(object, metaclass=_ModuleType):
+    # Subclasses may declare __slots__ for their arguments so instances
+    # carry no __dict__; subclasses that don't declare them work as before
+    __slots__ = ('module', 'module_args', 'module_name', 'display_name',
+                 '_parents', '_fingerprint')
+
+    # Attributes starting with this prefix are passed along as module
+    # arguments, with the prefix removed
+    arg_prefix = 'mod_'
+    # Arguments that tend to be the same for every use of the module, which
+    # Play.hoist() moves into the play's module_defaults
+    shared_args = ()
 
-class ModuleBase(object):
     def __init__(self):
         """ Base class for module implementations
         Subclasses must implement the module_name and display_name attributes
@@ -30,41 +194,135 @@ class ModuleBase(object):
         This class' reason for existing is to assign arguments to an Ansible
         module, provide a Python representation of the module/args, and to dump
         the YAML representation of the object.
+        The module and module_args dicts are only created by _make_dict(),
+        and setting any attribute afterwards throws them away again (and
+        marks the tasks wrapping this module as changed).
 
         """
-        self.module = dict()
-        self.module_args = dict()
+        self.module = None
+        self.module_args = None
         self.module_name = None
         self.display_name = None
+        self._parents = None
+        self._fingerprint = None
+
+    __setattr__ = _setattr_tracking
+
+    def __setstate__(self, state):
+        # Restore without triggering invalidation
+        if isinstance(state, tuple):
+            state, slots = state
+        else:
+            slots = None
+        if state:
+            self.__dict__.update(state)
+        for name, value in (slots or {}).items():
+            object.__setattr__(self, name, value)
+
+    def invalidate(self):
+        """ Discard the constructed module so it is rebuilt from the
+        object's attributes on next use, and tell the tasks wrapping it.
+        Called automatically when an attribute is set; call it directly
+        after changing an argument value in place (e.g. appending to a
+        list).
+        """
+        self.module = None
+        self.module_args = None
+        self._fingerprint = None
+        for parent in parents_of(self):
+            parent._child_changed(self)
+
+    @classmethod
+    def bulk(cls, columns, **constants):
+        """ Build one module object per row of column-oriented input
+
+            CloudDnsRecord.bulk({'fqdn': names, 'data': addresses},
+                                domain_name='example.com', region='IAD')
+
+        :param columns: dict mapping constructor argument names to lists,
+        tuples or NumPy arrays of equal length
+        :param constants: constructor arguments shared by every object; the
+        same value object is reused rather than copied
+        :return: list of module objects
+        """
+        with _gc_paused():
+            return list(cls._iter_bulk(columns, constants))
+
+    @classmethod
+    def _iter_bulk(cls, columns, constants):
+        """ The objects of bulk(), one at a time.  They are constructed as
+        the untracked twin directly, without going through the metaclass.
+        """
+        construct = type.__call__
+        untracked = cls._constructing
+        for row in _rows(columns):
+            row.update(constants)
+            obj = construct(untracked, **row)
+            if untracked is not cls:
+                obj.__class__ = cls
+            yield obj
 
     def __str__(self):
         """ String of ModuleBase
         :return: A pretty-formatted YAML representation of the module
         """
-        return pretty_yaml(self.module)
+        return self.to_yaml()
+
+    def _arg_table(self):
+        """ Pairs of (attribute, module argument) for every attribute on
+        this object prefaced with arg_prefix, slots first (base classes
+        first) and then instance attributes in the order they were set.
+        The table is computed once per class and attribute layout, so
+        building the module dictionary of further instances does no string
+        work.
+
+        :return: tuple
+        """
+        attrs = getattr(self, '__dict__', None)
+        layout = tuple(attrs) if attrs else ()
+        cls = type(self)
+        tables = _arg_tables.setdefault(cls, {})
+        try:
+            return tables[layout]
+        except KeyError:
+            prefix = self.arg_prefix
+            names = [name for klass in reversed(cls.__mro__)
+                     for name in _slots(klass)]
+            names.extend(attr for attr in layout if attr not in names)
+            table = tuple((attr, attr[len(prefix):]) for attr in names
+                          if attr.startswith(prefix))
+            tables[layout] = table
+            return table
 
     def _make_dict(self):
         """ Constructs the module dictionary from attributes defined on the
         object, but only adds arguments for the module if attributes are
-        prefaced with 'mod_'.
+        prefaced with arg_prefix ('mod_').
         """
-        for prop, val in vars(self).items():
-            try:
-                split_ = prop.split('_')
-                head = split_[0]
-                key = "_".join(split_[1:])
-            except IndexError:
-                    continue
-            else:
-                if head == 'mod' and val is not None:
-                    self.module_args[key] = val
-        self.module[self.module_name] = self.module_args
+        args = self.module_args = dict()
+        table = self._arg_table()
+        try:
+            getter = _arg_getters[table]
+        except KeyError:
+            getter = _arg_getters[table] = attrgetter(
+                *[attr for attr, key in table]) if table else None
+        try:
+            values = getter(self) if getter is not None else ()
+            if len(table) == 1:
+                values = (values,)
+        except AttributeError:
+            # A slot that was never assigned
+            values = [getattr(self, attr, None) for attr, key in table]
+        for (attr, key), val in zip(table, values):
+            if val is not None:
+                args[key] = val
+        self.module = {self.module_name: args}
 
     def as_obj(self):
         """ Representation of the constructed module as a dict
         :return: dict
         """
-        if not self.module:
+        if self.module is None:
             self._make_dict()
         return self.module
 
@@ -72,6 +330,27 @@ class ModuleBase(object):
         """ Representation of the constructed module as YAML string
         :return: str
         """
-        if not self.module:
+        if self.module is None:
             self._make_dict()
         return pretty_yaml(self.module)
+
+    def fingerprint(self):
+        """ Hash of the module's name, display name and arguments, kept
+        until the module changes.  Arguments are hashed by name, so the
+        order they were set in doesn't matter; see utils.content_hash.
+
+        :return: str (hex digest)
+        """
+        if self._fingerprint is None:
+            self._fingerprint = content_hash((self.display_name,
+                                              self.as_obj()))
+        return self._fingerprint
+
+    def to_json(self, indent=None):
+        """ Representation of the constructed module as JSON string
+        :param indent: Spaces to indent by; compact if None
+        :return: str
+        """
+        if self.module is None:
+            self._make_dict()
+        return pretty_json(self.module, indent=indent)
@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of datemike: https://github.com/angstwad/datemike
+#
+# Copyright 2014 Paul Durivage
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Command line tool turning rows of a fleet export into a playbook, one task
+per row:
+
+    datemike --module CloudServer --map name=hostname --group-by region \
+        servers.csv > site.yml
+
+Rows are JSON objects, one per line, or CSV with a header line, read from
+a file or stdin.  Each row's columns are the keyword arguments of a module
+class from datemike.providers (given by class name, such as CloudServer,
+or by Ansible module name, such as rax); --map takes an argument from a
+differently named column and --drop leaves a column out.  Empty CSV cells
+are left out, so the argument keeps its default; CSV values are otherwise
+strings, so use JSON lines for numbers, lists and booleans.
+
+A new play starts whenever the --group-by column's value changes and after
+every --play-size tasks.  Rows are read, written and dropped one at a
+time, so memory use doesn't grow with the input; to get one play per
+group, sort the input by that column first.
+"""
+
+import argparse
+import csv
+import json
+import sys
+
+from datemike import providers
+from datemike.ansible import Play, PlaybookWriter, Task
+
+INPUT_FORMATS = ('jsonl', 'csv')
+
+
+def _jsonl_rows(f):
+    for line_no, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            raise ValueError('line %d: %s' % (line_no, e))
+        if not isinstance(row, dict):
+            raise ValueError('line %d: every row must be a JSON object' %
+                             line_no)
+        yield line_no, row
+
+
+def _csv_rows(f):
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if header is None:
+        return
+    width = len(header)
+    for row in reader:
+        if not row:
+            continue
+        if len(row) != width:
+            raise ValueError('line %d: %d fields, expected %d' %
+                             (reader.line_num, len(row), width))
+        yield reader.line_num, dict((key, value)
+                                    for key, value in zip(header, row)
+                                    if value != '')
+
+
+def read_rows(f, format='jsonl'):
+    """ Rows of an export, one at a time
+
+    :param f: Open file object
+    :param format: 'jsonl' or 'csv'
+    :return: generator of (line number, dict of column to value)
+    """
+    if format == 'jsonl':
+        return _jsonl_rows(f)
+    if format == 'csv':
+        return _csv_rows(f)
+    raise ValueError('Unknown input format: %s' % format)
+
+
+def module_class(name):
+    """ A provider's module class, by class name or Ansible module name
+
+    :param name: Such as 'CloudServer' or 'rax'
+    :return: ModuleBase subclass
+    """
+    if name in providers.CLASSES:
+        return getattr(providers, name)
+    cls = providers.module_class(name)
+    if cls is None:
+        raise ValueError('No provider has a module class named %s' % name)
+    return cls
+
+
+class RowMapper(object):
+    def __init__(self, cls, columns=None, drop=(), group_by=None,
+                 local_action=True, task_args=None):
+        """ Builds a task from each row of an export
+
+        :param cls: Module class
+        :param columns: dict of constructor argument to the column holding
+        it, for columns not named after their argument
+        :param drop: Columns that aren't module arguments
+        :param group_by: Column whose value names the play; it is passed to
+        the module too, unless dropped
+        :param local_action: Whether tasks are local actions
+        :param task_args: dict of task arguments added to every task
+        """
+        self.cls = cls
+        self.columns = dict((column, arg) for arg, column in
+                            (columns or {}).items())
+        self.drop = frozenset(drop)
+        self.group_by = group_by
+        self.local_action = local_action
+        self.task_args = task_args or {}
+
+    def task(self, row):
+        """ Build the task for a row
+
+        :param row: dict of column to value
+        :return: Task
+        """
+        kwargs = {}
+        for column, value in row.items():
+            if column not in self.drop:
+                kwargs[self.columns.get(column, column)] = value
+        try:
+            module = self.cls(**kwargs)
+        except TypeError as e:
+            raise ValueError('%s: %s' % (self.cls.__name__, e))
+        return Task(module, self.local_action, **self.task_args)
+
+    def group(self, row):
+        """ The row's value of the group_by column, or None """
+        if self.group_by is None:
+            return None
+        return row.get(self.group_by)
+
+
+def stream(rows, mapper, file_, name='Provision', hosts='localhost',
+           play_size=0, format='yaml'):
+    """ Write a playbook with a task for each row, without keeping rows or
+    tasks around once written
+
+    :param rows: Iterable of (line number, row), as from read_rows()
+    :param mapper: RowMapper
+    :param file_: Open, writable file object or filepath
+    :param name: Play name; with grouping, the group's value is appended
+    :param hosts: Hosts of every play
+    :param play_size: Most tasks per play, or 0 for no limit
+    :param format: 'yaml' or 'json'
+    :return: int, number of rows written
+    """
+    count = 0
+    # The writer is aborted if a row fails, so a failed run doesn't leave
+    # output that looks complete
+    play = None
+    group = in_play = None
+    with PlaybookWriter(file_, format) as writer:
+        for line_no, row in rows:
+            try:
+                task = mapper.task(row)
+            except ValueError as e:
+                raise ValueError('line %d: %s' % (line_no, e))
+            row_group = mapper.group(row)
+            if play is None or row_group != group or \
+                    (play_size and in_play >= play_size):
+                if play is not None:
+                    play.close()
+                play_name = name
+                if row_group is not None:
+                    play_name = '%s: %s' % (name, row_group)
+                play = writer.play(Play(play_name, hosts=hosts))
+                group = row_group
+                in_play = 0
+            play.add_task(task)
+            in_play += 1
+            count += 1
+    return count
+
+
+def _pair(text):
+    key, sep, value = text.partition('=')
+    if not sep or not key:
+        raise argparse.ArgumentTypeError('expected KEY=VALUE, got %r' % text)
+    return key, value
+
+
+def parser():
+    parser = argparse.ArgumentParser(
+        prog='datemike',
+        description='Stream rows of JSON lines or CSV into a playbook, '
+                    'one task per row.')
+    parser.add_argument('input', nargs='?', default='-',
+                        help='input file; stdin if omitted or -')
+    parser.add_argument('-m', '--module', required=True,
+                        help='module class (CloudServer) or Ansible module '
+                             'name (rax) of every task')
+    parser.add_argument('-i', '--input-format', choices=INPUT_FORMATS,
+                        help='default: csv for .csv files, jsonl otherwise')
+    parser.add_argument('-f', '--format', choices=sorted(
+        PlaybookWriter.FORMATS), default='yaml', help='output format')
+    parser.add_argument('-o', '--output', default='-',
+                        help='output file; stdout if omitted or -')
+    parser.add_argument('--map', type=_pair, action='append', default=[],
+                        metavar='ARG=COLUMN',
+                        help='take module argument ARG from COLUMN')
+    parser.add_argument('--drop', action='append', default=[],
+                        metavar='COLUMN', help='ignore COLUMN')
+    parser.add_argument('--task-arg', type=_pair, action='append',
+                        default=[], metavar='KEY=VALUE',
+                        help='add a task argument to every task')
+    parser.add_argument('--group-by', metavar='COLUMN',
+                        help='start a play whenever COLUMN changes')
+    parser.add_argument('--play-size', type=int, default=0, metavar='N',
+                        help='start a play after every N tasks')
+    parser.add_argument('--name', default='Provision', help='play name')
+    parser.add_argument('--hosts', default='localhost',
+                        help='hosts of every play')
+    parser.add_argument('--remote', action='store_true',
+                        help='run tasks on the hosts, not as local actions')
+    return parser
+
+
+def main(argv=None, stdin=None, stdout=None):
+    """ Run the command line tool
+
+    :param argv: Arguments; sys.argv[1:] if None
+    :param stdin: File object read for input '-'; sys.stdin if None
+    :param stdout: File object written for output '-'; sys.stdout if None
+    :return: int, exit status
+    """
+    args = parser().parse_args(argv)
+    stdin = sys.stdin if stdin is None else stdin
+    stdout = sys.stdout if stdout is None else stdout
+    input_format = args.input_format
+    if input_format is None:
+        input_format = 'csv' if args.input.endswith('.csv') else 'jsonl'
+    try:
+        mapper = RowMapper(module_class(args.module), dict(args.map),
+                           args.drop, args.group_by, not args.remote,
+                           dict(args.task_arg))
+        if args.input == '-':
+            f = stdin
+        else:
+            # newline='' as the csv module wants; JSON lines don't mind
+            f = open(args.input, newline='')
+        try:
+            output = stdout if args.output == '-' else args.output
+            stream(read_rows(f, input_format), mapper, output, args.name,
+                   args.hosts, args.play_size, args.format)
+        finally:
+            if f is not stdin:
+                f.close()
+    except (IOError, ValueError) as e:
+        stdout.flush()
+        sys.stderr.write('datemike: %s\n' % e)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
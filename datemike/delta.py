@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of datemike: https://github.com/angstwad/datemike
+#
+# Copyright 2014 Paul Durivage
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Structural differences between two playbooks:
+
+    from datemike import diff
+
+    changes = diff('site.yml', book)
+    print(changes)
+
+or from the command line, exiting with status 1 if they differ:
+
+    python -m datemike.delta old.yml new.yml
+
+Plays are paired by name.  Within a play, tasks are paired by their name,
+module and key arguments (see KEY_ARGS), looked up in a dict so the work
+grows linearly with the number of tasks, and regardless of the order tasks
+are in.  Paired tasks that differ are reported argument by argument; the
+rest are reported as added or removed.  The order of tasks and keys isn't
+compared.
+
+Playbook files are read straight into dicts.  For the largest playbooks,
+compare JSON output (Playbook.to_json_file): parsing YAML takes far longer
+than the comparison itself.
+"""
+
+import json
+import os
+import sys
+from collections import deque, OrderedDict
+
+from datemike.ansible import Play, Playbook
+from datemike.loader import _loader, split_task, task_module
+
+# Module arguments that identify what a task acts on, and so pair tasks up
+# along with their name and module, unless diff() is given others
+KEY_ARGS = ('name', 'domain', 'path', 'dest', 'src', 'key', 'container',
+            'node_id', 'address', 'loadbalancer_id')
+
+
+_SCALARS = frozenset([str, int, float, bool, type(None)])
+
+
+class _Missing(object):
+    def __repr__(self):
+        return '<missing>'
+
+# Stands in for an argument or key one side doesn't have
+MISSING = _Missing()
+
+
+def _freeze(value):
+    """ A hashable stand-in for a value """
+    if type(value) in _SCALARS:
+        return value
+    if isinstance(value, dict):
+        return tuple(sorted((repr(k), _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+
+def _deltas(old, new):
+    """ Values that differ between two dicts, by key, as (old, new) """
+    deltas = OrderedDict()
+    for key in old:
+        value = new.get(key, MISSING)
+        if value != old[key]:
+            deltas[key] = (old[key], value)
+    for key in new:
+        if key not in old:
+            deltas[key] = (MISSING, new[key])
+    return deltas
+
+
+class TaskChange(object):
+    def __init__(self, name, module, key, args, keys):
+        """ A task found in both playbooks with different contents
+
+        :param name: Task name
+        :param module: Module name, or None
+        :param key: dict of the key arguments that paired the tasks
+        :param args: dict of module argument to (old, new) value
+        :param keys: dict of other task key to (old, new) value
+        """
+        self.name = name
+        self.module = module
+        self.key = key
+        self.args = args
+        self.keys = keys
+
+    def as_obj(self):
+        return OrderedDict([
+            ('name', self.name), ('module', self.module),
+            ('key', self.key),
+            ('args', _delta_obj(self.args)),
+            ('keys', _delta_obj(self.keys)),
+        ])
+
+
+def _delta_obj(deltas):
+    return OrderedDict(
+        (key, OrderedDict((side, value) for side, value in
+                          zip(('old', 'new'), values) if value is not MISSING))
+        for key, values in deltas.items())
+
+
+class PlayDiff(object):
+    def __init__(self, name):
+        """ Differences within one play found in both playbooks
+
+        :param name: Play name
+        """
+        self.name = name
+        # dict of play key (other than tasks) to (old, new) value
+        self.keys = OrderedDict()
+        # Task dicts only in the new and only in the old play
+        self.added = []
+        self.removed = []
+        # TaskChange for each paired task that differs
+        self.changed = []
+        self.unchanged = 0
+
+    def __bool__(self):
+        return bool(self.keys or self.added or self.removed or self.changed)
+
+    __nonzero__ = __bool__
+
+    def as_obj(self):
+        return OrderedDict([
+            ('name', self.name),
+            ('keys', _delta_obj(self.keys)),
+            ('added', self.added),
+            ('removed', self.removed),
+            ('changed', [c.as_obj() for c in self.changed]),
+            ('unchanged', self.unchanged),
+        ])
+
+
+class PlaybookDiff(object):
+    def __init__(self, key_args=KEY_ARGS):
+        """ Differences between two playbooks; see diff()
+
+        :param key_args: Key arguments the tasks were paired by
+        """
+        self.key_args = key_args
+        # Play dicts only in the new and only in the old playbook
+        self.added = []
+        self.removed = []
+        # PlayDiff for each play found in both, changed or not
+        self.plays = []
+
+    def __bool__(self):
+        return bool(self.added or self.removed or any(self.plays))
+
+    __nonzero__ = __bool__
+
+    def __str__(self):
+        return self.to_text()
+
+    def summary(self):
+        """ Counts of what changed
+
+        :return: dict
+        """
+        return OrderedDict([
+            ('plays_added', len(self.added)),
+            ('plays_removed', len(self.removed)),
+            ('plays_changed', sum(1 for p in self.plays if p)),
+            ('tasks_added', sum(len(p.added) for p in self.plays)),
+            ('tasks_removed', sum(len(p.removed) for p in self.plays)),
+            ('tasks_changed', sum(len(p.changed) for p in self.plays)),
+            ('tasks_unchanged', sum(p.unchanged for p in self.plays)),
+        ])
+
+    def as_obj(self):
+        """ The differences as plain data, for JSON
+
+        :return: dict
+        """
+        return OrderedDict([
+            ('summary', self.summary()),
+            ('added', self.added),
+            ('removed', self.removed),
+            ('plays', [p.as_obj() for p in self.plays if p]),
+        ])
+
+    def to_text(self):
+        """ The differences for reading: + added, - removed, ~ changed
+
+        :return: str
+        """
+        lines = []
+        for play in self.removed:
+            lines.append('- play %r (%d tasks)' % (
+                play.get('name'), len(play.get('tasks') or ())))
+        for play in self.added:
+            lines.append('+ play %r (%d tasks)' % (
+                play.get('name'), len(play.get('tasks') or ())))
+        for play in self.plays:
+            if not play:
+                continue
+            lines.append('~ play %r' % play.name)
+            _delta_lines(lines, play.keys, '    ')
+            for sign, tasks in (('-', play.removed), ('+', play.added)):
+                for task in tasks:
+                    name, module, args, _ = split_task(task)
+                    key = _key(module, args, self.key_args)
+                    lines.append('  %s task %r %s' % (
+                        sign, name, _label(module, key)))
+            for change in play.changed:
+                lines.append('  ~ task %r %s' % (
+                    change.name, _label(change.module, change.key)))
+                _delta_lines(lines, change.args, '      ')
+                _delta_lines(lines, change.keys, '      ')
+        return ''.join(line + '\n' for line in lines)
+
+
+def _label(module, args):
+    parts = [module or '(no module)']
+    parts.extend('%s=%s' % item for item in args.items())
+    return ' '.join(parts)
+
+
+def _delta_lines(lines, deltas, indent):
+    for key, (old, new) in deltas.items():
+        lines.append('%s%s: %r -> %r' % (indent, key, old, new))
+
+
+def _read(file_):
+    """ The plays of a playbook file as dicts, without building Play and
+    Task objects.  JSON playbooks are read with the json module, which is
+    much faster than any YAML parser; key order doesn't matter to diff().
+    """
+    if isinstance(file_, str):
+        with open(os.path.abspath(os.path.expanduser(file_))) as f:
+            text = f.read()
+    else:
+        text = file_.read()
+    if text.lstrip()[:1] in ('[', '{'):
+        try:
+            return json.loads(text)
+        except ValueError:
+            # YAML flow style, which isn't always JSON
+            pass
+    import yaml
+    return yaml.load(text, Loader=_loader('libyaml')) or []
+
+
+def _plays(source):
+    """ Play dicts of a playbook, play, list of plays or playbook file """
+    if isinstance(source, Playbook):
+        return [play.as_obj() for play in source._plays]
+    if isinstance(source, Play):
+        return [source.as_obj()]
+    if isinstance(source, (list, tuple)):
+        return [play.as_obj() if isinstance(play, Play) else play
+                for play in source]
+    plays = _read(source)
+    if not isinstance(plays, list):
+        raise ValueError('A playbook is a list of plays')
+    return plays
+
+
+def _key(module, args, key_args):
+    """ The key arguments of a module's arguments """
+    if isinstance(key_args, dict):
+        key_args = key_args.get(module, KEY_ARGS)
+    return OrderedDict((k, args[k]) for k in key_args if k in args)
+
+
+def _task_key(task, key_args):
+    """ What pairs a task dict with its counterpart: its name, module and
+    key arguments, or its name and every other key if it has no module
+    """
+    name = task.get('name')
+    module, args = task_module(task)
+    if module is None:
+        return name, None, _freeze(task)
+    if not isinstance(args, dict):
+        return name, module, _freeze(args)
+    if isinstance(key_args, dict):
+        key_args = key_args.get(module, KEY_ARGS)
+    return name, module, tuple((k, _freeze(args[k])) for k in key_args
+                               if k in args)
+
+
+def _diff_tasks(result, old, new, key_args):
+    """ Pair up and compare the task dicts of a play """
+    # key -> indexes of the old tasks with that key not yet paired
+    pending = {}
+    for i, task in enumerate(old):
+        key = _task_key(task, key_args)
+        indexes = pending.get(key)
+        if indexes is None:
+            indexes = pending[key] = deque()
+        indexes.append(i)
+    paired = [False] * len(old)
+    for task in new:
+        indexes = pending.get(_task_key(task, key_args))
+        if not indexes:
+            result.added.append(task)
+            continue
+        i = indexes.popleft()
+        paired[i] = True
+        if old[i] == task:
+            result.unchanged += 1
+            continue
+        old_parts = split_task(old[i])
+        name, module, args, keys = split_task(task)
+        arg_deltas = _deltas(old_parts[2], args)
+        key_deltas = _deltas(old_parts[3], keys)
+        if not arg_deltas and not key_deltas:
+            # Only the order of keys differs
+            result.unchanged += 1
+            continue
+        result.changed.append(TaskChange(
+            name, module, _key(module, args, key_args), arg_deltas,
+            key_deltas))
+    result.removed.extend(task for task, done in zip(old, paired)
+                          if not done)
+
+
+def diff(old, new, key_args=None):
+    """ Compare two playbooks
+
+    :param old: Playbook, Play, list of Plays, or a playbook's filepath or
+    open file object
+    :param new: Same as old
+    :param key_args: Module arguments that identify a task's target, as a
+    sequence, or a dict of module name to sequence (other modules use
+    KEY_ARGS); KEY_ARGS if None
+    :return: PlaybookDiff
+    """
+    if key_args is None:
+        key_args = KEY_ARGS
+    old_plays = _plays(old)
+    new_plays = _plays(new)
+    result = PlaybookDiff(key_args)
+    single = isinstance(old, Play) and isinstance(new, Play)
+    # name -> old plays with that name, in order
+    pending = {}
+    for play in old_plays:
+        pending.setdefault(play.get('name'), deque()).append(play)
+    for play in new_plays:
+        name = play.get('name')
+        if single:
+            old_play = old_plays[0]
+        elif pending.get(name):
+            old_play = pending[name].popleft()
+        else:
+            result.added.append(play)
+            continue
+        play_diff = PlayDiff(name)
+        play_diff.keys = _deltas(
+            dict((k, v) for k, v in old_play.items() if k != 'tasks'),
+            dict((k, v) for k, v in play.items() if k != 'tasks'))
+        _diff_tasks(play_diff, old_play.get('tasks') or (),
+                    play.get('tasks') or (), key_args)
+        result.plays.append(play_diff)
+    if not single:
+        for plays in pending.values():
+            result.removed.extend(plays)
+    return result
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        sys.stderr.write('usage: python -m datemike.delta OLD_PLAYBOOK '
+                         'NEW_PLAYBOOK\n')
+        return 2
+    result = diff(argv[0], argv[1])
+    sys.stdout.write(result.to_text())
+    summary = result.summary()
+    print(', '.join('%s %d' % (k.replace('_', ' '), v)
+                    for k, v in summary.items()))
+    return 1 if result else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of datemike: https://github.com/angstwad/datemike
+#
+# Copyright 2014 Paul Durivage
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Ordered sets of host names, written compactly as Ansible inventory ranges:
+
+    from datemike.hosts import HostSet
+
+    hosts = HostSet('web%03d.iad' % i for i in range(1, 501))
+    hosts.patterns()            # ['web[001:500].iad']
+    hosts.to_inventory('web')
+    # {'web': {'hosts': {'web[001:500].iad': None}}}
+
+Range patterns are inventory syntax; a play's hosts: can't hold them (it
+would read the brackets as a glob), so plays list hosts in full, or target
+a group of an inventory written with to_inventory().
+"""
+
+import re
+import string
+from collections import OrderedDict
+
+# Host name tokens: runs of digits, and everything in between
+_digits = re.compile(r'(\d+)')
+# One [start:end] or [start:end:step] range in a pattern
+_range = re.compile(r'\[([^\[\]:]*):([^\[\]:]*)(?::([^\[\]:]*))?\]')
+
+
+class HostSet(object):
+    def __init__(self, hosts=()):
+        """ Host names in the order they were first added, without
+        duplicates
+
+        :param hosts: A host as a string, or any iterable of hosts
+        """
+        self._hosts = OrderedDict()
+        self.update(hosts)
+
+    @classmethod
+    def from_patterns(cls, patterns):
+        """ Expand the range patterns written by patterns() (or any
+        inventory host ranges) back into a HostSet
+
+        :param patterns: A pattern as a string, or an iterable of patterns
+        :return: HostSet
+        """
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        hosts = cls()
+        for pattern in patterns:
+            hosts.update(expand(pattern))
+        return hosts
+
+    def __contains__(self, host):
+        return host in self._hosts
+
+    def __iter__(self):
+        return iter(self._hosts)
+
+    def __len__(self):
+        return len(self._hosts)
+
+    def __eq__(self, other):
+        if isinstance(other, HostSet):
+            return list(self._hosts) == list(other._hosts)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __repr__(self):
+        return 'HostSet(%r)' % self.patterns()
+
+    def add(self, host):
+        """ Add a host
+
+        :param host: Host name
+        :return: True if it was added, False if it was already in the set
+        """
+        if host in self._hosts:
+            return False
+        self._hosts[host] = None
+        return True
+
+    def update(self, hosts):
+        """ Add hosts
+
+        :param hosts: A host as a string, or any iterable of hosts
+        :return: list of the hosts that weren't in the set yet
+        """
+        if isinstance(hosts, str):
+            hosts = [hosts]
+        seen = self._hosts
+        added = []
+        for host in hosts:
+            if host not in seen:
+                seen[host] = None
+                added.append(host)
+        return added
+
+    def discard(self, host):
+        """ Remove a host if it is in the set """
+        self._hosts.pop(host, None)
+
+    def patterns(self):
+        """ The hosts, in order, with each run of names that differ only in
+        a counting number written as an Ansible range, such as
+        web[001:500].iad
+
+        :return: list of str
+        """
+        return compress(self._hosts)
+
+    def to_inventory(self, group):
+        """ A YAML inventory holding these hosts as a group
+
+        :param group: Group name
+        :return: dict, for pretty_yaml
+        """
+        hosts = OrderedDict((pattern, None) for pattern in self.patterns())
+        return OrderedDict([(group, OrderedDict(hosts=hosts))])
+
+
+def _tokens(host):
+    """ Split host into non-digit text and digit runs; None if host can't
+    be part of a range (it already holds range syntax)
+    """
+    if '[' in host or ']' in host or ':' in host:
+        return None
+    return _digits.split(host)
+
+
+def _fits(start, token, value):
+    """ Whether token is written the way Ansible writes value in a range
+    starting at the token start
+    """
+    if start[0] == '0' and len(start) > 1:
+        return token == str(value).zfill(len(start))
+    return token == str(value)
+
+
+def compress(hosts):
+    """ Write runs of consecutive hosts that count up by one in a single
+    digit field as range patterns; expand() reverses it exactly
+
+    :param hosts: iterable of host names
+    :return: list of str
+    """
+    patterns = []
+    # Tokens of the run's first host, the digit field that counts (once
+    # known), its first token, and its last value
+    run = None
+
+    def flush():
+        tokens, field, start, last = run
+        if field is None:
+            patterns.append(''.join(tokens))
+            return
+        end = str(last)
+        if start[0] == '0':
+            end = end.zfill(len(start))
+        patterns.append('%s[%s:%s]%s' % (''.join(tokens[:field]), start, end,
+                                         ''.join(tokens[field + 1:])))
+
+    for host in hosts:
+        tokens = _tokens(host)
+        if run is not None and tokens is not None:
+            first, field, start, last = run
+            if len(tokens) == len(first) and tokens[::2] == first[::2]:
+                diffs = [i for i in range(1, len(tokens), 2)
+                         if tokens[i] != first[i]]
+                if field is None and len(diffs) == 1:
+                    field = diffs[0]
+                    start, last = first[field], int(first[field])
+                if (field is not None and diffs == [field] and
+                        int(tokens[field]) == last + 1 and
+                        _fits(start, tokens[field], last + 1)):
+                    run = [first, field, start, last + 1]
+                    continue
+        if run is not None:
+            flush()
+        if tokens is None:
+            patterns.append(host)
+            run = None
+        else:
+            run = [tokens, None, None, None]
+    if run is not None:
+        flush()
+    return patterns
+
+
+def _bound(value, alpha):
+    if alpha:
+        return string.ascii_letters.index(value)
+    return int(value)
+
+
+def expand(pattern):
+    """ The hosts an Ansible inventory range pattern stands for, such as
+    web[001:500].iad or db-[a:c], in order
+
+    :param pattern: Host name or pattern
+    :return: list of str
+    """
+    match = _range.search(pattern)
+    if match is None:
+        return [pattern]
+    start, end, step = match.group(1), match.group(2), match.group(3)
+    start = start or '0'
+    if not end:
+        raise ValueError('Host range must have an end: %s' % pattern)
+    step = int(step) if step else 1
+    alpha = not start.isdigit()
+    if alpha != (not end.isdigit()):
+        raise ValueError('Host range mixes letters and numbers: %s' %
+                         pattern)
+    if alpha:
+        if len(start) != 1 or len(end) != 1:
+            raise ValueError('Host range letters must be single characters: '
+                             '%s' % pattern)
+        fill = lambda i: string.ascii_letters[i]  # noqa: E731
+    elif start[0] == '0' and len(start) > 1:
+        if len(start) != len(end):
+            raise ValueError('Host range must specify equal-length begin and '
+                             'end formats: %s' % pattern)
+        fill = lambda i: str(i).zfill(len(start))  # noqa: E731
+    else:
+        fill = str
+    head, tail = pattern[:match.start()], pattern[match.end():]
+    hosts = []
+    for i in range(_bound(start, alpha), _bound(end, alpha) + 1, step):
+        for rest in expand(tail):
+            hosts.append(head + fill(i) + rest)
+    return hosts
@@ -0,0 +1,408 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of datemike: https://github.com/angstwad/datemike
+#
+# Copyright 2014 Paul Durivage
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Read existing playbooks back into Play and Task objects:
+
+    from datemike import PlaybookWriter
+    from datemike.loader import iter_plays
+
+    with PlaybookWriter('new.yml') as writer:
+        for play in iter_plays('site.yml'):
+            play.hoist()
+            writer.add_play(play)
+
+The file is parsed event by event (with libyaml when it is installed) and
+one play is built at a time, so memory use depends on the largest play
+rather than the playbook.  With tasks=True each play's tasks are yielded
+one at a time as well, for plays too large to hold in memory.
+
+Tasks of modules a provider implements (such as rax_clb) become Tasks of
+its module classes, other modules become RawModules, and tasks that don't
+name a single module (blocks, includes, free-form arguments) become
+RawTasks that keep their dict as is.  Rebuilt tasks are written in
+datemike's key order: name, task arguments, then the module.
+"""
+
+import os
+from collections import OrderedDict
+
+from datemike import providers
+from datemike.ansible import Play, RawTask, Task
+from datemike.base import link_parent, ModuleBase, shared
+
+# Task keys that aren't a module; any other key of a task names its module
+TASK_KEYWORDS = frozenset([
+    'action', 'any_errors_fatal', 'args', 'async', 'become',
+    'become_exe', 'become_flags', 'become_method', 'become_user',
+    'changed_when', 'check_mode', 'collections', 'connection', 'debugger',
+    'delay', 'delegate_facts', 'delegate_to', 'diff', 'environment',
+    'failed_when', 'ignore_errors', 'ignore_unreachable', 'local_action',
+    'loop', 'loop_control', 'module_defaults', 'name', 'no_log', 'notify',
+    'poll', 'port', 'register', 'remote_user', 'retries', 'run_once', 'su',
+    'su_user', 'sudo', 'sudo_user', 'tags', 'throttle', 'timeout', 'until',
+    'vars', 'when', 'with_dict', 'with_fileglob', 'with_first_found',
+    'with_flattened', 'with_indexed_items', 'with_items', 'with_lines',
+    'with_list', 'with_nested', 'with_random_choice', 'with_sequence',
+    'with_subelements', 'with_together',
+])
+
+
+def _module_keys(task):
+    """ The keys of a task dict that could name its module: those that
+    aren't task keywords, nor a with_<lookup> loop over any lookup plugin
+    """
+    return [k for k in task if k not in TASK_KEYWORDS and
+            not (isinstance(k, str) and k.startswith('with_'))]
+
+
+# Keys of tasks that hold other tasks or files rather than run a module
+_RAW_KEYS = frozenset([
+    'always', 'block', 'import_playbook', 'import_tasks', 'include',
+    'include_tasks', 'rescue',
+])
+# Loader classes by engine; see _loader()
+_loaders = {}
+
+
+class RawModule(ModuleBase):
+    def __init__(self, module_name, args=None, display_name=None):
+        """ Any Ansible module, with its arguments as read
+
+        :param module_name: Ansible module name
+        :param args: dict of module arguments
+        :param display_name: Task name
+        """
+        super(RawModule, self).__init__()
+        self.module_name = module_name
+        self.display_name = display_name
+        prefix = self.arg_prefix
+        for key, value in (args or {}).items():
+            setattr(self, prefix + key, value)
+
+
+def _construct_mapping(loader, node):
+    data = OrderedDict()
+    yield data
+    loader.flatten_mapping(node)
+    data.update(loader.construct_pairs(node))
+
+
+def _loader(engine):
+    """ A private subclass of the engine's SafeLoader that reads mappings
+    as OrderedDicts
+
+    :param engine: 'libyaml' (if installed; PyYAML otherwise) or 'pyyaml'
+    """
+    try:
+        return _loaders[engine]
+    except KeyError:
+        pass
+    import yaml
+    base = yaml.SafeLoader
+    if engine == 'libyaml':
+        base = getattr(yaml, 'CSafeLoader', base)
+    loader = type(base.__name__, (base,), {'__module__': __name__})
+    loader.add_constructor(u'tag:yaml.org,2002:map', _construct_mapping)
+    _loaders[engine] = loader
+    return loader
+
+
+class _Events(object):
+    def __init__(self, file_, engine):
+        """ Parse a YAML stream one event at a time, composing and
+        constructing single values from it on request
+
+        :param file_: Open file object
+        :param engine: 'libyaml' or 'pyyaml'
+        """
+        import yaml
+        self.yaml = yaml
+        self.loader = _loader(engine)(file_)
+        # Anchored nodes, kept for aliases in later values
+        self.anchors = {}
+
+    def expect(self, kind):
+        event = self.loader.get_event()
+        if not isinstance(event, getattr(self.yaml, kind)):
+            raise ValueError('Expected %s in playbook, found %s at %s' %
+                             (kind, type(event).__name__, event.start_mark))
+        return event
+
+    def check(self, kind):
+        return self.loader.check_event(getattr(self.yaml, kind))
+
+    def compose(self):
+        """ The node of the next complete value """
+        yaml = self.yaml
+        loader = self.loader
+        event = loader.get_event()
+        if isinstance(event, yaml.AliasEvent):
+            try:
+                return self.anchors[event.anchor]
+            except KeyError:
+                raise ValueError('Unknown alias %s in playbook at %s' %
+                                 (event.anchor, event.start_mark))
+        if isinstance(event, yaml.ScalarEvent):
+            tag = event.tag
+            if tag is None or tag == u'!':
+                tag = loader.resolve(yaml.ScalarNode, event.value,
+                                     event.implicit)
+            node = yaml.ScalarNode(tag, event.value, event.start_mark,
+                                   event.end_mark, style=event.style)
+        elif isinstance(event, yaml.SequenceStartEvent):
+            tag = event.tag
+            if tag is None or tag == u'!':
+                tag = loader.resolve(yaml.SequenceNode, None, event.implicit)
+            node = yaml.SequenceNode(tag, [], event.start_mark, None,
+                                     flow_style=event.flow_style)
+            if event.anchor is not None:
+                self.anchors[event.anchor] = node
+            while not loader.check_event(yaml.SequenceEndEvent):
+                node.value.append(self.compose())
+            node.end_mark = loader.get_event().end_mark
+            return node
+        elif isinstance(event, yaml.MappingStartEvent):
+            tag = event.tag
+            if tag is None or tag == u'!':
+                tag = loader.resolve(yaml.MappingNode, None, event.implicit)
+            node = yaml.MappingNode(tag, [], event.start_mark, None,
+                                    flow_style=event.flow_style)
+            if event.anchor is not None:
+                self.anchors[event.anchor] = node
+            while not loader.check_event(yaml.MappingEndEvent):
+                key = self.compose()
+                node.value.append((key, self.compose()))
+            node.end_mark = loader.get_event().end_mark
+            return node
+        else:
+            raise ValueError('Unexpected %s in playbook at %s' %
+                             (type(event).__name__, event.start_mark))
+        if event.anchor is not None:
+            self.anchors[event.anchor] = node
+        return node
+
+    def value(self):
+        """ Construct the next complete value """
+        return self.loader.construct_document(self.compose())
+
+
+def _module(module_name, args, display_name):
+    """ An instance of the module class implementing module_name, set up
+    with exactly the arguments read, or a RawModule
+    """
+    if args is None:
+        args = {}
+    if not isinstance(args, dict) or not all(isinstance(k, str)
+                                             for k in args):
+        return None
+    cls = providers.module_class(module_name)
+    if cls is not None and all(hasattr(cls, cls.arg_prefix + k)
+                               for k in args):
+        # Only what was read: the constructor's defaults would add more
+        module = cls.__new__(cls)
+        ModuleBase.__init__(module)
+        module.module_name = module_name
+        module.display_name = display_name
+        for key, value in args.items():
+            if key in cls.shared_args:
+                value = shared(value)
+            setattr(module, cls.arg_prefix + key, value)
+        return module
+    return RawModule(module_name, args, display_name)
+
+
+def task_module(task):
+    """ Find the module a task dict runs, as split_task() does but without
+    copying its other keys
+
+    :param task: Task as a dict
+    :return: tuple of (module name, its arguments as in the task), or
+    (None, None) if the task doesn't name a single module.  The arguments
+    of a local action still include 'module'; free-form ones are not a
+    dict.
+    """
+    local = task.get('local_action')
+    if isinstance(local, dict) and 'module' in local:
+        return local['module'], local
+    modules = _module_keys(task)
+    if len(modules) != 1:
+        return None, None
+    return modules[0], task[modules[0]]
+
+
+def split_task(task):
+    """ Take a task dict apart, whether or not it runs as a local action
+
+    :param task: Task as a dict
+    :return: tuple of (name, module name, dict of module arguments, dict of
+    other task keys, with local_action True if it was one).  Tasks that
+    don't name a single module have no module and all their keys in the
+    last part; free-form arguments are given as _raw_params.
+    """
+    name = task.get('name')
+    module, args = task_module(task)
+    if module is None:
+        return name, None, {}, dict((k, v) for k, v in task.items()
+                                    if k != 'name')
+    if args is task.get('local_action'):
+        args = dict((k, v) for k, v in args.items() if k != 'module')
+        keys = dict((k, v) for k, v in task.items()
+                    if k not in ('name', 'local_action'))
+        keys['local_action'] = True
+        return name, module, args, keys
+    if not isinstance(args, dict):
+        args = {'_raw_params': args}
+    keys = dict((k, v) for k, v in task.items() if k not in ('name', module))
+    return name, module, args, keys
+
+
+def make_task(obj):
+    """ Rebuild a Task from a task dict
+
+    :param obj: Task as read from a playbook
+    :return: Task, or RawTask if obj doesn't run a single module
+    """
+    if not isinstance(obj, dict) or _RAW_KEYS.intersection(obj):
+        return RawTask(obj)
+    local = obj.get('local_action')
+    if local is not None:
+        if not isinstance(local, dict) or 'module' not in local:
+            return RawTask(obj)
+        module_key, module_name = 'local_action', local['module']
+        args = OrderedDict((k, v) for k, v in local.items() if k != 'module')
+    else:
+        keys = _module_keys(obj)
+        if len(keys) != 1 or 'action' in obj:
+            return RawTask(obj)
+        module_key = module_name = keys[0]
+        args = obj[module_key]
+    module = _module(module_name, args, obj.get('name'))
+    if module is None:
+        return RawTask(obj)
+    task_args = OrderedDict((k, v) for k, v in obj.items()
+                            if k not in ('name', module_key))
+    return Task(module, local is not None, **task_args)
+
+
+def make_play(obj, tasks=True):
+    """ Rebuild a Play from a play dict
+
+    :param obj: Play as read from a playbook
+    :param tasks: Whether to rebuild the tasks too
+    :return: Play
+    """
+    play = Play(None)
+    play._play.clear()
+    for key, value in obj.items():
+        if key == 'tasks' and tasks:
+            value = [make_task(t) for t in value or ()]
+            for task in value:
+                link_parent(task, play)
+        play._play[key] = value
+    return play
+
+
+def _open(file_):
+    if isinstance(file_, str):
+        return open(os.path.abspath(os.path.expanduser(file_)))
+    return None
+
+
+def iter_plays(file_, tasks=False, engine='libyaml'):
+    """ Read a playbook one play at a time
+
+    :param file_: Filepath as a string or an open file object; the plays of
+    every YAML document in it are read
+    :param tasks: Yield each play's tasks one at a time too: items are then
+    (Play, generator of Tasks), and the generator must be used up before
+    the next item is requested.  Until then the play has an empty task
+    list, and keys that follow the tasks in the file are added to it once
+    the tasks are read.  This suits PlaybookWriter.play():
+
+        for play, tasks in iter_plays('site.yml', tasks=True):
+            with writer.play(play) as play_writer:
+                play_writer.add_task(tasks)
+
+    :param engine: 'libyaml' (when installed) or 'pyyaml'
+    :return: generator of Play objects, or of (Play, generator) tuples
+    """
+    opened = _open(file_)
+    try:
+        events = _Events(opened or file_, engine)
+        events.expect('StreamStartEvent')
+        while not events.check('StreamEndEvent'):
+            events.expect('DocumentStartEvent')
+            # Anchors only reach to the end of their document
+            events.anchors = {}
+            if events.check('ScalarEvent'):
+                # An empty document
+                events.expect('ScalarEvent')
+                events.expect('DocumentEndEvent')
+                continue
+            events.expect('SequenceStartEvent')
+            while not events.check('SequenceEndEvent'):
+                if not tasks:
+                    yield make_play(events.value())
+                    continue
+                play, streaming = _stream_play(events)
+                play_tasks = _stream_tasks(events, play, streaming)
+                yield play, play_tasks
+                # Whatever the caller didn't read
+                for _ in play_tasks:
+                    pass
+            events.expect('SequenceEndEvent')
+            events.expect('DocumentEndEvent')
+    finally:
+        if opened is not None:
+            opened.close()
+
+
+def _stream_play(events):
+    """ Read a play up to the start of its tasks
+
+    :return: tuple of (Play, whether its tasks are still to be read)
+    """
+    events.expect('MappingStartEvent')
+    obj = OrderedDict()
+    while not events.check('MappingEndEvent'):
+        key = events.value()
+        if key == 'tasks' and events.check('SequenceStartEvent'):
+            events.expect('SequenceStartEvent')
+            obj['tasks'] = []
+            return make_play(obj), True
+        obj[key] = events.value()
+    events.expect('MappingEndEvent')
+    return make_play(obj), False
+
+
+def _stream_tasks(events, play, streaming):
+    """ Yield the tasks of a play read by _stream_play, then read the rest
+    of the play into it
+    """
+    if not streaming:
+        return
+    while not events.check('SequenceEndEvent'):
+        yield make_task(events.value())
+    events.expect('SequenceEndEvent')
+    while not events.check('MappingEndEvent'):
+        key = events.value()
+        play._play[key] = events.value()
+    events.expect('MappingEndEvent')
+    play.invalidate()
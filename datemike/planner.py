@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of datemike: https://github.com/angstwad/datemike
+#
+# Copyright 2014 Paul Durivage
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Concurrency settings for plays, sized from how many hosts they run on:
+
+    book.plan(forks=20, rate=5, task_seconds=30)
+
+picks each play's strategy, serial batches and throttle, sets them on the
+play and returns a ConcurrencyPlan per play with the predicted wall time.
+
+Host counts come from the playbook itself.  Servers created with rax (the
+count of a CloudServer, or 1) are counted once add_host (such as
+CloudServersAddHosts) puts them into groups, and a later play on those
+groups runs on that many hosts; any other host pattern counts as one host.
+Pass the count to Play.plan() where it's known better.
+
+The model is deliberately simple: every task takes task_seconds on every
+host and makes calls_per_task API requests, and no more than rate requests
+may be made per second in all.  Running more than rate * task_seconds /
+calls_per_task tasks at once would exceed the rate, so that is the most
+the play is allowed (as throttle) when it is below forks.
+"""
+
+import math
+from collections import OrderedDict
+
+from datemike.loader import task_module
+
+STRATEGIES = ('linear', 'free')
+# Play keywords a plan sets
+PLAY_KEYWORDS = ('strategy', 'serial', 'throttle')
+# Patterns that are the control node itself
+_LOCAL = frozenset(['localhost', '127.0.0.1'])
+
+
+class ConcurrencyPlan(object):
+    def __init__(self, hosts, tasks, forks, strategy, serial=None,
+                 throttle=None, seconds=0.0):
+        """ Concurrency settings chosen for a play; see plan()
+
+        :param hosts: Hosts the play runs on
+        :param tasks: Task runs per host (loop items count separately)
+        :param forks: Forks Ansible is run with (-f)
+        :param strategy: 'linear' or 'free'
+        :param serial: Batch size, or list of batch sizes (the last one
+        repeating), or None to run all hosts at once
+        :param throttle: Most tasks running at once, or None
+        :param seconds: Predicted wall time of the play
+        """
+        self.hosts = hosts
+        self.tasks = tasks
+        self.forks = forks
+        self.strategy = strategy
+        self.serial = serial
+        self.throttle = throttle
+        self.seconds = seconds
+
+    def __repr__(self):
+        return '<ConcurrencyPlan %s>' % ' '.join(
+            '%s=%r' % item for item in self.as_obj().items())
+
+    def play_args(self):
+        """ The play keywords to set
+
+        :return: dict; the strategy is left out when it's linear, the
+        default
+        """
+        args = OrderedDict()
+        if self.strategy != 'linear':
+            args['strategy'] = self.strategy
+        if self.serial is not None:
+            args['serial'] = self.serial
+        if self.throttle is not None:
+            args['throttle'] = self.throttle
+        return args
+
+    def as_obj(self):
+        return OrderedDict([
+            ('hosts', self.hosts), ('tasks', self.tasks),
+            ('forks', self.forks), ('strategy', self.strategy),
+            ('serial', self.serial), ('throttle', self.throttle),
+            ('seconds', self.seconds),
+        ])
+
+
+def plan(hosts, tasks, forks=5, rate=None, task_seconds=10.0,
+         calls_per_task=1, rolling=False):
+    """ Choose concurrency settings for a play
+
+    :param hosts: Number of hosts the play runs on
+    :param tasks: Number of task runs per host
+    :param forks: Forks Ansible is run with
+    :param rate: Most API requests per second, or None for no limit
+    :param task_seconds: Seconds a task takes on one host
+    :param calls_per_task: API requests a task makes on one host
+    :param rolling: Go through the hosts in batches (a single canary host,
+    then as many as can run at once), stopping if a batch fails
+    :return: ConcurrencyPlan
+    """
+    if forks < 1:
+        raise ValueError('forks must be at least 1')
+    hosts = max(int(hosts), 0)
+    tasks = max(int(tasks), 1)
+    workers = min(forks, hosts) or 1
+    throttle = None
+    if rate is not None and calls_per_task:
+        # Tasks running at once that keep within the rate (Little's law)
+        limit = max(int(rate * task_seconds / calls_per_task), 1)
+        if limit < workers:
+            workers = throttle = limit
+    serial = None
+    if rolling and hosts > 1:
+        strategy = 'linear'
+        serial = [1, workers] if workers > 1 else 1
+        batches = 1 + int(math.ceil((hosts - 1) / float(workers)))
+        seconds = batches * tasks * task_seconds
+    elif hosts > workers:
+        # More hosts than workers: with linear, every task waits for the
+        # slowest of each round of hosts; free keeps the workers busy
+        strategy = 'free'
+        seconds = math.ceil(hosts * tasks / float(workers)) * task_seconds
+    else:
+        strategy = 'linear'
+        seconds = tasks * task_seconds if hosts else 0.0
+    if rate is not None:
+        seconds = max(seconds, hosts * tasks * calls_per_task / float(rate))
+    return ConcurrencyPlan(hosts, tasks, forks, strategy, serial, throttle,
+                           float(seconds))
+
+
+def _patterns(hosts):
+    if hosts is None:
+        return []
+    if isinstance(hosts, str):
+        hosts = hosts.replace(':', ',').split(',')
+    return [h.strip() for h in hosts if h and h.strip()]
+
+
+def _int(value, default):
+    """ A module argument as an int, unless it's a template """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _loop_length(task):
+    """ Items a task dict loops over, read from its loop keyword whether or
+    not a module was found in it
+    """
+    items = task.get('with_items', task.get('loop'))
+    return len(items) if isinstance(items, list) else 1
+
+
+def task_runs(play_obj):
+    """ Task runs per host of a play dict: each task, or each item of a
+    loop over a list; at least 1 for plays of roles
+    """
+    runs = 0
+    for task in play_obj.get('tasks') or ():
+        runs += _loop_length(task)
+    if not runs and play_obj.get('roles'):
+        runs = len(play_obj['roles'])
+    return runs
+
+
+def host_counts(plays):
+    """ Estimate how many hosts each play runs on
+
+    :param plays: Play objects in playbook order
+    :return: list of ints, one per play
+    """
+    groups = {}
+    counts = []
+    for play in plays:
+        play_obj = play.as_obj()
+        count = 0
+        for pattern in _patterns(play_obj.get('hosts')):
+            if pattern[0] in '!&':
+                continue
+            if pattern == 'all':
+                count += sum(groups.values()) or 1
+            else:
+                count += groups.get(pattern, 1)
+        counts.append(count)
+        # Servers each registered variable holds, and made so far
+        registered = {}
+        created = 0
+        for task in play_obj.get('tasks') or ():
+            module, args = task_module(task)
+            if not isinstance(args, dict):
+                args = {}
+            if module == 'rax':
+                servers = _int(args.get('count'), 1) * _loop_length(task)
+                created += servers
+                if task.get('register'):
+                    registered[task['register']] = servers
+            elif module == 'add_host':
+                items = task.get('with_items', task.get('loop'))
+                if isinstance(items, list):
+                    added = len(items)
+                elif isinstance(items, str):
+                    var = items.strip('{} ').split('.')[0]
+                    added = registered.get(var, created)
+                else:
+                    added = 1
+                names = args.get('groupname', args.get('groups', ()))
+                for group in _patterns(names):
+                    groups[group] = groups.get(group, 0) + added
+    return counts
@@ -1,2 +1,106 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+
+# This file is part of datemike: https://github.com/angstwad/datemike
+#
+# Copyright 2014 Paul Durivage
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module classes for each provider.  A provider is only imported when one of
+its classes is first looked up here:
+
+    from datemike import providers
+    server = providers.CloudServer('web', 'performance1-1', 'ubuntu')
+"""
+
+import importlib
+
+# Module path of each provider, by provider name
+PROVIDERS = {}
+# Provider name of each module class, by class name
+CLASSES = {}
+# Module class name of each Ansible module a provider implements
+MODULES = {}
+
+
+def register(name, path, classes, modules=None):
+    """ Make a provider's module classes available from this package
+    without importing it
+
+    :param name: Provider name, such as 'rackspace'
+    :param path: Import path of the module defining the classes
+    :param classes: Names of the module classes it defines
+    :param modules: dict of Ansible module name to the name of the class
+    implementing it, for reading playbooks back (see datemike.loader)
+    """
+    PROVIDERS[name] = path
+    for cls_name in classes:
+        CLASSES[cls_name] = name
+    MODULES.update(modules or {})
+
+
+def provider(name):
+    """ Import a provider
+
+    :param name: Provider name
+    :return: module
+    """
+    try:
+        return importlib.import_module(PROVIDERS[name])
+    except KeyError:
+        raise ValueError('Unknown provider: %s' % name)
+
+
+def module_class(module_name):
+    """ The module class implementing an Ansible module, importing its
+    provider if need be
+
+    :param module_name: Ansible module name, such as 'rax_clb'
+    :return: ModuleBase subclass, or None if no provider implements it
+    """
+    cls_name = MODULES.get(module_name)
+    if cls_name is None:
+        return None
+    return getattr(provider(CLASSES[cls_name]), cls_name)
+
+
+def __getattr__(name):
+    if name in CLASSES:
+        value = getattr(provider(CLASSES[name]), name)
+    elif name in PROVIDERS:
+        value = provider(name)
+    else:
+        raise AttributeError('module %r has no attribute %r' %
+                             (__name__, name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(PROVIDERS) | set(CLASSES))
+
+
+register('rackspace', 'datemike.providers.rackspace', [
+    'CloudServer', 'CloudLoadBal', 'CloudLoadBalNodes', 'CloudDnsRecord',
+    'CloudDns', 'CloudFilesContainer', 'CloudFilesObjects', 'CloudKeypair',
+    'CloudFacts', 'CloudNetwork', 'CloudQueue', 'CloudServersAddHosts'
+], {
+    'rax': 'CloudServer', 'rax_clb': 'CloudLoadBal',
+    'rax_clb_nodes': 'CloudLoadBalNodes', 'rax_dns': 'CloudDns',
+    'rax_dns_record': 'CloudDnsRecord', 'rax_files': 'CloudFilesContainer',
+    'rax_files_objects': 'CloudFilesObjects', 'rax_keypair': 'CloudKeypair',
+    'rax_network': 'CloudNetwork', 'rax_queue': 'CloudQueue',
+    'rax_facts': 'CloudFacts',
+})
@@ -17,7 +17,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from datemike.base import ModuleBase
+from datemike.base import ModuleBase, shared
 
 __all__ = [
     'CloudServer', 'CloudLoadBal', 'CloudLoadBalNodes', 'CloudDnsRecord',
@@ -27,6 +27,11 @@ __all__ = [
 
 
 class CloudBase(ModuleBase):
+    __slots__ = ('r_api_key', 'r_credentials', 'r_region', 'r_username')
+
+    arg_prefix = 'r_'
+    shared_args = ('api_key', 'credentials', 'region', 'username')
+
     def __init__(
         self,
         api_key=None,
@@ -35,26 +40,20 @@ class CloudBase(ModuleBase):
         username=None
     ):
         super(CloudBase, self).__init__()
-        self.r_api_key = api_key
-        self.r_credentials = credentials
-        self.r_region = region
-        self.r_username = username
-
-    def _make_dict(self):
-        for prop, val in vars(self).items():
-            try:
-                split_ = prop.split('_')
-                head = split_[0]
-                key = "_".join(split_[1:])
-            except IndexError:
-                    continue
-            else:
-                if head == 'r' and val is not None:
-                    self.module_args[key] = val
-        self.module[self.module_name] = self.module_args
+        self.r_api_key = shared(api_key)
+        self.r_credentials = shared(credentials)
+        self.r_region = shared(region)
+        self.r_username = shared(username)
 
 
 class CloudServer(CloudBase):
+    __slots__ = (
+        'r_name', 'r_flavor', 'r_image', 'r_auto_increment', 'r_count',
+        'r_count_offset', 'r_disk_config', 'r_exact_count', 'r_files',
+        'r_group', 'r_identity_type', 'r_instance_ids', 'r_key_name',
+        'r_meta', 'r_networks', 'r_state', 'r_wait', 'r_wait_timeout',
+    )
+
     def __init__(
         self,
         name,
@@ -103,6 +102,11 @@ class CloudServer(CloudBase):
 
 
 class CloudServersAddHosts(ModuleBase):
+    __slots__ = (
+        'mod_module', 'mod_hostname', 'mod_ansible_ssh_host',
+        'mod_ansible_ssh_pass', 'mod_ansible_ssh_user', 'mod_groupname',
+    )
+
     def __init__(self, groups):
         """ Class to add add hosts task to a play; useful when creating
         servers with the 'rax' module
@@ -120,6 +124,11 @@ class CloudServersAddHosts(ModuleBase):
 
 
 class CloudLoadBal(CloudBase):
+    __slots__ = (
+        'r_name', 'r_algorithm', 'r_meta', 'r_port', 'r_protocol', 'r_state',
+        'r_timeout', 'r_type', 'r_vip_id', 'r_wait', 'r_wait_timeout',
+    )
+
     def __init__(
         self,
         name,
@@ -154,6 +163,12 @@ class CloudLoadBal(CloudBase):
 
 
 class CloudLoadBalNodes(CloudBase):
+    __slots__ = (
+        'r_name', 'r_load_balancer_id', 'r_address', 'r_condition',
+        'r_node_id', 'r_port', 'r_state', 'r_type', 'r_virtualenv', 'r_wait',
+        'r_wait_timeout', 'r_weight',
+    )
+
     def __init__(
         self,
         name,
@@ -190,6 +205,8 @@ class CloudLoadBalNodes(CloudBase):
 
 
 class CloudDns(CloudBase):
+    __slots__ = ('r_name', 'r_comment', 'r_email', 'r_state', 'r_ttl')
+
     def __init__(
         self,
         domain_name,
@@ -212,6 +229,11 @@ class CloudDns(CloudBase):
 
 
 class CloudDnsRecord(CloudBase):
+    __slots__ = (
+        'r_domain', 'r_name', 'r_data', 'r_comment', 'r_priority', 'r_state',
+        'r_ttl', 'r_type',
+    )
+
     def __init__(
         self,
         domain_name,
@@ -240,6 +262,11 @@ class CloudDnsRecord(CloudBase):
 
 
 class CloudFilesContainer(CloudBase):
+    __slots__ = (
+        'r_container', 'r_clear_meta', 'r_meta', 'r_private', 'r_public',
+        'r_ttl', 'r_type', 'r_web_error', 'r_web_index',
+    )
+
     def __init__(
         self,
         container,
@@ -270,6 +297,11 @@ class CloudFilesContainer(CloudBase):
 
 
 class CloudFilesObjects(CloudBase):
+    __slots__ = (
+        'r_container', 'r_clear_meta', 'r_dest', 'r_expires', 'r_meta',
+        'r_method', 'r_src', 'r_structure', 'r_type',
+    )
+
     def __init__(
         self,
         container,
@@ -300,6 +332,8 @@ class CloudFilesObjects(CloudBase):
 
 
 class CloudKeypair(CloudBase):
+    __slots__ = ('r_name', 'r_public_key', 'r_state')
+
     def __init__(
         self,
         name,
@@ -318,6 +352,8 @@ class CloudKeypair(CloudBase):
 
 
 class CloudNetwork(CloudBase):
+    __slots__ = ('r_label', 'r_cidr', 'r_state')
+
     def __init__(
         self,
         label,
@@ -336,6 +372,8 @@ class CloudNetwork(CloudBase):
 
 
 class CloudQueue(CloudBase):
+    __slots__ = ('r_name', 'r_state')
+
     def __init__(
         self,
         name,
@@ -352,6 +390,8 @@ class CloudQueue(CloudBase):
 
 
 class CloudFacts(CloudBase):
+    __slots__ = ('r_address', 'r_id', 'name')
+
     def __init__(
         self,
         display_name='Get Rackspace facts',
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of datemike: https://github.com/angstwad/datemike
+#
+# Copyright 2014 Paul Durivage
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module classes generated from the DOCUMENTATION of Ansible's own modules.
+
+Parsing thousands of module docs is slow, so it's done once, into an index
+file of each module's options:
+
+    python -m datemike.schema ~/src/ansible modules.json
+
+Loading the index only reads that file; a module's class is built the first
+time it is used:
+
+    from datemike import schema
+
+    modules = schema.load_index('modules.json')
+    copy = modules.copy('/etc/motd', src='motd')    # dest is required
+    task = Task(modules['community.general.ufw'](rule='allow', port='22'))
+
+Required options can be given positionally, in the order they are
+documented; all options can be given by name or by alias.  Options that
+only come from documentation fragments aren't in the index.
+"""
+
+import json
+import os
+import re
+import sys
+
+from datemike.base import _gc_paused, ModuleBase
+
+# Version of the index file layout; load_index() rejects any other.  Each
+# module's schema is stored as its own JSON string, so loading the index
+# only decodes the outer mapping and a schema is decoded on first use.
+FORMAT = 1
+
+_documentation = re.compile(
+    r'^DOCUMENTATION\s*=\s*[rRuU]?(\'\'\'|""")(.*?)\1',
+    re.DOTALL | re.MULTILINE)
+_release = re.compile(r'''^__version__\s*=\s*['"]([^'"]+)['"]''',
+                      re.MULTILINE)
+_identifier = re.compile(r'[A-Za-z_][A-Za-z0-9_]*\Z').match
+# Loaded indexes, by path, with the modification time they were loaded at
+_indexes = {}
+
+
+class SchemaModule(ModuleBase):
+    __slots__ = ()
+
+    # Set on each class synthesized from the index
+    schema_name = None
+    short_description = None
+    # Option names in documented order, the required ones among them, and
+    # the option each name or alias stands for
+    options = ()
+    required = ()
+    aliases = {}
+
+    def __init__(self, *args, **kwargs):
+        """ Base class of the module classes built from a ModuleIndex
+
+        :param args: Required options, in documented order
+        :param kwargs: Options by name or alias; display_name sets the task
+        name, which defaults to the module's short description
+        """
+        super(SchemaModule, self).__init__()
+        cls = type(self)
+        self.module_name = cls.schema_name
+        self.display_name = (kwargs.pop('display_name', None) or
+                             cls.short_description)
+        if len(args) > len(cls.required):
+            raise TypeError('%s() takes at most %d positional arguments '
+                            '(%d given)' % (cls.__name__, len(cls.required),
+                                            len(args)))
+        values = dict(zip(cls.required, args))
+        for key, value in kwargs.items():
+            name = cls.aliases.get(key)
+            if name is None:
+                raise TypeError('%s() got an unexpected keyword argument '
+                                '%r' % (cls.__name__, key))
+            if name in values:
+                raise TypeError('%s() got multiple values for option %r' %
+                                (cls.__name__, name))
+            values[name] = value
+        missing = [name for name in cls.required if name not in values]
+        if missing:
+            raise TypeError('%s() missing required options: %s' %
+                            (cls.__name__, ', '.join(missing)))
+        prefix = self.arg_prefix
+        for name, value in values.items():
+            setattr(self, prefix + name, value)
+
+
+def _class_name(module_name):
+    """ CamelCase class name for a module, e.g. ec2_group -> Ec2Group """
+    name = module_name.rsplit('.', 1)[-1]
+    return ''.join(part[:1].upper() + part[1:]
+                   for part in re.split(r'[^A-Za-z0-9]+', name)) or 'Module'
+
+
+class ModuleIndex(object):
+    def __init__(self, data):
+        """ Module schemas loaded from an index file, with a module class
+        built for each on first use, by name (modules['copy']) or, for names
+        that are identifiers, as an attribute (modules.copy)
+
+        :param data: Index contents, as written by build_index()
+        """
+        self.ansible_version = data.get('ansible_version')
+        self._modules = data['modules']
+        self._classes = {}
+
+    def __contains__(self, name):
+        return name in self._modules
+
+    def __iter__(self):
+        return iter(sorted(self._modules))
+
+    def __len__(self):
+        return len(self._modules)
+
+    def __getitem__(self, name):
+        try:
+            return self._classes[name]
+        except KeyError:
+            pass
+        description, options = json.loads(self._modules[name])
+        names = tuple(option[0] for option in options)
+        aliases = dict((n, n) for n in names)
+        for option in options:
+            for alias in option[3]:
+                aliases.setdefault(alias, option[0])
+        cls = type(_class_name(name), (SchemaModule,), {
+            '__slots__': tuple(SchemaModule.arg_prefix + n for n in names),
+            '__module__': __name__,
+            '__doc__': description,
+            'schema_name': name,
+            'short_description': description,
+            'options': names,
+            'required': tuple(o[0] for o in options if o[1]),
+            'aliases': aliases,
+        })
+        self._classes[name] = cls
+        return cls
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError('No module named %r in the index' % name)
+
+    def __dir__(self):
+        return sorted(set(dir(type(self))) |
+                      set(n for n in self._modules if _identifier(n)))
+
+
+def _json_value(value):
+    """ A documented default as a JSON-compatible value """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_json_value(v) for v in value]
+    if isinstance(value, dict):
+        return dict((str(k), _json_value(v)) for k, v in value.items())
+    return str(value)
+
+
+def _truthy(value):
+    """ Documentation uses yes/no, true/false and the odd string """
+    if isinstance(value, str):
+        return value.strip().lower() in ('yes', 'true', 'y', '1')
+    return bool(value)
+
+
+def parse_documentation(text):
+    """ Read the DOCUMENTATION block of a module's source
+
+    :param text: Module source as a string
+    :return: tuple of (module name, schema) or None if there's no usable
+    documentation; the schema is [short description, [[option name,
+    required, default, aliases], ...]]
+    """
+    match = _documentation.search(text)
+    if match is None:
+        return None
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    try:
+        doc = yaml.load(match.group(2), Loader=loader)
+    except yaml.YAMLError:
+        return None
+    if not isinstance(doc, dict) or not doc.get('module'):
+        return None
+    options = []
+    for name, spec in (doc.get('options') or {}).items():
+        name = str(name)
+        if not _identifier(name):
+            continue
+        if not isinstance(spec, dict):
+            spec = {}
+        aliases = [str(a) for a in spec.get('aliases') or ()
+                   if _identifier(str(a))]
+        options.append([name, _truthy(spec.get('required', False)),
+                        _json_value(spec.get('default')), aliases])
+    description = doc.get('short_description')
+    return str(doc['module']), [str(description) if description else None,
+                                options]
+
+
+def _module_files(root):
+    """ Paths of the files under an Ansible checkout or collection tree
+    that can hold modules: anything in a 'modules' or 'library' directory
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        parts = dirpath.split(os.sep)
+        if 'modules' not in parts and 'library' not in parts:
+            continue
+        for filename in sorted(filenames):
+            if (filename.startswith('__init__') or
+                    filename.endswith(('.pyc', '.ps1', '.md', '.yml'))):
+                continue
+            yield os.path.join(dirpath, filename)
+
+
+def _collection_prefix(path):
+    """ 'namespace.collection.' for a module inside ansible_collections """
+    parts = path.split(os.sep)
+    if 'ansible_collections' in parts:
+        i = len(parts) - 1 - parts[::-1].index('ansible_collections')
+        if len(parts) > i + 2:
+            return '%s.%s.' % (parts[i + 1], parts[i + 2])
+    return ''
+
+
+def build_index(root, path=None):
+    """ Parse the module documentation of an Ansible checkout, an installed
+    ansible package or a collections tree
+
+    :param root: Directory to search for modules
+    :param path: Write the index to this file as well
+    :return: dict of the index contents; module schemas are JSON strings
+    (see parse_documentation)
+    """
+    root = os.path.abspath(os.path.expanduser(root))
+    modules = {}
+    for filepath in _module_files(root):
+        try:
+            with open(filepath, 'rb') as f:
+                text = f.read().decode('utf-8')
+        except (IOError, UnicodeDecodeError):
+            continue
+        if 'DOCUMENTATION' not in text:
+            continue
+        parsed = parse_documentation(text)
+        if parsed is not None:
+            name, schema = parsed
+            modules.setdefault(_collection_prefix(filepath) + name,
+                               json.dumps(schema, separators=(',', ':')))
+    data = {'format': FORMAT, 'ansible_version': _ansible_version(root),
+            'modules': modules}
+    if path is not None:
+        path = os.path.abspath(os.path.expanduser(path))
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f, separators=(',', ':'), sort_keys=True)
+        os.rename(tmp, path)
+    return data
+
+
+def _ansible_version(root):
+    for candidate in ('lib/ansible/release.py', 'ansible/release.py',
+                      'lib/ansible/__init__.py', 'ansible/__init__.py'):
+        try:
+            with open(os.path.join(root, candidate)) as f:
+                match = _release.search(f.read())
+        except IOError:
+            continue
+        if match:
+            return match.group(1)
+    return None
+
+
+def load_index(path):
+    """ Load an index written by build_index().  Indexes are cached, so
+    loading the same unchanged file again returns the same ModuleIndex
+    (and the module classes already built from it).
+
+    :param path: Index filepath as a string
+    :return: ModuleIndex
+    """
+    path = os.path.abspath(os.path.expanduser(path))
+    mtime = os.stat(path).st_mtime
+    cached = _indexes.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with open(path) as f, _gc_paused():
+        data = json.load(f)
+    if data.get('format') != FORMAT:
+        raise ValueError('%s is a format %s module index; rebuild it with '
+                         'build_index()' % (path, data.get('format')))
+    index = ModuleIndex(data)
+    _indexes[path] = (mtime, index)
+    return index
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        sys.stderr.write('usage: python -m datemike.schema ANSIBLE_DIR '
+                         'INDEX_FILE\n')
+        return 2
+    data = build_index(argv[0], argv[1])
+    print('%d modules written to %s' % (len(data['modules']), argv[1]))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
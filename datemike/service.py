@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of datemike: https://github.com/angstwad/datemike
+#
+# Copyright 2014 Paul Durivage
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A small HTTP service rendering playbooks from JSON specs, for web front
+ends that build playbooks on the fly:
+
+    python -m datemike.service --port 8080
+
+POST a spec to /render and get the playbook back; GET /metrics for cache
+statistics.  A spec is a list of plays (or {"plays": [...]}, with
+"format": "json" for JSON output or "dedup": true for YAML aliases):
+
+    [{"name": "Web servers", "hosts": "localhost",
+      "tasks": [{"module": "CloudServer",
+                 "args": {"name": "web1", "flavor": "performance1-1",
+                          "image": "ubuntu"},
+                 "local_action": true, "register": "web"}]}]
+
+A task's module is either a module class name from datemike.providers,
+whose args are its constructor arguments, or any Ansible module name,
+whose args are the module's arguments.  Its other keys, and a play's
+other keys, are passed along as task and play arguments.
+
+Rendered playbooks are cached by a hash of the spec (so formatting
+doesn't matter, but key order, which shows in the output, does),
+evicting the least recently used entries beyond a number of entries or
+bytes, and entries older than a time to live.
+"""
+
+import hashlib
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from datemike import providers, utils
+from datemike.ansible import Play, Playbook, Task
+from datemike.loader import RawModule
+
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class RenderCache(object):
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024,
+                 ttl=300, clock=_clock):
+        """ Least recently used cache of rendered playbooks (as encoded
+        bytes), safe to use from several threads
+
+        :param max_entries: Most entries kept
+        :param max_bytes: Most bytes of rendered playbooks kept
+        :param ttl: Seconds an entry is served for, or None for no limit
+        :param clock: Function returning the time in seconds
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # key -> (time stored, body), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """ The body cached under key, or None (counted as a miss) """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and \
+                    self.clock() - entry[0] > self.ttl:
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.pop(key)
+            self._entries[key] = entry
+            return entry[1]
+
+    def put(self, key, body):
+        """ Cache a body under key, evicting old entries to make room.
+        Bodies larger than max_bytes aren't cached.
+        """
+        size = len(body)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (self.clock(), body)
+            self.bytes += size
+            while (len(self._entries) > self.max_entries or
+                   self.bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        self.bytes -= len(self._entries.pop(key)[1])
+
+    def metrics(self):
+        """ Counters and sizes
+
+        :return: dict
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return OrderedDict([
+                ('hits', self.hits),
+                ('misses', self.misses),
+                ('hit_rate', float(self.hits) / lookups if lookups else 0.0),
+                ('evictions', self.evictions),
+                ('expirations', self.expirations),
+                ('entries', len(self._entries)),
+                ('bytes', self.bytes),
+            ])
+
+
+def _module(spec):
+    module_name = spec.get('module')
+    if not isinstance(module_name, str):
+        raise ValueError('Every task needs a module name')
+    args = spec.get('args') or {}
+    if not isinstance(args, dict):
+        raise ValueError('Arguments of module %s must be an object' %
+                         module_name)
+    if module_name in providers.CLASSES:
+        cls = getattr(providers, module_name)
+        try:
+            module = cls(**args)
+        except TypeError as e:
+            raise ValueError('%s: %s' % (module_name, e))
+        if spec.get('name') is not None:
+            module.display_name = spec['name']
+        return module
+    return RawModule(module_name, args, spec.get('name', module_name))
+
+
+def build(spec):
+    """ Build a Playbook from a spec (see the module documentation)
+
+    :param spec: list of play specs, or dict with a 'plays' list
+    :return: Playbook
+    """
+    if isinstance(spec, dict):
+        spec = spec.get('plays')
+    if not isinstance(spec, list):
+        raise ValueError('A spec is a list of plays')
+    book = Playbook()
+    for play_spec in spec:
+        if not isinstance(play_spec, dict) or 'name' not in play_spec:
+            raise ValueError('Every play needs a name')
+        play_args = OrderedDict((k, v) for k, v in play_spec.items()
+                                if k not in ('name', 'tasks'))
+        task_specs = play_spec.get('tasks') or []
+        if not isinstance(task_specs, list):
+            raise ValueError('Tasks of play %s must be a list' %
+                             play_spec['name'])
+        play = Play(play_spec['name'], **play_args)
+        tasks = []
+        for task_spec in task_specs:
+            if not isinstance(task_spec, dict):
+                raise ValueError('Every task is an object')
+            task_args = OrderedDict(
+                (k, v) for k, v in task_spec.items()
+                if k not in ('module', 'args', 'name', 'local_action'))
+            tasks.append(Task(_module(task_spec),
+                              bool(task_spec.get('local_action')),
+                              **task_args))
+        if tasks:
+            play.add_task(tasks)
+        book.add_play(play)
+    return book
+
+
+class RenderService(object):
+    def __init__(self, cache=None):
+        """ WSGI application rendering playbook specs
+
+        :param cache: RenderCache; a default one if None
+        """
+        self.cache = cache if cache is not None else RenderCache()
+        self.renders = 0
+
+    def render(self, spec):
+        """ The rendered playbook for a spec, from the cache if possible
+
+        :param spec: Spec as decoded from JSON
+        :return: tuple of (content type, UTF-8 encoded playbook)
+        """
+        options = spec if isinstance(spec, dict) else {}
+        fmt = options.get('format', 'yaml')
+        if fmt not in ('yaml', 'json'):
+            raise ValueError('Unknown format: %s' % fmt)
+        # Keys are hashed in order: the order of play keys and module
+        # arguments carries through to the playbook
+        key = hashlib.sha1(json.dumps(
+            [utils.default_engine, spec], separators=(',', ':'),
+            ensure_ascii=False).encode('utf-8')).hexdigest()
+        body = self.cache.get(key)
+        if body is None:
+            book = build(spec)
+            if fmt == 'json':
+                text = book.to_json()
+            else:
+                text = book.to_yaml(bool(options.get('dedup')))
+            body = text.encode('utf-8')
+            self.renders += 1
+            self.cache.put(key, body)
+        if fmt == 'json':
+            return 'application/json', body
+        return 'application/x-yaml', body
+
+    def __call__(self, environ, start_response):
+        method = environ.get('REQUEST_METHOD', 'GET')
+        path = environ.get('PATH_INFO', '/')
+        if path == '/metrics' and method == 'GET':
+            metrics = self.cache.metrics()
+            metrics['renders'] = self.renders
+            return self._respond(start_response, '200 OK',
+                                 'application/json',
+                                 json.dumps(metrics).encode('utf-8'))
+        if path != '/render':
+            return self._error(start_response, '404 Not Found',
+                               'No such resource: %s' % path)
+        if method != 'POST':
+            return self._error(start_response, '405 Method Not Allowed',
+                               'Use POST to render')
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+            body = environ['wsgi.input'].read(length)
+            spec = json.loads(body.decode('utf-8'))
+            content_type, body = self.render(spec)
+        except ValueError as e:
+            return self._error(start_response, '400 Bad Request', str(e))
+        return self._respond(start_response, '200 OK', content_type, body)
+
+    def _error(self, start_response, status, message):
+        return self._respond(start_response, status, 'application/json',
+                             json.dumps({'error': message}).encode('utf-8'))
+
+    def _respond(self, start_response, status, content_type, body):
+        start_response(status, [
+            ('Content-Type', content_type + '; charset=utf-8'),
+            ('Content-Length', str(len(body)))])
+        return [body]
+
+
+def make_server(host='127.0.0.1', port=8080, app=None):
+    """ A threaded wsgiref server for the service
+
+    :param app: RenderService; a default one if None
+    :return: server; call serve_forever() on it
+    """
+    from socketserver import ThreadingMixIn
+    from wsgiref.simple_server import (make_server as _make_server,
+                                       WSGIRequestHandler, WSGIServer)
+
+    class Server(ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+
+    class Handler(WSGIRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    return _make_server(host, port, app or RenderService(), Server, Handler)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Render playbooks from '
+                                                 'JSON specs over HTTP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-entries', type=int, default=1024)
+    parser.add_argument('--max-bytes', type=int, default=64 * 1024 * 1024)
+    parser.add_argument('--ttl', type=float, default=300,
+                        help='seconds; 0 for no limit')
+    args = parser.parse_args(argv)
+    cache = RenderCache(args.max_entries, args.max_bytes, args.ttl or None)
+    server = make_server(args.host, args.port, RenderService(cache))
+    print('Serving on http://%s:%d/render' % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of datemike: https://github.com/angstwad/datemike
+#
+# Copyright 2014 Paul Durivage
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Opt-in timing of datemike's build stages:
+
+    from datemike import stats
+
+    with stats.collect() as report:
+        build_playbook().to_yaml_file('site.yml')
+    report.to_json(open('stats.json', 'w'))
+
+While collecting, the methods behind each stage are wrapped to count calls
+and wall time, per module class where it applies, and optionally the bytes
+allocated (with tracemalloc).  The original methods are put back when
+collection stops, so there is no cost at all otherwise.  Times are
+inclusive: pretty_yaml time (which includes the fast emitter used with
+the default engine) is also part of the to_yaml call it ran in.
+Collection is not thread-safe.
+"""
+
+import functools
+import json
+from collections import OrderedDict
+from timeit import default_timer
+
+from datemike import ansible, base, utils
+
+# Stage names, in build order
+STAGES = ('construct', 'make_dict', 'task', 'task_dict', 'add_task',
+          'add_play', 'to_yaml', 'pretty_yaml')
+
+# YAML emitters timed as the pretty_yaml stage: the fast ones are what
+# to_yaml uses with the default engine
+_EMITTERS = ('pretty_yaml', 'fast_yaml', 'fast_yaml_entries',
+             'fast_yaml_entry')
+
+# The active Report, if collecting
+_report = None
+# (owner, attribute name, original value) of every wrapped callable
+_patched = []
+# Whether enable() started tracemalloc, and so disable() should stop it
+_tracing = False
+
+
+def _class_name(args):
+    return type(args[0]).__name__
+
+
+def _task_class_name(args):
+    return type(args[1]).__name__
+
+
+def _dict_class_name(args):
+    # RawTasks have no module
+    task = args[0]
+    return type(task.module if task.module is not None else task).__name__
+
+
+class Report(object):
+    def __init__(self, allocations=False):
+        """ Counters collected by enable() or collect()
+
+        :param allocations: Whether allocated bytes are counted
+        """
+        self.allocations = allocations
+        self.stages = OrderedDict()
+        self._running = set()
+
+    def record(self, stage, name, seconds, allocated):
+        """ Add one call to a stage
+
+        :param stage: Stage name
+        :param name: Class name (of the module, for module and task
+        stages), or None
+        :param seconds: Wall time of the call
+        :param allocated: Bytes allocated by the call, or None
+        """
+        entry = self.stages.get(stage)
+        if entry is None:
+            entry = self.stages[stage] = self._counter()
+        self._add(entry, seconds, allocated)
+        if name is not None:
+            classes = entry.setdefault('classes', OrderedDict())
+            counter = classes.get(name)
+            if counter is None:
+                counter = classes[name] = self._counter()
+            self._add(counter, seconds, allocated)
+
+    def _counter(self):
+        counter = OrderedDict([('calls', 0), ('seconds', 0.0)])
+        if self.allocations:
+            counter['allocated'] = 0
+        return counter
+
+    def _add(self, counter, seconds, allocated):
+        counter['calls'] += 1
+        counter['seconds'] += seconds
+        if allocated is not None:
+            counter['allocated'] += allocated
+
+    def as_dict(self):
+        """ Get the counters of every stage that ran, in build order
+
+        :return: dict of stage name to a dict of calls, seconds,
+        allocated (if counted), and the same per class under 'classes' for
+        stages that record it
+        """
+        return OrderedDict((stage, self.stages[stage])
+                           for stage in STAGES if stage in self.stages)
+
+    def to_json(self, file_=None):
+        """ Dump the counters as JSON
+
+        :param file_: Open, writable file object
+        :return: str (JSON), if no file is given
+        """
+        if file_ is None:
+            return json.dumps(self.as_dict(), indent=2)
+        json.dump(self.as_dict(), file_, indent=2)
+
+
+def _wrap(func, stage, key=None):
+    """ Wrap func to record its calls under stage.  Calls made while the
+    stage is already running (such as a subclass __init__ calling its
+    base's) are part of the outer call and aren't recorded again.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        report = _report
+        if report is None or stage in report._running:
+            return func(*args, **kwargs)
+        report._running.add(stage)
+        if report.allocations:
+            before = _traced()
+        start = default_timer()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            seconds = default_timer() - start
+            allocated = _traced() - before if report.allocations else None
+            report._running.discard(stage)
+            report.record(stage, key(args) if key else None, seconds,
+                          allocated)
+    return wrapper
+
+
+def _traced():
+    import tracemalloc
+    return tracemalloc.get_traced_memory()[0]
+
+
+def _patch(owner, name, stage, key=None):
+    original = owner.__dict__[name]
+    _patched.append((owner, name, original))
+    setattr(owner, name, _wrap(original, stage, key))
+
+
+def _module_classes(cls=base.ModuleBase):
+    """ cls (a module or task class) and every class derived from it """
+    yield cls
+    for sub in cls.__subclasses__():
+        for klass in _module_classes(sub):
+            yield klass
+
+
+def enable(allocations=False):
+    """ Start collecting.  Module classes defined after this call are not
+    timed.
+
+    :param allocations: Also count bytes allocated per stage, using
+    tracemalloc (which slows everything down noticeably)
+    :return: Report being collected into
+    """
+    global _report, _tracing
+    if _report is not None:
+        raise ValueError('Stats are already being collected')
+    if allocations:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing = True
+    for cls in set(_module_classes()):
+        if '__init__' in cls.__dict__:
+            _patch(cls, '__init__', 'construct', _class_name)
+    for cls in set(_module_classes()):
+        if '_make_dict' in cls.__dict__:
+            _patch(cls, '_make_dict', 'make_dict', _class_name)
+    _patch(ansible.Task, '__init__', 'task', _task_class_name)
+    for cls in set(_module_classes(ansible.Task)):
+        if '_make_dict' in cls.__dict__:
+            _patch(cls, '_make_dict', 'task_dict', _dict_class_name)
+    _patch(ansible.Play, 'add_task', 'add_task')
+    _patch(ansible.Playbook, 'add_play', 'add_play')
+    for cls in (ansible.Task, ansible.Play, ansible.Playbook):
+        _patch(cls, 'to_yaml', 'to_yaml', _class_name)
+    # Modules that imported the emitters by name hold their own reference
+    for module in (utils, base, ansible):
+        for name in _EMITTERS:
+            if name in module.__dict__:
+                _patch(module, name, 'pretty_yaml')
+    _report = Report(allocations)
+    return _report
+
+
+def disable():
+    """ Stop collecting and restore the original methods
+
+    :return: Report that was collected into, or None if not collecting
+    """
+    global _report, _tracing
+    report, _report = _report, None
+    while _patched:
+        owner, name, original = _patched.pop()
+        setattr(owner, name, original)
+    if _tracing:
+        import tracemalloc
+        tracemalloc.stop()
+        _tracing = False
+    return report
+
+
+class collect(object):
+    def __init__(self, allocations=False):
+        """ Collect stats for the duration of a with block
+
+        :param allocations: Also count bytes allocated per stage
+        """
+        self.allocations = allocations
+
+    def __enter__(self):
+        return enable(self.allocations)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        disable()
@@ -17,25 +17,846 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import yaml
+import os
+import re
 from collections import OrderedDict
 
+# PyYAML is only imported once something needs it: output the dedicated
+# emitter can't write alone, or a YamlStream.  Short-lived processes that
+# just build modules and tasks never load it, nor hashlib and tempfile.
+
+ENGINES = ('auto', 'libyaml', 'pyyaml')
+# Engine used by pretty_yaml when none is given; see set_engine()
+default_engine = 'auto'
+
 
 def order_rep(dumper, data):
     """ YAML Dumper to represent OrderedDict """
     return dumper.represent_mapping(u'tag:yaml.org,2002:map', data.items(),
                                     flow_style=False)
 
-# Adds a representation for OrderedDicts
-yaml.add_representer(OrderedDict, order_rep)
+
+class _MergeKey(str):
+    """ The YAML merge key, '<<', which a plain string would be quoted as """
+    __slots__ = ()
+
+
+MERGE_KEY = _MergeKey('<<')
+
+
+def merge_rep(dumper, data):
+    """ YAML Dumper to represent the merge key """
+    return dumper.represent_scalar(u'tag:yaml.org,2002:merge', u'<<')
+
+
+# Dumper classes by (engine, anchor template); see _dumper()
+_dumpers = {}
+# PyYAML's default anchor names
+_ANCHOR_TEMPLATE = 'id%03d'
+
+
+def _dumper(engine, anchors=None):
+    """ A private subclass of the engine's Dumper with the OrderedDict
+    representer registered on it alone, leaving yaml.dump and other code's
+    dumpers as they are
+
+    :param engine: 'libyaml' (if installed; PyYAML otherwise) or 'pyyaml'
+    :param anchors: Template for anchor names (PyYAML only)
+    :return: yaml.Dumper or yaml.CDumper subclass
+    """
+    try:
+        return _dumpers[engine, anchors]
+    except KeyError:
+        pass
+    import yaml
+    base = yaml.Dumper
+    if engine == 'libyaml':
+        base = getattr(yaml, 'CDumper', base)
+    attrs = {'__module__': __name__}
+    if anchors is not None:
+        attrs['ANCHOR_TEMPLATE'] = anchors
+    dumper = type(base.__name__, (base,), attrs)
+    dumper.add_representer(OrderedDict, order_rep)
+    dumper.add_representer(_MergeKey, merge_rep)
+    _dumpers[engine, anchors] = dumper
+    return dumper
+
+
+def set_engine(engine):
+    """ Select the engine pretty_yaml uses by default
+
+    'auto' renders the plain mappings, lists and scalars datemike builds
+    with a dedicated emitter and hands anything else to libyaml (when it is
+    installed and known to produce the same bytes) or PyYAML.  'pyyaml'
+    always uses the pure-Python emitter.  'libyaml' always uses libyaml
+    when it is installed; it is the fastest generic engine but differs from
+    PyYAML for a few inputs such as characters outside the BMP.
+
+    :param engine: One of ENGINES
+    """
+    global default_engine
+    if engine not in ENGINES:
+        raise ValueError('Unknown YAML engine: %s' % engine)
+    default_engine = engine
 
 
-def pretty_yaml(value, file_=None):
+def pretty_yaml(value, file_=None, engine=None, anchors=None):
     """ Print an object to a YAML string
 
     :param value: object to dump
     :param file_: Open, writable file object
+    :param engine: One of ENGINES; defaults to the engine set by set_engine()
+    :param anchors: Template for anchor names, such as 'id%03d' (the
+    default); any other template is only supported by the PyYAML engine,
+    which is then used whenever anchors may be needed
     :return: str (YAML)
     """
-    return yaml.dump(value, stream=file_, indent=2, allow_unicode=True,
-                     default_flow_style=False)
+    engine = engine or default_engine
+    if engine not in ENGINES:
+        raise ValueError('Unknown YAML engine: %s' % engine)
+    if engine == 'auto':
+        text = fast_yaml(value)
+        if text is not None:
+            if file_ is None:
+                return text
+            file_.write(text)
+            return None
+        engine = 'libyaml' if _libyaml_safe(value) else 'pyyaml'
+    if anchors is not None and anchors != _ANCHOR_TEMPLATE:
+        dumper = _dumper('pyyaml', anchors)
+    else:
+        dumper = _dumper(engine)
+    import yaml
+    return yaml.dump(value, stream=file_, Dumper=dumper, indent=2,
+                     allow_unicode=True, default_flow_style=False)
+
+
+JSON_ENGINES = ('auto', 'json')
+# Encoder pretty_json uses for 'auto', chosen on first use; see _json_encoder
+_json_auto = None
+
+
+def _stdlib_json(value, indent):
+    import json
+    return json.dumps(value, ensure_ascii=False, indent=indent,
+                      separators=(',', ': ') if indent else (',', ':'))
+
+
+def _json_encoder():
+    """ orjson's dumps, wrapped to return text, if it is installed, or else
+    the standard library's.  Both keep mapping order and lay out compact
+    (or 2-space indented) JSON the same way, but the text of floats can
+    differ (orjson writes 1e16 where the standard library writes 1e+16),
+    and orjson writes NaN and infinities as null.
+    """
+    global _json_auto
+    if _json_auto is None:
+        try:
+            import orjson
+        except ImportError:
+            _json_auto = _stdlib_json
+        else:
+            def encode(value, indent):
+                if indent not in (None, 2):
+                    return _stdlib_json(value, indent)
+                option = orjson.OPT_INDENT_2 if indent else 0
+                try:
+                    return orjson.dumps(value, option=option).decode('utf-8')
+                except TypeError:
+                    # Non-string keys, integers over 64 bits, and the like
+                    return _stdlib_json(value, indent)
+            _json_auto = encode
+    return _json_auto
+
+
+def pretty_json(value, file_=None, indent=None, engine='auto'):
+    """ Print an object to a JSON string.  JSON is also YAML, so Ansible
+    reads it as a playbook too, and it is much faster to write and parse.
+
+    :param value: object to dump
+    :param file_: Open, writable file object
+    :param indent: Spaces to indent nested values by; compact if None
+    :param engine: 'auto' to use orjson when it is installed, or 'json' for
+    the standard library's encoder, whose output doesn't depend on what is
+    installed (orjson spells some floats differently)
+    :return: str (JSON), if no file is given
+    """
+    if engine not in JSON_ENGINES:
+        raise ValueError('Unknown JSON engine: %s' % engine)
+    encode = _json_encoder() if engine == 'auto' else _stdlib_json
+    text = encode(value, indent)
+    if file_ is None:
+        return text
+    file_.write(text)
+
+
+def dedup(value):
+    """ Make structurally identical mappings and lists in a value share one
+    object, so they are written once with a YAML anchor and then as
+    aliases.  Mappings that differ but share two or more items (the
+    credentials, region and domain of per-record tasks, say) get those
+    items from one anchored mapping through a YAML merge key ('<<').  The
+    value itself is not changed; containers are only copied where one of
+    their items was replaced.
+
+    :param value: object to deduplicate
+    :return: object with the same contents (once read back as YAML)
+    """
+    interned = {}
+
+    def intern(value):
+        if isinstance(value, dict):
+            items = [(k, intern(v)) for k, v in value.items()]
+            if isinstance(value, OrderedDict):
+                key = (type(value), tuple((k, v[1]) for k, v in items))
+            else:
+                # Plain dicts are written sorted, so their order is moot
+                key = (type(value), frozenset((k, v[1]) for k, v in items))
+            children = [(k, v[0]) for k, v in items]
+            changed = any(v is not value[k] for k, v in children)
+        elif isinstance(value, list):
+            items = [intern(v) for v in value]
+            key = (list, tuple(v[1] for v in items))
+            children = [v[0] for v in items]
+            changed = any(a is not b for a, b in zip(children, value))
+        else:
+            try:
+                hash(value)
+            except TypeError:
+                return value, (id(value),)
+            # Keep 1, 1.0 and True apart
+            return value, (type(value), value)
+        if not value:
+            return value, (id(value),)
+        try:
+            return interned[key]
+        except KeyError:
+            if changed:
+                value = type(value)(children)
+            # Stand in for the whole subtree in its parents' keys
+            interned[key] = (value, len(interned))
+            return interned[key]
+
+    return _merge_shared(intern(value)[0], interned)
+
+
+def _merge_shared(value, interned):
+    """ Factor the items that interned mappings share out into anchored
+    mappings merged back in with '<<'.  Plain dicts are written sorted, so
+    any shared items can go; OrderedDicts only give up their shared leading
+    items, as merged keys come first when the YAML is read back.
+
+    :param value: deduplicated object
+    :param interned: dedup's table of interned containers by key
+    :return: object with the same contents (once read back as YAML)
+    """
+    keys = {}
+    pairs = {}
+    for key, (obj, _) in interned.items():
+        if key[0] not in (dict, OrderedDict) or MERGE_KEY in obj:
+            continue
+        keys[id(obj)] = key
+        for pair in key[1]:
+            pairs[pair] = pairs.get(pair, 0) + 1
+
+    shares = {}
+    for obj_id, key in keys.items():
+        if key[0] is dict:
+            share = frozenset(p for p in key[1] if pairs[p] > 1)
+        else:
+            count = 0
+            for pair in key[1]:
+                if pairs[pair] < 2:
+                    break
+                count += 1
+            share = key[1][:count]
+        if len(share) > 1:
+            shares[obj_id] = share
+    users = {}
+    for share in shares.values():
+        users[share] = users.get(share, 0) + 1
+    shares = dict((i, share) for i, share in shares.items()
+                  if users[share] > 1)
+    if not shares:
+        return value
+
+    # Anchored mappings by the items they hold
+    merged = {}
+    done = {}
+
+    def rebuild(value):
+        try:
+            return done[id(value)]
+        except KeyError:
+            pass
+        if isinstance(value, dict):
+            children = [(k, rebuild(v) if isinstance(v, (dict, list)) else v)
+                        for k, v in value.items()]
+            if any(v is not value[k] for k, v in children):
+                result = type(value)(children)
+            else:
+                result = value
+            share = shares.get(id(value))
+            if share is None:
+                pass
+            elif len(share) == len(keys[id(value)][1]):
+                # Holds just the shared items: be the anchor itself
+                result = merged.setdefault(share, result)
+            else:
+                base = merged.get(share)
+                shared = set(k for k, _ in share)
+                if base is None:
+                    base = merged[share] = type(value)(
+                        (k, v) for k, v in children if k in shared)
+                result = type(value)(
+                    [(MERGE_KEY, base)] +
+                    [(k, v) for k, v in children if k not in shared])
+        else:
+            children = [rebuild(v) if isinstance(v, (dict, list)) else v
+                        for v in value]
+            if any(a is not b for a, b in zip(children, value)):
+                result = children
+            else:
+                result = value
+        done[id(value)] = result
+        return result
+
+    return rebuild(value)
+
+
+def content_hash(value):
+    """ A stable hash of everything about a value that shows in its YAML:
+    scalars and their types, mapping order where it is kept (OrderedDicts),
+    and which containers are shared.  Equal hashes mean equal output for
+    the same engine and options.
+
+    :param value: object to hash
+    :return: str (hex digest)
+    """
+    import hashlib
+    digest = hashlib.sha1()
+    update = digest.update
+    seen = {}
+
+    def feed(value):
+        type_ = type(value)
+        if type_ is str:
+            data = value.encode('utf-8')
+            update(b's%d:' % len(data))
+            update(data)
+        elif value is None or type_ in (bool, int, float):
+            update(b'%s:%r;' % (type_.__name__.encode(), value))
+        elif type_ in (dict, OrderedDict, list, tuple):
+            if id(value) in seen:
+                update(b'@%d;' % seen[id(value)])
+                return
+            seen[id(value)] = len(seen)
+            update(b'%s%d:' % (type_.__name__.encode(), len(value)))
+            if type_ is dict:
+                try:
+                    items = sorted(value.items(), key=lambda kv: kv[0])
+                except TypeError:
+                    items = sorted(value.items(), key=lambda kv: repr(kv[0]))
+            elif type_ is OrderedDict:
+                items = value.items()
+            else:
+                for item in value:
+                    feed(item)
+                return
+            for key, item in items:
+                feed(key)
+                feed(item)
+        else:
+            data = repr(value).encode('utf-8')
+            update(b'%s%d:' % (type_.__name__.encode(), len(data)))
+            update(data)
+
+    feed(value)
+    return digest.hexdigest()
+
+
+class atomic_write(object):
+    def __init__(self, filepath):
+        """ Open a temporary file next to filepath for writing, and move it
+        into place only once the with block completes, so readers never see
+        a partly written file
+
+            with atomic_write('site.yml') as f:
+                f.write(text)
+
+        :param filepath: Filepath as a string
+        """
+        self.filepath = os.path.abspath(os.path.expanduser(filepath))
+        self.file_ = None
+
+    def __enter__(self):
+        import tempfile
+        directory, name = os.path.split(self.filepath)
+        fd, self.tmp = tempfile.mkstemp(prefix='.%s.' % name, dir=directory)
+        self.file_ = os.fdopen(fd, 'w')
+        return self.file_
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.file_.close()
+        if exc_type is not None:
+            os.remove(self.tmp)
+            return
+        # mkstemp creates files readable by the owner only
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(self.tmp, 0o666 & ~umask)
+        getattr(os, 'replace', os.rename)(self.tmp, self.filepath)
+
+
+class _Unsupported(Exception):
+    """ Raised by _FastEmitter for values it can't render exactly """
+
+
+# PyYAML's scalar analysis and implicit type resolution, loaded by
+# _render_str when first needed
+_analyzer = None
+_resolver = None
+_STR_TAG = u'tag:yaml.org,2002:str'
+# Rendered form of every string seen so far, or None if it must be quoted in
+# a way the fast emitter doesn't handle
+_scalars = {}
+_SCALAR_CACHE_SIZE = 100000
+# Strings PyYAML always writes plain or single-quoted, without needing the
+# emitter's full analysis, and those among them starting with a letter that
+# resolve to bools or null
+_simple_plain = re.compile(r'[A-Za-z0-9][A-Za-z0-9_./-]*\Z').match
+_LETTER_SCALARS = frozenset(
+    [word for base in ('yes', 'no', 'true', 'false', 'on', 'off', 'null')
+     for word in (base, base.capitalize(), base.upper())]
+)
+
+
+def _load_analysis():
+    global _analyzer, _resolver
+    from yaml.emitter import Emitter
+    from yaml.nodes import ScalarNode
+    from yaml.resolver import Resolver
+    resolver = Resolver()
+
+    def resolve(text):
+        """ Tag PyYAML resolves a plain scalar to """
+        return resolver.resolve(ScalarNode, text, (True, False))
+
+    _analyzer = Emitter(None, allow_unicode=True)
+    _resolver = resolve
+
+
+def _render_str(text):
+    """ Render a string the way PyYAML's emitter would in block context
+
+    :param text: str
+    :return: str, or None if the string needs double quotes or more than
+    one line
+    """
+    try:
+        return _scalars[text]
+    except KeyError:
+        pass
+    if _simple_plain(text):
+        # Names, paths, addresses and the like: plain unless they look like
+        # another type (a number, bool, null or timestamp)
+        if text[0].isalpha():
+            implicit = text not in _LETTER_SCALARS
+        else:
+            if _resolver is None:
+                _load_analysis()
+            implicit = _resolver(text) == _STR_TAG
+        rendered = text if implicit else "'%s'" % text
+        if len(_scalars) >= _SCALAR_CACHE_SIZE:
+            _scalars.clear()
+        _scalars[text] = rendered
+        return rendered
+    if _analyzer is None:
+        _load_analysis()
+    analysis = _analyzer.analyze_scalar(text)
+    rendered = None
+    if not analysis.multiline:
+        implicit = _resolver(text) == _STR_TAG
+        if implicit and analysis.allow_block_plain and not analysis.empty:
+            rendered = text
+        elif analysis.allow_single_quoted:
+            rendered = "'%s'" % text.replace("'", "''")
+    if len(_scalars) >= _SCALAR_CACHE_SIZE:
+        _scalars.clear()
+    _scalars[text] = rendered
+    return rendered
+
+
+class _FastEmitter(object):
+    # Width at which PyYAML starts folding long scalars onto the next line
+    best_width = 80
+    # PyYAML writes keys this long (128 less the length of the implicit
+    # '!!str' tag) or empty as explicit "? key" entries
+    max_simple_key = 123
+
+    def __init__(self):
+        """ Writes the narrow shape of data datemike produces (dicts,
+        OrderedDicts and lists of strings, ints, bools and None) directly as
+        block-style YAML, byte-identical to pretty_yaml with PyYAML.
+        Anything else raises _Unsupported so the caller can fall back.
+        """
+        self.out = []
+        self.seen = set()
+
+    def render(self, value):
+        if not isinstance(value, (dict, list)):
+            raise _Unsupported()
+        if value:
+            self.node(value, 0)
+        else:
+            self.out.append(self.empty(value)[1:])
+        return ''.join(self.out)
+
+    def scalar(self, value, column):
+        if value is None:
+            return 'null'
+        type_ = type(value)
+        if type_ is str:
+            rendered = _render_str(value)
+            if rendered is None:
+                raise _Unsupported()
+            if (column + len(rendered) > self.best_width and
+                    ' ' in rendered):
+                raise _Unsupported()
+            return rendered
+        if type_ is bool:
+            return 'true' if value else 'false'
+        if type_ is int:
+            return str(value)
+        raise _Unsupported()
+
+    def remember(self, value):
+        """ PyYAML writes a collection seen twice as an anchor and alias """
+        if id(value) in self.seen:
+            raise _Unsupported()
+        self.seen.add(id(value))
+
+    def items(self, value):
+        """ Mapping items in the order PyYAML writes them """
+        if type(value) is OrderedDict:
+            return value.items()
+        if type(value) is dict:
+            try:
+                return sorted(value.items(), key=lambda kv: kv[0])
+            except TypeError:
+                raise _Unsupported()
+        raise _Unsupported()
+
+    def empty(self, value):
+        """ Flow-style text of an empty collection """
+        self.remember(value)
+        if type(value) is list:
+            return ' []\n'
+        if type(value) in (dict, OrderedDict):
+            return ' {}\n'
+        raise _Unsupported()
+
+    def fragment(self, item, indent):
+        """ Write the cached text of a Fragment as a sequence entry """
+        rendered = item.yaml_fragment(indent)
+        if rendered is None:
+            raise _Unsupported()
+        text, ids = rendered
+        if not self.seen.isdisjoint(ids):
+            raise _Unsupported()
+        self.seen.update(ids)
+        self.out.append(text)
+
+    def node(self, value, indent, inline=False):
+        """ Write a non-empty collection at the given indent.  If inline,
+        the first line continues a sequence entry already written.
+        """
+        out = self.out
+        pad = ' ' * indent
+        self.remember(value)
+        if type(value) is list:
+            for item in value:
+                if isinstance(item, Fragment) and not inline:
+                    self.fragment(item, indent)
+                    continue
+                out.append('-' if inline else pad + '-')
+                inline = False
+                if isinstance(item, (dict, list)):
+                    if not item:
+                        out.append(self.empty(item))
+                    else:
+                        out.append(' ')
+                        self.node(item, indent + 2, True)
+                else:
+                    out.append(' %s\n' % self.scalar(item, indent + 2))
+            return
+        for key, item in self.items(value):
+            if (type(key) is not str or not key or
+                    len(key) >= self.max_simple_key):
+                raise _Unsupported()
+            key = self.scalar(key, indent)
+            out.append(key + ':' if inline else pad + key + ':')
+            inline = False
+            if isinstance(item, (dict, list)):
+                if not item:
+                    out.append(self.empty(item))
+                elif type(item) is list:
+                    out.append('\n')
+                    self.node(item, indent)
+                else:
+                    out.append('\n')
+                    self.node(item, indent + 2)
+            else:
+                column = indent + len(key) + 2
+                out.append(' %s\n' % self.scalar(item, column))
+
+
+def fast_yaml(value):
+    """ Render value with the dedicated emitter
+
+    :param value: object to dump; lists in it may hold Fragments
+    :return: str (YAML), or None if value isn't made only of the plain
+    mappings, lists and scalars the dedicated emitter supports
+    """
+    try:
+        return _FastEmitter().render(value)
+    except _Unsupported:
+        return None
+
+
+def fast_yaml_entry(value, indent, transient=()):
+    """ Render value as one entry of a block sequence at the given indent,
+    for use as the text of a Fragment
+
+    :param value: object to dump; lists in it may hold Fragments
+    :param indent: column of the entry's '-' indicator
+    :param transient: temporary containers in value (views built just for
+    rendering) to leave out of the returned ids
+    :return: tuple of (str, set of ids of the containers written), or None
+    if the dedicated emitter can't render value
+    """
+    emitter = _FastEmitter()
+    wrapper = [value]
+    try:
+        emitter.node(wrapper, indent)
+    except _Unsupported:
+        return None
+    emitter.seen.discard(id(wrapper))
+    for obj in transient:
+        emitter.seen.discard(id(obj))
+    return ''.join(emitter.out), frozenset(emitter.seen)
+
+
+def fast_yaml_entries(values, indent):
+    """ Render the items of a list as the entries of a block sequence at
+    the given indent, as they appear when the list is nested in a mapping
+    written at that indent
+
+    :param values: list; may hold Fragments
+    :param indent: column of each entry's '-' indicator
+    :return: str (YAML), or None if the dedicated emitter can't render
+    values, or if items share containers and so need anchors
+    """
+    emitter = _FastEmitter()
+    try:
+        emitter.node(values, indent)
+    except _Unsupported:
+        return None
+    return ''.join(emitter.out)
+
+
+class Fragment(object):
+    """ Base class for objects that keep their own rendered YAML, such as
+    tasks and plays.  When the dedicated emitter meets one inside a list it
+    writes the cached text instead of rendering the object again.
+    """
+
+    def yaml_fragment(self, indent):
+        """ This object as a block sequence entry at the given indent
+
+        :param indent: column of the entry's '-' indicator
+        :return: tuple of (str, frozenset of the ids of the containers it
+        writes), or None if it can only be rendered by PyYAML
+        """
+        raise NotImplementedError
+
+
+_printable_ascii = re.compile(r'^[\x20-\x7e]*$').match
+
+
+def _libyaml_safe(value):
+    """ Whether libyaml is known to render value exactly like PyYAML: a
+    collection of single-line, printable ASCII strings with no empty or
+    very long keys
+    """
+    if not isinstance(value, (dict, list)):
+        return False
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            for key in item:
+                if (isinstance(key, str) and
+                        not 0 < len(key) < _FastEmitter.max_simple_key - 8):
+                    return False
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple)):
+            stack.extend(item)
+        elif isinstance(item, str) and not _printable_ascii(item):
+            return False
+    return True
+
+
+def yaml_dumper(file_):
+    """ Build a Dumper configured exactly like the one used by pretty_yaml
+
+    :param file_: Open, writable file object
+    :return: yaml.Dumper
+    """
+    return _dumper('pyyaml')(file_, indent=2, allow_unicode=True,
+                       default_flow_style=False)
+
+
+class YamlStream(object):
+    def __init__(self, file_):
+        """ Incrementally emit a single YAML document to an open file.
+
+        Block collections are opened and closed explicitly and values are
+        represented and written one at a time, so nothing but the value
+        currently being written is held in memory.  The bytes written are
+        the same pretty_yaml would produce for the equivalent document, as
+        long as separately written values share no objects (pretty_yaml
+        would turn those into anchors and aliases).
+
+        :param file_: Open, writable file object
+        """
+        self.dumper = yaml_dumper(file_)
+
+    def open(self):
+        """ Start the stream and its only document """
+        from yaml.events import DocumentStartEvent
+        self.dumper.open()
+        self.dumper.emit(DocumentStartEvent(explicit=False))
+
+    def close(self):
+        """ End the document and the stream """
+        from yaml.events import DocumentEndEvent
+        self.dumper.emit(DocumentEndEvent(explicit=False))
+        self.dumper.close()
+        self.dumper.dispose()
+
+    def start_sequence(self):
+        from yaml.events import SequenceStartEvent
+        self.dumper.emit(SequenceStartEvent(None, u'tag:yaml.org,2002:seq',
+                                            True, flow_style=False))
+
+    def end_sequence(self):
+        from yaml.events import SequenceEndEvent
+        self.dumper.emit(SequenceEndEvent())
+
+    def start_mapping(self):
+        from yaml.events import MappingStartEvent
+        self.dumper.emit(MappingStartEvent(None, u'tag:yaml.org,2002:map',
+                                           True, flow_style=False))
+
+    def end_mapping(self):
+        from yaml.events import MappingEndEvent
+        self.dumper.emit(MappingEndEvent())
+
+    def write(self, value):
+        """ Write a complete value (scalar, mapping key or collection)
+
+        :param value: object to dump
+        """
+        dumper = self.dumper
+        # Entries after the first of a block sequence are rendered by the
+        # dedicated emitter when they can be; by then PyYAML has written
+        # everything before them and holds no events back
+        if (not dumper.events and
+                dumper.state == dumper.expect_block_sequence_item):
+            rendered = fast_yaml_entry(value, dumper.indent)
+            if rendered is not None:
+                self._write_entry(rendered[0])
+                return
+        node = dumper.represent_data(value)
+        dumper.represented_objects = {}
+        dumper.object_keeper = []
+        dumper.alias_key = None
+        dumper.anchor_node(node)
+        dumper.serialize_node(node, None, None)
+        dumper.serialized_nodes = {}
+        dumper.anchors = {}
+
+    def _write_entry(self, text):
+        """ Write a rendered sequence entry and leave the PyYAML emitter as
+        if it had written the entry itself
+        """
+        dumper = self.dumper
+        if dumper.column:
+            dumper.write_line_break()
+        text = text[:-1]
+        dumper.stream.write(text)
+        dumper.column = len(text) - text.rfind('\n') - 1
+        dumper.whitespace = False
+        dumper.indention = False
+
+
+class JsonStream(object):
+    def __init__(self, file_):
+        """ Incrementally write a single compact JSON value to an open file,
+        with the same interface as YamlStream.  The text written is the
+        same pretty_json would produce for the equivalent value.
+
+        :param file_: Open, writable file object
+        """
+        self.file_ = file_
+        # For each open collection: [is a mapping, values written so far]
+        self._open = []
+
+    def open(self):
+        pass
+
+    def close(self):
+        if self._open:
+            raise ValueError('Cannot close a stream with open collections')
+        self.file_.write('\n')
+
+    def _separator(self):
+        if not self._open:
+            return ''
+        mapping, count = self._open[-1]
+        self._open[-1][1] += 1
+        if mapping and count % 2:
+            return ':'
+        return ',' if count else ''
+
+    def _start(self, mapping, text):
+        self.file_.write(self._separator() + text)
+        self._open.append([mapping, 0])
+
+    def _end(self, mapping, text):
+        if not self._open or self._open[-1][0] is not mapping:
+            raise ValueError('No open %s to end' %
+                             ('mapping' if mapping else 'sequence'))
+        self._open.pop()
+        self.file_.write(text)
+
+    def start_sequence(self):
+        self._start(False, '[')
+
+    def end_sequence(self):
+        self._end(False, ']')
+
+    def start_mapping(self):
+        self._start(True, '{')
+
+    def end_mapping(self):
+        self._end(True, '}')
+
+    def write(self, value):
+        """ Write a complete value (scalar, mapping key or collection)
+
+        :param value: object to dump
+        """
+        self.file_.write(self._separator() + pretty_json(value))
@@ -23,11 +23,14 @@ from datemike import __version__
 setup(
     name='datemike',
     version=__version__,
-    packages=['datemike'],
+    packages=['datemike', 'datemike.providers'],
     url='https://github.com/angstwad/datemike',
     license='Apache v2.0',
     author='Paul Durivage',
     author_email='pauldurivage@gmail.com',
     description='Create Ansible tasks, plays, and playbooks in pure Python',
-    install_requires=['pyyaml']
+    install_requires=['pyyaml'],
+    entry_points={
+        'console_scripts': ['datemike = datemike.cli:main'],
+    },
 )
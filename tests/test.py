@@ -2,12 +2,23 @@
 # -*- coding: utf-8 -*-
 from collections import OrderedDict
 
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
 import yaml
 
-from datemike import ansible, base, utils
+import datemike
+from datemike import (ansible, base, cli, delta, hosts, loader, planner,
+                      schema, service, stats, utils)
+from datemike import providers
 from datemike.providers import rackspace
 
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
 desired_task_yaml = """name: Create Cloud Server(s)
 rax:
   exact_count: true
@@ -73,13 +84,13 @@ class TestAnsible(unittest.TestCase):
 
     def test_task_localaction(self):
         task = ansible.Task(self.server, local_action=True)
-        yamlobj = yaml.load(task.to_yaml())
+        yamlobj = yaml.load(task.to_yaml(), Loader=yaml.SafeLoader)
         self.assertIn('local_action', yamlobj.keys(),
                       'local_action not in the parsed YAML object!')
 
     def test_task_localaction_module(self):
         task = ansible.Task(self.server, local_action=True)
-        yamlobj = yaml.load(task.to_yaml())
+        yamlobj = yaml.load(task.to_yaml(), Loader=yaml.SafeLoader)
         module = yamlobj.get('local_action')
         self.assertEqual(module.get('module'), 'rax',
                          'value of module not rax')
@@ -89,11 +100,11 @@ class TestAnsible(unittest.TestCase):
                          'value of flavor not performance1-1')
 
     def test_task(self):
-        yamlobj = yaml.load(self.task.to_yaml())
+        yamlobj = yaml.load(self.task.to_yaml(), Loader=yaml.SafeLoader)
         self.assertNotIn('local_action', yamlobj.keys())
 
     def test_task_module(self):
-        module = yaml.load(self.task.to_yaml())
+        module = yaml.load(self.task.to_yaml(), Loader=yaml.SafeLoader)
         self.assertIn('rax', module.keys())
         rax = module.get('rax')
         self.assertEqual(rax.get('image'), 'image-ubuntu-1204',
@@ -182,6 +193,1595 @@ class TestAnsible(unittest.TestCase):
                          'Playbook YAML output does not match intended YAML')
 
 
+class Ping(base.ModuleBase):
+    def __init__(self, data=None, extra=None):
+        super(Ping, self).__init__()
+        self.module_name = 'ping'
+        self.display_name = 'Ping'
+        self.mod_data = data
+        if extra is not None:
+            self.mod_extra_arg = extra
+        self.not_an_arg = 'ignored'
+
+
+class TestModuleBase(unittest.TestCase):
+    def test_mod_prefix(self):
+        self.assertEqual({'ping': {'data': 'pong'}}, Ping('pong').as_obj())
+        self.assertEqual({'ping': {}}, Ping().as_obj())
+
+    def test_layouts(self):
+        self.assertEqual({'ping': {'data': 'a', 'extra_arg': 1}},
+                         Ping('a', extra=1).as_obj())
+        self.assertEqual({'ping': {'data': 'b'}}, Ping('b').as_obj())
+
+    def test_r_prefix(self):
+        class Server(rackspace.CloudServer):
+            pass
+        server = Server('web', 'performance1-1', 'ubuntu', region='IAD')
+        server.mod_ignored = True
+        server.r_extra = 'extra'
+        args = server.as_obj()['rax']
+        self.assertEqual('extra', args['extra'])
+        self.assertEqual('IAD', args['region'])
+        self.assertEqual('web', args['name'])
+        self.assertNotIn('ignored', args)
+        self.assertNotIn('api_key', args)
+
+    def test_slots(self):
+        record = rackspace.CloudDnsRecord('example.com', 'www.example.com',
+                                          '10.0.0.1', region='DFW')
+        self.assertFalse(hasattr(record, '__dict__'))
+        self.assertEqual(
+            ['region', 'domain', 'name', 'data'],
+            list(record.as_obj()['rax_dns_record'].keys())
+        )
+
+
+class TestInvalidation(unittest.TestCase):
+    def setUp(self):
+        self.servers = [rackspace.CloudServer('web%d' % i, 'performance1-1',
+                                              'ubuntu', region='IAD')
+                        for i in range(3)]
+        self.tasks = [ansible.Task(self.servers[0]),
+                      ansible.Task(self.servers[1], local_action=True),
+                      ansible.Task(self.servers[2], register='rax')]
+        self.play = ansible.Play('Servers')
+        self.play.add_task(self.tasks)
+        self.book = ansible.Playbook()
+        self.book.add_play(self.play)
+
+    def reference(self, value):
+        return utils.pretty_yaml(value, engine='pyyaml')
+
+    def test_module_edit(self):
+        self.book.to_yaml()
+        self.servers[1].r_flavor = 'performance2-15'
+        self.assertEqual('performance2-15',
+                         self.tasks[1].as_obj()['local_action']['flavor'])
+        self.assertIn('performance2-15', self.play.to_yaml())
+        self.assertIn('performance2-15', self.book.to_yaml())
+        self.assertEqual(self.reference(self.book.as_obj()),
+                         self.book.to_yaml())
+        self.assertEqual(self.reference(self.play.as_obj()),
+                         self.play.to_yaml())
+
+    def test_plain_class(self):
+        server = rackspace.CloudServer('web', 'performance1-1', 'ubuntu')
+        self.assertIs(rackspace.CloudServer, type(server))
+        self.assertIsNone(server.module_args)
+        subclasses = len(rackspace.CloudServer.__subclasses__())
+        server.as_obj()
+        self.assertIs(rackspace.CloudServer, type(server))
+        self.assertEqual(subclasses,
+                         len(rackspace.CloudServer.__subclasses__()))
+        server.r_flavor = 'performance1-2'
+        self.assertIsNone(server.module)
+        self.assertEqual('performance1-2', server.as_obj()['rax']['flavor'])
+
+    def test_unset_argument(self):
+        self.servers[0].r_region = None
+        self.assertNotIn('region', self.tasks[0].as_obj()['rax'])
+
+    def test_unchanged_tasks_reuse_yaml(self):
+        self.book.to_yaml()
+        before = [t.yaml_fragment(2) for t in self.tasks]
+        self.servers[2].r_image = 'centos'
+        self.book.to_yaml()
+        after = [t.yaml_fragment(2) for t in self.tasks]
+        self.assertIs(before[0], after[0])
+        self.assertIs(before[1], after[1])
+        self.assertIsNot(before[2], after[2])
+
+    def test_play_edits(self):
+        self.book.to_yaml()
+        self.play.add_host('localhost')
+        self.assertIn('localhost', self.book.to_yaml())
+
+    def test_read_only_views(self):
+        with self.assertRaises(TypeError):
+            self.play.play['vars'] = {'a': 1}
+        with self.assertRaises(TypeError):
+            self.tasks[0].task['when'] = 'a'
+        with self.assertRaises(AttributeError):
+            self.book.playbook.append({})
+        self.book.to_yaml()
+        self.play.set_key('vars', {'a': 1})
+        self.assertEqual({'a': 1}, self.play.play['vars'])
+        self.assertEqual(['name', 'vars', 'tasks'], list(self.play.play))
+        self.assertIn('vars:', self.book.to_yaml())
+        self.tasks[0].task_args['when'] = 'a'
+        self.tasks[0].invalidate()
+        self.assertEqual('a', self.tasks[0].task['when'])
+        self.assertIn("when: a", self.book.to_yaml())
+
+    def test_shared_task(self):
+        self.play.add_task(self.tasks[0])
+        self.assertEqual(self.reference(self.book.as_obj()),
+                         self.book.to_yaml())
+
+    def test_pickle(self):
+        import pickle
+        task = pickle.loads(pickle.dumps(self.tasks[0]))
+        task.module.r_flavor = 'performance2-15'
+        self.assertEqual('performance2-15', task.as_obj()['rax']['flavor'])
+        self.assertIs(rackspace.CloudServer,
+                      type(pickle.loads(pickle.dumps(rackspace.CloudServer(
+                          'web', 'performance1-1', 'ubuntu')))))
+
+
+class TestLazyComposition(unittest.TestCase):
+    def servers(self, count):
+        for i in range(count):
+            yield rackspace.CloudServer('web%d' % i, 'performance1-1',
+                                        'ubuntu', region='IAD')
+
+    def test_task_built_on_use(self):
+        task = ansible.Task(Ping())
+        self.assertIsNone(task._task)
+        self.assertEqual({'name': 'Ping', 'ping': {}}, dict(task.as_obj()))
+
+    def test_play_accepts_generators(self):
+        play = ansible.Play('Servers')
+        play.add_task(ansible.Task(s) for s in self.servers(3))
+        play.add_host(h for h in ('web0', 'web1'))
+        play.add_role(iter(['common']))
+        self.assertIsNone(play._obj)
+        self.assertEqual(3, len(play.play['tasks']))
+        self.assertEqual(['web0', 'web1'], play.play['hosts'])
+        self.assertEqual(['common'], play.play['roles'])
+
+    def test_playbook_accepts_generators(self):
+        book = ansible.Playbook()
+        book.add_play(ansible.Play('Play %d' % i) for i in range(2))
+        self.assertEqual(['Play 0', 'Play 1'],
+                         [p['name'] for p in book.playbook])
+        self.assertEqual(utils.pretty_yaml(book.as_obj(), engine='pyyaml'),
+                         book.to_yaml())
+
+    def test_edit_after_as_obj(self):
+        servers = list(self.servers(2))
+        play = ansible.Play('Servers')
+        play.add_task(ansible.Task(s) for s in servers)
+        obj = play.as_obj()
+        servers[1].r_image = 'centos'
+        self.assertIs(obj, play.as_obj())
+        self.assertEqual('centos', obj['tasks'][1]['rax']['image'])
+
+
+class TestDedup(unittest.TestCase):
+    def make_play(self, name):
+        play = ansible.Play(name, hosts='localhost')
+        play.add_task(ansible.Task(rackspace.CloudLoadBalNodes(
+            'node', 1234, address='10.0.0.%d' % (i % 2), port=80,
+            credentials='~/.rax'), local_action=True) for i in range(4))
+        return play
+
+    def test_dedup_shares_identical_containers(self):
+        value = [OrderedDict([('a', [1, 2])]), OrderedDict([('a', [1, 2])]),
+                 {'b': 1, 'c': True}, {'c': True, 'b': 1}, {'b': True},
+                 {'b': 1.0}, []]
+        result = utils.dedup(value)
+        self.assertEqual(value, result)
+        self.assertIs(result[0], result[1])
+        self.assertIs(result[2], result[3])
+        self.assertIsNot(result[2], result[4])
+        self.assertIsNot(result[4], result[5])
+        self.assertIsNot(value[0], value[1])
+
+    def test_playbook_dedup(self):
+        book = ansible.Playbook()
+        book.add_play(self.make_play('Play %d' % i) for i in range(3))
+        text = book.to_yaml(dedup=True)
+        self.assertEqual(book.as_obj(),
+                         yaml.load(text, Loader=yaml.SafeLoader))
+        self.assertLess(len(text), len(book.to_yaml()) / 2)
+        self.assertIn('&id', text)
+        self.assertEqual(utils.pretty_yaml(utils.dedup(book.as_obj()),
+                                           engine='pyyaml'), text)
+
+    def test_play_dedup(self):
+        play = self.make_play('Nodes')
+        text = play.to_yaml(dedup=True)
+        # Two repeated tasks, and the arguments both addresses share
+        self.assertEqual(3, text.count('*id'))
+        self.assertEqual(1, text.count('<<: &id'))
+        self.assertEqual(play.as_obj(),
+                         yaml.load(text, Loader=yaml.SafeLoader))
+
+    def test_dedup_merges_shared_items(self):
+        value = [{'a': 1, 'b': 2, 'c': 3}, {'a': 1, 'b': 2, 'c': 4},
+                 {'a': 1, 'b': 2}, {'a': 1, 'd': 5}, {'a': 1, 'd': 6},
+                 OrderedDict([('a', 1), ('b', 2), ('e', 7)]),
+                 OrderedDict([('e', 8), ('a', 1), ('b', 2)]),
+                 OrderedDict([('a', 1), ('b', 2), ('e', 9)])]
+        result = utils.dedup(value)
+        self.assertEqual(value, yaml.load(utils.pretty_yaml(result),
+                                          Loader=yaml.SafeLoader))
+        self.assertIs(result[0]['<<'], result[2])
+        self.assertIs(result[1]['<<'], result[2])
+        # A single shared item isn't worth a merge
+        self.assertIs(result[3], value[3])
+        # Merged keys come first when read back, so only leading ones go
+        self.assertEqual(['<<', 'e'], list(result[5]))
+        self.assertIs(result[5]['<<'], result[7]['<<'])
+        self.assertIs(result[6], value[6])
+
+    def test_dedup_per_record_tasks(self):
+        play = ansible.Play('Records', hosts='localhost')
+        play.add_task(ansible.Task(rackspace.CloudDnsRecord(
+            'example.com', 'host%d.example.com' % i, '10.0.0.%d' % i,
+            credentials='~/.rax', region='DFW', ttl=300),
+            local_action=bool(i % 2)) for i in range(20))
+        book = ansible.Playbook()
+        book.add_play(play)
+        text = book.to_yaml(dedup=True)
+        self.assertEqual(2, text.count('<<: &id'))
+        self.assertEqual(20, text.count('<<:'))
+        self.assertLess(len(text), len(book.to_yaml()) * 0.75)
+        plays = list(loader.iter_plays(io.StringIO(text), engine='pyyaml'))
+        self.assertEqual(play.to_yaml(), plays[0].to_yaml())
+
+
+class TestBulk(unittest.TestCase):
+    columns = {
+        'fqdn': ['www.example.com', 'mail.example.com'],
+        'data': ['10.0.0.1', '10.0.0.2'],
+    }
+
+    def test_module_bulk(self):
+        records = rackspace.CloudDnsRecord.bulk(
+            self.columns, domain_name='example.com', region='IAD')
+        self.assertEqual(2, len(records))
+        self.assertEqual(
+            {'rax_dns_record': {'domain': 'example.com', 'region': 'IAD',
+                                'name': 'mail.example.com',
+                                'data': '10.0.0.2'}},
+            records[1].as_obj()
+        )
+
+    def test_task_bulk(self):
+        tasks = ansible.Task.bulk(
+            rackspace.CloudDnsRecord, self.columns,
+            constants={'domain_name': 'example.com'},
+            local_action=True, register='dns'
+        )
+        expected = ansible.Task(
+            rackspace.CloudDnsRecord('example.com', 'www.example.com',
+                                     '10.0.0.1'),
+            local_action=True, register='dns'
+        )
+        self.assertEqual(expected.to_yaml(), tasks[0].to_yaml())
+        module = tasks[0].module
+        self.assertIs(rackspace.CloudDnsRecord, type(module))
+        self.assertIsNot(tasks[0].task_args, tasks[1].task_args)
+        module.r_ttl = 60
+        self.assertIn('ttl: 60', tasks[0].to_yaml())
+
+    def test_bulk_mismatched_columns(self):
+        columns = {'fqdn': ['www.example.com'], 'data': []}
+        self.assertRaises(ValueError, rackspace.CloudDnsRecord.bulk,
+                          columns, domain_name='example.com')
+
+    def test_bulk_numpy(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest('NumPy is not installed')
+        nodes = rackspace.CloudLoadBalNodes.bulk(
+            {'name': numpy.array(['a', 'b']), 'port': numpy.arange(80, 82)},
+            load_balancer_id=1
+        )
+        self.assertIs(type(nodes[1].r_port), int)
+        self.assertEqual(81, nodes[1].r_port)
+
+
+class TestPlaybookWriter(unittest.TestCase):
+    def make_tasks(self, count):
+        return [ansible.Task(rackspace.CloudServer(
+            'server%d' % i, 'performance1-1', 'image-ubuntu-1204',
+            credentials='~/.rackspace_cloud_credentials', region='IAD'
+        ), register='rax%d' % i) for i in range(count)]
+
+    def make_play(self, name, count=0):
+        play = ansible.Play(name, gather_facts=False)
+        play.add_host('localhost')
+        play.add_role(['common', 'nginx'])
+        if count:
+            play.add_task(self.make_tasks(count))
+        return play
+
+    def test_writer_matches_to_yaml(self):
+        plays = [self.make_play('Play %d' % i, 3) for i in range(3)]
+        book = ansible.Playbook()
+        book.add_play(plays)
+        out = io.StringIO()
+        with ansible.PlaybookWriter(out) as writer:
+            writer.add_play(p for p in plays)
+        self.assertEqual(book.to_yaml(), out.getvalue())
+
+    def test_writer_streams_tasks(self):
+        book = ansible.Playbook()
+        book.add_play(self.make_play('Streamed', 5))
+        out = io.StringIO()
+        with ansible.PlaybookWriter(out) as writer:
+            with writer.play(self.make_play('Streamed')) as play_writer:
+                play_writer.add_task(iter(self.make_tasks(5)))
+        self.assertEqual(book.to_yaml(), out.getvalue())
+
+    def test_writer_empty_playbook(self):
+        out = io.StringIO()
+        with ansible.PlaybookWriter(out):
+            pass
+        self.assertEqual(ansible.Playbook().to_yaml(), out.getvalue())
+
+    def test_stream_to_file(self):
+        book = ansible.Playbook()
+        book.add_play(self.make_play('First', 2))
+        fd, path = tempfile.mkstemp(suffix='.yml')
+        os.close(fd)
+        try:
+            with book.stream_to(path) as writer:
+                writer.add_play(self.make_play('Second', 2))
+            book.add_play(self.make_play('Second', 2))
+            with open(path) as f:
+                self.assertEqual(book.to_yaml(), f.read())
+        finally:
+            os.remove(path)
+
+
+class TestParallelRendering(unittest.TestCase):
+    def make_tasks(self, count):
+        return [ansible.Task(rackspace.CloudServer(
+            'server%d' % i, 'performance1-1', 'image-ubuntu-1204', region='IAD'
+        )) for i in range(count)]
+
+    def make_play(self, name, count=0):
+        play = ansible.Play(name, hosts='localhost')
+        play.add_task(self.make_tasks(count))
+        play.add_role('common')
+        return play
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.chunk = ansible._TASK_CHUNK
+        ansible._TASK_CHUNK = 2
+        self.book = ansible.Playbook()
+        self.book.add_play(self.make_play('Play %d' % i, i * 3)
+                           for i in range(4))
+
+    def tearDown(self):
+        ansible._TASK_CHUNK = self.chunk
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_matches_to_yaml(self):
+        path = os.path.join(self.tmp, 'site.yml')
+        for processes in (1, 2):
+            self.book.to_yaml_file(path, processes=processes)
+            self.assertEqual(self.book.to_yaml(), self.read(path))
+
+    def test_shared_tasks(self):
+        play = self.make_play('Shared')
+        task = self.make_tasks(1)[0]
+        play.add_task([task, task, task])
+        self.book.add_play(play)
+        path = os.path.join(self.tmp, 'site.yml')
+        self.book.to_yaml_file(path, processes=1)
+        self.assertIn('&id4_001', self.read(path))
+        self.assertEqual(self.book.as_obj(),
+                         yaml.load(self.read(path), Loader=yaml.SafeLoader))
+
+    def test_shards(self):
+        paths = self.book.to_yaml_files(self.tmp, 2, processes=2)
+        self.assertEqual(3, len(paths))
+        self.assertEqual([{'import_playbook': 'site-000.yml'},
+                          {'import_playbook': 'site-001.yml'}],
+                         yaml.load(self.read(paths[0]),
+                                   Loader=yaml.SafeLoader))
+        plays = []
+        for path in paths[1:]:
+            plays.extend(yaml.load(self.read(path), Loader=yaml.SafeLoader))
+        self.assertEqual(self.book.as_obj(), plays)
+        self.assertEqual(paths, self.book.to_yaml_files(self.tmp, 2,
+                                                        processes=1))
+
+
+class TestIncremental(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.servers = [rackspace.CloudServer('server%d' % i, 'performance1-1',
+                                              'image-ubuntu-1204')
+                        for i in range(4)]
+        self.book = ansible.Playbook()
+        for i, server in enumerate(self.servers):
+            play = ansible.Play('Play %d' % i, hosts='localhost')
+            play.add_task(ansible.Task(server))
+            self.book.add_play(play)
+
+    def test_content_hash(self):
+        value = OrderedDict([('a', 1), ('b', [1, '1'])])
+        self.assertEqual(utils.content_hash(value),
+                         utils.content_hash(OrderedDict(value)))
+        self.assertNotEqual(utils.content_hash(value), utils.content_hash(
+            OrderedDict([('b', [1, '1']), ('a', 1)])))
+        self.assertNotEqual(utils.content_hash([1, '1']),
+                            utils.content_hash([1, 1]))
+        shared = [1]
+        self.assertNotEqual(utils.content_hash([shared, shared]),
+                            utils.content_hash([[1], [1]]))
+
+    def test_skips_unchanged(self):
+        path = os.path.join(self.tmp, 'site.yml')
+        self.assertTrue(self.book.to_yaml_file(path, incremental=True))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp,
+                                                    ansible.MANIFEST)))
+        self.assertFalse(self.book.to_yaml_file(path, incremental=True))
+        self.servers[0].r_flavor = 'performance1-2'
+        self.assertTrue(self.book.to_yaml_file(path, incremental=True))
+        with open(path) as f:
+            self.assertEqual(self.book.to_yaml(), f.read())
+        self.assertTrue(self.book.to_yaml_file(path, dedup=True,
+                                               incremental=True))
+
+    def test_task_argument_order(self):
+        path = os.path.join(self.tmp, 'site.yml')
+        book = ansible.Playbook()
+        play = ansible.Play('Build', hosts='localhost')
+        play.add_task(ansible.Task(self.servers[0], register='x', when='y'))
+        book.add_play(play)
+        book.to_yaml_file(path, incremental=True)
+        book = ansible.Playbook()
+        play = ansible.Play('Build', hosts='localhost')
+        play.add_task(ansible.Task(self.servers[0], when='y', register='x'))
+        book.add_play(play)
+        self.assertTrue(book.to_yaml_file(path, incremental=True))
+        with open(path) as f:
+            self.assertEqual(book.to_yaml(), f.read())
+
+    def test_rewrites_edited_file(self):
+        path = os.path.join(self.tmp, 'site.yml')
+        self.book.to_yaml_file(path, incremental=True)
+        with open(path, 'a') as f:
+            f.write('# edited\n')
+        self.assertTrue(self.book.to_yaml_file(path, incremental=True))
+
+    def test_shards(self):
+        paths = self.book.to_yaml_files(self.tmp, 2, incremental=True)
+        # Backdate the files, keeping the manifest in step, so rewritten
+        # ones stand out
+        manifest = ansible._Manifest(self.tmp)
+        for path in paths:
+            os.utime(path, ns=(1, 1))
+            manifest.record(path, manifest.entries[
+                os.path.basename(path)]['hash'])
+        manifest.save()
+        self.servers[3].r_flavor = 'performance1-2'
+        self.assertEqual(paths, self.book.to_yaml_files(self.tmp, 2,
+                                                        incremental=True))
+        touched = [os.stat(p).st_mtime_ns != 1 for p in paths]
+        self.assertEqual([False, False, True], touched)
+
+    def test_atomic_write(self):
+        path = os.path.join(self.tmp, 'site.yml')
+        with utils.atomic_write(path) as f:
+            f.write('old\n')
+        with self.assertRaises(RuntimeError):
+            with utils.atomic_write(path) as f:
+                f.write('new\n')
+                raise RuntimeError
+        with open(path) as f:
+            self.assertEqual('old\n', f.read())
+        self.assertEqual(['site.yml'], os.listdir(self.tmp))
+
+
+class TestFingerprint(unittest.TestCase):
+    def setUp(self):
+        self.server = rackspace.CloudServer('web', 'performance1-1', 'ubuntu')
+        self.task = ansible.Task(self.server)
+        self.play = ansible.Play('Build', hosts='localhost')
+        self.play.add_task(self.task)
+        self.play.add_task(ansible.Task(Ping('data')))
+        self.book = ansible.Playbook()
+        self.book.add_play(self.play)
+
+    def test_argument_order(self):
+        first = Ping('data', 'extra')
+        second = Ping()
+        second.mod_extra_arg = 'extra'
+        second.mod_data = 'data'
+        self.assertEqual(first.fingerprint(), second.fingerprint())
+        self.assertEqual(ansible.Task(first).fingerprint(),
+                         ansible.Task(second).fingerprint())
+        self.assertNotEqual(first.fingerprint(), Ping('data').fingerprint())
+
+    def test_memoized(self):
+        fingerprint = self.play.fingerprint()
+        self.assertIsNotNone(self.task._fingerprint)
+        hash_, base.content_hash = base.content_hash, None
+        try:
+            self.assertEqual(fingerprint, self.play.fingerprint())
+        finally:
+            base.content_hash = hash_
+
+    def test_changes_propagate(self):
+        fingerprints = [self.server.fingerprint(), self.task.fingerprint(),
+                        self.play.fingerprint(), self.book.fingerprint()]
+        self.server.r_flavor = 'performance1-2'
+        changed = [self.server.fingerprint(), self.task.fingerprint(),
+                   self.play.fingerprint(), self.book.fingerprint()]
+        for before, after in zip(fingerprints, changed):
+            self.assertNotEqual(before, after)
+        self.server.r_flavor = 'performance1-1'
+        self.assertEqual(fingerprints[2], self.play.fingerprint())
+
+    def test_play_keys(self):
+        fingerprint = self.play.fingerprint()
+        self.play.add_host('web1')
+        self.assertNotEqual(fingerprint, self.play.fingerprint())
+        other = ansible.Play('Build', hosts='localhost')
+        other.add_task(ansible.Task(Ping('data')))
+        other.add_task(ansible.Task(rackspace.CloudServer(
+            'web', 'performance1-1', 'ubuntu')))
+        self.assertNotEqual(self.play.fingerprint(), other.fingerprint())
+
+    def test_optimized_and_hoisted(self):
+        play = ansible.Play('Build', hosts='localhost')
+        for i in range(3):
+            play.add_task(ansible.Task(Ping('data%d' % i)))
+        before = play.fingerprint()
+        play.optimize()
+        loop = play._play['tasks'][0]
+        self.assertIsInstance(loop, ansible.LoopTask)
+        optimized = play.fingerprint()
+        self.assertNotEqual(before, optimized)
+        loop.tasks[1].module.mod_data = 'other'
+        self.assertNotEqual(optimized, play.fingerprint())
+        hoisted = ansible.Play('Build', hosts='localhost')
+        for name in ('a', 'b'):
+            hoisted.add_task(ansible.Task(rackspace.CloudServer(
+                name, 'performance1-1', 'ubuntu', region='IAD')))
+        before = hoisted.fingerprint()
+        hoisted.hoist()
+        self.assertNotEqual(before, hoisted.fingerprint())
+
+
+class TestJsonOutput(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.server = rackspace.CloudServer('web', 'performance1-1',
+                                            'ubuntu', region='IAD')
+        self.book = ansible.Playbook()
+        for i in range(3):
+            play = ansible.Play('Play %d' % i, hosts='localhost')
+            play.add_task(ansible.Task(self.server, register='web'))
+            play.add_role('common')
+            self.book.add_play(play)
+
+    def load(self, text):
+        return json.loads(text, object_pairs_hook=OrderedDict)
+
+    def test_to_json(self):
+        obj = self.book.as_obj()
+        self.assertEqual(obj, self.load(self.book.to_json()))
+        self.assertEqual(list(obj[0]), list(self.load(self.book.to_json())[0]))
+        self.assertEqual(obj, self.load(self.book.to_json(indent=2)))
+        self.assertEqual(obj[0], self.load(self.book._plays[0].to_json()))
+        self.assertEqual(self.server.as_obj(),
+                         self.load(self.server.to_json()))
+        self.assertEqual(json.dumps(obj, separators=(',', ':')),
+                         self.book.to_json())
+
+    def test_cached_until_changed(self):
+        first = self.book.to_json()
+        self.server.r_flavor = 'performance1-2'
+        self.assertNotEqual(first, self.book.to_json())
+        self.assertIn('performance1-2', self.book.to_json())
+
+    def test_engines(self):
+        value = OrderedDict([('b', [1, 2.5, None, True]), ('a', u'\xe9')])
+        self.assertEqual(utils.pretty_json(value),
+                         utils.pretty_json(value, engine='json'))
+        self.assertRaises(ValueError, utils.pretty_json, value,
+                          engine='yaml')
+
+    def test_file_and_stream(self):
+        path = os.path.join(self.tmp, 'site.json')
+        self.book.to_json_file(path)
+        with open(path) as f:
+            expected = f.read()
+        self.assertEqual(self.book.to_json() + '\n', expected)
+        out = io.StringIO()
+        with ansible.PlaybookWriter(out, format='json') as writer:
+            writer.add_play(self.book._plays[:2])
+            writer.play(self.book._plays[2]).close()
+        self.assertEqual(expected, out.getvalue())
+        out = io.StringIO()
+        play = ansible.Play('Streamed', hosts='localhost')
+        with self.book.stream_to(out, format='json') as writer:
+            with writer.play(play) as play_writer:
+                play_writer.add_task(ansible.Task(self.server) for _ in
+                                     range(2))
+        play.add_task([ansible.Task(self.server) for _ in range(2)])
+        self.book.add_play(play)
+        self.assertEqual(self.book.to_json() + '\n', out.getvalue())
+
+    def test_stream_errors(self):
+        stream = utils.JsonStream(io.StringIO())
+        stream.start_sequence()
+        self.assertRaises(ValueError, stream.end_mapping)
+        self.assertRaises(ValueError, stream.close)
+        self.assertRaises(ValueError, ansible.PlaybookWriter, 'x.txt',
+                          format='toml')
+
+
+class TestOptimize(unittest.TestCase):
+    def nodes(self, count, **kwargs):
+        return [ansible.Task(rackspace.CloudLoadBalNodes(
+            'web', '123', address='10.0.0.%d' % i, port=80), local_action=True,
+            **kwargs) for i in range(count)]
+
+    def records(self, count):
+        return [ansible.Task(rackspace.CloudDnsRecord(
+            'example.com', 'web%d.example.com' % i, '10.0.0.%d' % i,
+            ttl=300)) for i in range(count)]
+
+    def expand(self, task):
+        """ The module arguments of each loop iteration """
+        args = OrderedDict(task['local_action'])
+        del args['module']
+        rows = []
+        for item in task['with_items']:
+            row = OrderedDict()
+            for key, value in args.items():
+                if value == '{{ item }}':
+                    value = item
+                elif value == '{{ item.%s }}' % key:
+                    value = item[key]
+                row[key] = value
+            rows.append(row)
+        return rows
+
+    def test_folds_runs(self):
+        play = ansible.Play('Nodes', hosts='localhost')
+        nodes = self.nodes(3)
+        expected = [t.as_obj()['local_action'] for t in nodes]
+        play.add_task(nodes)
+        play.add_task(self.records(2))
+        self.assertEqual(3, play.optimize())
+        tasks = play.as_obj()['tasks']
+        self.assertEqual(2, len(tasks))
+        self.assertEqual('{{ item }}', tasks[0]['local_action']['address'])
+        self.assertEqual(['10.0.0.0', '10.0.0.1', '10.0.0.2'],
+                         tasks[0]['with_items'])
+        for row, original in zip(self.expand(tasks[0]), expected):
+            original = OrderedDict(original)
+            del original['module']
+            self.assertEqual(original, row)
+        self.assertEqual(['{{ item.name }}', '{{ item.data }}'],
+                         [tasks[1]['rax_dns_record'][k]
+                          for k in ('name', 'data')])
+        self.assertEqual(300, tasks[1]['rax_dns_record']['ttl'])
+        self.assertEqual(0, play.optimize())
+
+    def test_list_values(self):
+        play = ansible.Play('Servers', hosts='localhost')
+        networks = [['public'], ['public', 'private']]
+        play.add_task(ansible.Task(rackspace.CloudServer(
+            'web', 'performance1-1', 'ubuntu', networks=n), local_action=True)
+            for n in networks)
+        self.assertEqual(1, play.optimize())
+        task = play.as_obj()['tasks'][0]
+        self.assertEqual('{{ item.networks }}',
+                         task['local_action']['networks'])
+        self.assertEqual(networks,
+                         [row['networks'] for row in self.expand(task)])
+
+    def test_unfoldable(self):
+        play = ansible.Play('Nodes', hosts='localhost')
+        play.add_task(self.nodes(2, register='node'))
+        play.add_task(self.nodes(1))
+        play.add_task(self.nodes(2, sudo=True))
+        self.assertEqual(1, play.optimize())
+        self.assertEqual(4, len(play.as_obj()['tasks']))
+        play = ansible.Play('Nodes', hosts='localhost')
+        play.add_task(self.nodes(3))
+        self.assertEqual(0, play.optimize(min_run=4))
+
+    def test_changes_rebuild_loop(self):
+        play = ansible.Play('Nodes', hosts='localhost')
+        nodes = self.nodes(3)
+        play.add_task(nodes)
+        play.optimize()
+        book = ansible.Playbook()
+        book.add_play(play)
+        book.to_yaml()
+        nodes[1].module.r_port = 8080
+        task = play.as_obj()['tasks'][0]
+        self.assertEqual('{{ item.port }}', task['local_action']['port'])
+        self.assertEqual([80, 8080, 80],
+                         [row['port'] for row in self.expand(task)])
+        self.assertIn('8080', book.to_yaml())
+        self.assertEqual(yaml.load(book.to_yaml(), Loader=yaml.SafeLoader),
+                         book.as_obj())
+
+
+class TestAsyncTasks(unittest.TestCase):
+    def balancers(self, count, **kwargs):
+        return [ansible.Task(rackspace.CloudLoadBal(
+            'lb%d' % i, wait=True, wait_timeout=900), local_action=True,
+            **kwargs) for i in range(count)]
+
+    def test_fan_out(self):
+        play = ansible.Play('Balancers', hosts='localhost')
+        wait = play.add_async_tasks(self.balancers(3), delay=30)
+        tasks = play.as_obj()['tasks']
+        self.assertEqual(4, len(tasks))
+        for i, task in enumerate(tasks[:3]):
+            self.assertEqual((960, 0, 'async_0_%d' % i),
+                             (task['async'], task['poll'], task['register']))
+        self.assertIs(wait.as_obj(), tasks[3])
+        self.assertEqual(['{{ async_0_0 }}', '{{ async_0_1 }}',
+                          '{{ async_0_2 }}'], tasks[3]['with_items'])
+        self.assertEqual('async_status', tasks[3]['local_action']['module'])
+        self.assertEqual('{{ item.ansible_job_id }}',
+                         tasks[3]['local_action']['jid'])
+        self.assertEqual('async_0_status.finished', tasks[3]['until'])
+        self.assertEqual(33, tasks[3]['retries'])
+        play.add_async_tasks(self.balancers(1), timeout=60, register='lbs')
+        tasks = play.as_obj()['tasks']
+        self.assertEqual(('lbs_0', 60), (tasks[4]['register'],
+                                         tasks[4]['async']))
+        self.assertEqual(yaml.load(play.to_yaml(), Loader=yaml.SafeLoader),
+                         play.as_obj())
+
+    def test_loops(self):
+        play = ansible.Play('Nodes', hosts='localhost')
+        loop = ansible.LoopTask(ansible.Task(rackspace.CloudLoadBalNodes(
+            'web', '123', address='10.0.0.%d' % i), local_action=True)
+            for i in range(3))
+        play.add_async_tasks(loop)
+        tasks = play.as_obj()['tasks']
+        self.assertEqual(3, len(tasks[0]['with_items']))
+        self.assertEqual('async_0_0', tasks[0]['register'])
+        self.assertEqual(['{{ async_0_0.results }}'], tasks[1]['with_items'])
+
+    def test_invalid(self):
+        play = ansible.Play('Balancers', hosts='localhost')
+        self.assertIsNone(play.add_async_tasks([]))
+        self.assertRaises(ValueError, play.add_async_tasks,
+                          self.balancers(1, register='lb'))
+        mixed = self.balancers(1) + [ansible.Task(
+            rackspace.CloudLoadBal('remote'))]
+        self.assertRaises(ValueError, play.add_async_tasks, mixed)
+        self.assertNotIn('tasks', play.as_obj())
+
+
+class TestHostSet(unittest.TestCase):
+    def test_ordered_set(self):
+        host_set = hosts.HostSet(h for h in ['web2', 'web1', 'web2'])
+        self.assertEqual(['web2', 'web1'], list(host_set))
+        self.assertEqual(['web3'], host_set.update(['web1', 'web3']))
+        self.assertFalse(host_set.add('web3'))
+        self.assertIn('web3', host_set)
+        host_set.discard('web2')
+        self.assertEqual(['web1', 'web3'], list(host_set))
+        self.assertEqual(['db'], list(hosts.HostSet('db')))
+
+    def test_patterns(self):
+        names = ['web%03d.iad' % i for i in range(1, 501)]
+        names += ['web9', 'web10', 'web11', 'db1', 'lb', '10.0.0.1',
+                  '10.0.0.2', 'n[1]']
+        host_set = hosts.HostSet(names)
+        patterns = host_set.patterns()
+        self.assertEqual(['web[001:500].iad', 'web[9:11]', 'db1', 'lb',
+                          '10.0.0.[1:2]', 'n[1]'], patterns)
+        self.assertEqual(host_set, hosts.HostSet.from_patterns(patterns))
+        self.assertEqual(['x08', 'x09', 'x10'], hosts.expand('x[08:10]'))
+        self.assertEqual(['db-a1', 'db-a2', 'db-c1', 'db-c2'],
+                         hosts.expand('db-[a:c:2][1:2]'))
+        self.assertRaises(ValueError, hosts.expand, 'x[8:10:]x[01:100]')
+
+    def test_inventory(self):
+        host_set = hosts.HostSet('web%d' % i for i in range(1, 4))
+        inventory = yaml.load(utils.pretty_yaml(host_set.to_inventory('web')),
+                              Loader=yaml.SafeLoader)
+        self.assertEqual({'web': {'hosts': {'web[1:3]': None}}}, inventory)
+
+    def test_play_add_host(self):
+        play = ansible.Play('Web', hosts='localhost')
+        play.add_host(['web1', 'localhost', 'web1'])
+        play.add_host(hosts.HostSet(['web2', 'web1']))
+        self.assertEqual(['localhost', 'web1', 'web2'],
+                         play.as_obj()['hosts'])
+        self.assertEqual(['localhost', 'web[1:2]'],
+                         play.host_set().patterns())
+
+
+class TestHoist(unittest.TestCase):
+    def servers(self, count, **kwargs):
+        return [ansible.Task(rackspace.CloudServer(
+            'web%d' % i, 'performance1-1', 'ubuntu', **kwargs))
+            for i in range(count)]
+
+    def test_hoist(self):
+        play = ansible.Play('Servers', hosts='localhost')
+        play.add_task(self.servers(3, region='IAD', credentials='~/.rax'))
+        play.add_task(ansible.Task(rackspace.CloudLoadBalNodes(
+            'web', '123', region='DFW'), local_action=True))
+        book = ansible.Playbook()
+        book.add_play(play)
+        book.to_yaml()
+        self.assertEqual(3, book.hoist())
+        obj = play.as_obj()
+        self.assertEqual(['name', 'hosts', 'module_defaults', 'tasks'],
+                         list(obj))
+        self.assertEqual({'rax': {'region': 'IAD', 'credentials': '~/.rax'},
+                          'rax_clb_nodes': {'region': 'DFW'}},
+                         obj['module_defaults'])
+        self.assertNotIn('region', obj['tasks'][0]['rax'])
+        self.assertNotIn('region', obj['tasks'][3]['local_action'])
+        self.assertIn('module_defaults', book.to_yaml())
+        self.assertEqual(0, play.hoist())
+
+    def test_raw_task_modules(self):
+        play = ansible.Play('Servers', hosts='localhost')
+        play.add_task(self.servers(2, region='IAD'))
+        play.add_task(ansible.Task(rackspace.CloudLoadBalNodes(
+            'web', '123', region='DFW'), local_action=True))
+        raw = ansible.RawTask({'block': [
+            {'rax': {'name': 'db', 'flavor': 'f', 'image': 'i'}},
+            {'action': 'ping'}]})
+        play.add_task(raw)
+        self.assertEqual({'rax', 'ping'}, raw.module_names())
+        self.assertEqual(1, play.hoist())
+        obj = play.as_obj()
+        self.assertEqual({'rax_clb_nodes': {'region': 'DFW'}},
+                         obj['module_defaults'])
+        self.assertEqual('IAD', obj['tasks'][0]['rax']['region'])
+
+    def test_uncommon_args_stay(self):
+        play = ansible.Play('Servers', hosts='localhost')
+        tasks = self.servers(2, region='IAD')
+        tasks += self.servers(1, region='ORD', credentials='~/.rax')
+        play.add_task(tasks)
+        self.assertEqual(0, play.hoist())
+        self.assertEqual(1, play.hoist(args=['image']))
+        tasks[0].module.r_image = 'centos'
+        obj = play.as_obj()
+        self.assertEqual('centos', obj['tasks'][0]['rax']['image'])
+        self.assertNotIn('image', obj['tasks'][1]['rax'])
+
+    def test_flyweight(self):
+        region = ''.join(['I', 'A', 'D'])
+        first = rackspace.CloudServer('a', 'f', 'i', region='IAD')
+        second = rackspace.CloudServer('b', 'f', 'i', region=region)
+        self.assertIs(first.r_region, second.r_region)
+        self.assertEqual([1], base.shared([1]))
+        base.shared(1)
+        self.assertIs(True, base.shared(True))
+
+
+class TestLoader(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.book = ansible.Playbook()
+        play = ansible.Play('Nodes', hosts='localhost', gather_facts=False)
+        play.add_task(ansible.Task(rackspace.CloudLoadBalNodes(
+            'web', '123', address='10.0.0.%d' % i, region='IAD'),
+            local_action=True) for i in range(3))
+        play.add_task(ansible.Task(rackspace.CloudServer(
+            'web%d' % i, 'performance1-1', 'ubuntu', region='IAD'),
+            register='server') for i in range(2))
+        play.add_task(ansible.Task(Ping(), when='server.changed'))
+        self.book.add_play(play)
+        play = ansible.Play('Handlers', hosts='web')
+        play.add_task(ansible.Task(Ping()))
+        play.add_role('common')
+        self.book.add_play(play)
+        self.path = os.path.join(self.tmp, 'site.yml')
+
+    def round_trip(self, **kwargs):
+        self.book.to_yaml_file(self.path)
+        return ansible.Playbook.from_yaml_file(self.path, **kwargs)
+
+    def test_round_trip(self):
+        book = self.round_trip()
+        self.assertEqual(self.book.to_yaml(), book.to_yaml())
+        tasks = book._plays[0]._play['tasks']
+        self.assertIsInstance(tasks[0].module, rackspace.CloudLoadBalNodes)
+        self.assertIsInstance(tasks[3].module, rackspace.CloudServer)
+        self.assertIsInstance(tasks[5].module, loader.RawModule)
+        self.assertTrue(tasks[0].local_action)
+        tasks[3].module.r_flavor = 'performance1-2'
+        self.assertIn('performance1-2', book.to_yaml())
+        for engine in ('libyaml', 'pyyaml'):
+            with open(self.path) as f:
+                plays = list(loader.iter_plays(f, engine=engine))
+            self.assertEqual(self.book.as_obj(), [p.as_obj() for p in plays])
+
+    def test_optimized(self):
+        for play in self.book._plays:
+            play.optimize()
+            play.hoist()
+        # Loops come back as Tasks with with_items before the module
+        self.assertEqual(json.loads(self.book.to_json()),
+                         json.loads(self.round_trip().to_json()))
+        self.book.to_yaml_file(self.path, dedup=True)
+        book = ansible.Playbook.from_yaml_file(self.path)
+        self.assertEqual(json.loads(self.book.to_json()),
+                         json.loads(book.to_json()))
+
+    def test_optimized_remote_loop(self):
+        play = ansible.Play('Servers', hosts='localhost')
+        play.add_task(ansible.Task(rackspace.CloudServer(
+            'web%d' % i, 'performance1-1', 'ubuntu', region='IAD'))
+            for i in range(3))
+        play.optimize()
+        self.book = ansible.Playbook()
+        self.book.add_play(play)
+        book = self.round_trip()
+        tasks = book._plays[0]._play['tasks']
+        self.assertEqual([ansible.Task], [type(t) for t in tasks])
+        self.assertIsInstance(tasks[0].module, rackspace.CloudServer)
+        self.assertEqual(json.loads(self.book.to_json()),
+                         json.loads(book.to_json()))
+        name, module, args, keys = loader.split_task(tasks[0].as_obj())
+        self.assertEqual('rax', module)
+        self.assertEqual(3, len(keys['with_items']))
+        task = loader.make_task({'ping': None, 'with_fileglob': ['*.txt']})
+        self.assertIsInstance(task.module, loader.RawModule)
+
+    def test_unnamed_tasks(self):
+        text = ('- hosts: localhost\n  tasks:\n  - rax:\n      name: web\n'
+                '  - copy:\n      dest: /tmp/x\n      src: x\n'
+                '    with_items: [1, 2]\n')
+        with open(self.path, 'w') as f:
+            f.write(text)
+        book = ansible.Playbook.from_yaml_file(self.path)
+        self.assertEqual(yaml.safe_load(text), json.loads(book.to_json()))
+        self.assertNotIn('name: null', book.to_yaml())
+        self.assertNotIn('name: null', ansible.Task(
+            rackspace.CloudServersAddHosts('web'), True).to_yaml())
+
+    def test_anchors_per_document(self):
+        text = ('- hosts: a\n  vars: &v {x: 1}\n  tasks: []\n'
+                '---\n- hosts: b\n  vars: *v\n')
+        for engine in ('libyaml', 'pyyaml'):
+            self.assertRaises(ValueError, list,
+                              loader.iter_plays(io.StringIO(text),
+                                                engine=engine))
+        text = text.replace('*v', '&v {x: 2}\n  roles: [*v]')
+        plays = list(loader.iter_plays(io.StringIO(text), engine='pyyaml'))
+        self.assertEqual(['a', 'b'], [p.as_obj()['hosts'] for p in plays])
+
+    def test_raw_tasks(self):
+        with open(self.path, 'w') as f:
+            f.write('- hosts: all\n  tasks:\n  - shell: echo hi\n'
+                    '  - block:\n    - ping:\n  - include_tasks: x.yml\n')
+        tasks = ansible.Playbook.from_yaml_file(self.path)._plays[0]._play[
+            'tasks']
+        self.assertEqual([ansible.RawTask] * 3, [type(t) for t in tasks])
+        self.assertEqual({'shell': 'echo hi'}, tasks[0].as_obj())
+        self.assertEqual([], list(loader.iter_plays(io.StringIO(''))))
+
+    def test_stream_tasks(self):
+        self.book._plays[0]._play['handlers'] = [
+            OrderedDict([('name', 'restart'), ('service', 'name=web')])]
+        self.book.to_yaml_file(self.path)
+        out = io.StringIO()
+        with ansible.PlaybookWriter(out) as writer:
+            for play, tasks in loader.iter_plays(self.path, tasks=True):
+                self.assertEqual([], play.as_obj()['tasks'])
+                with writer.play(play) as play_writer:
+                    play_writer.add_task(tasks)
+        self.assertEqual(self.book.to_yaml(), out.getvalue())
+        # Tasks left unread are skipped
+        plays = [p for p, _ in loader.iter_plays(self.path, tasks=True)]
+        self.assertEqual(['Nodes', 'Handlers'],
+                         [p.as_obj()['name'] for p in plays])
+        self.assertIn('handlers', plays[0].as_obj())
+
+    def test_module_class(self):
+        self.assertIs(rackspace.CloudDnsRecord,
+                      providers.module_class('rax_dns_record'))
+        self.assertIsNone(providers.module_class('ping'))
+
+
+class TestService(unittest.TestCase):
+    SPEC = [{'name': 'Web', 'hosts': 'localhost', 'gather_facts': False,
+             'tasks': [{'module': 'CloudServer',
+                        'args': {'name': 'web1', 'flavor': 'performance1-1',
+                                 'image': 'ubuntu'},
+                        'local_action': True, 'register': 'web'},
+                       {'module': 'ping', 'name': 'Ping'}]}]
+
+    def setUp(self):
+        self.app = service.RenderService()
+
+    def request(self, method, path, body=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        environ = {'REQUEST_METHOD': method, 'PATH_INFO': path,
+                   'CONTENT_LENGTH': str(len(data)),
+                   'wsgi.input': io.BytesIO(data)}
+        status = []
+        body = self.app(environ, lambda s, headers: status.append(s))
+        return status[0], b''.join(body).decode('utf-8')
+
+    def test_render(self):
+        status, text = self.request('POST', '/render', self.SPEC)
+        self.assertEqual('200 OK', status)
+        expected = ansible.Play('Web', hosts='localhost', gather_facts=False)
+        expected.add_task(ansible.Task(rackspace.CloudServer(
+            'web1', 'performance1-1', 'ubuntu'), True, register='web'))
+        expected.add_task(ansible.Task(loader.RawModule('ping', {}, 'Ping')))
+        book = ansible.Playbook()
+        book.add_play(expected)
+        self.assertEqual(book.to_yaml(), text)
+        status, text = self.request('POST', '/render',
+                                    {'plays': self.SPEC, 'format': 'json'})
+        self.assertEqual(book.as_obj(), json.loads(text))
+
+    def test_cache_metrics(self):
+        for _ in range(3):
+            self.request('POST', '/render', self.SPEC)
+        # Key order shows in the playbook, so it gets an entry of its own
+        reordered = [OrderedDict(reversed(list(self.SPEC[0].items())))]
+        self.assertNotEqual(self.request('POST', '/render', self.SPEC),
+                            self.request('POST', '/render', reordered))
+        metrics = json.loads(self.request('GET', '/metrics')[1])
+        self.assertEqual((3, 2, 2, 2), (metrics['hits'], metrics['misses'],
+                                        metrics['renders'],
+                                        metrics['entries']))
+
+    def test_errors(self):
+        self.assertEqual('404 Not Found', self.request('GET', '/x')[0])
+        self.assertEqual('405 Method Not Allowed',
+                         self.request('GET', '/render')[0])
+        for spec in ({'plays': 1}, [{'hosts': 'all'}],
+                     [{'name': 'x', 'tasks': [{'module': 'CloudServer'}]}],
+                     [{'name': 'x', 'tasks': 5}]):
+            status, text = self.request('POST', '/render', spec)
+            self.assertEqual('400 Bad Request', status)
+            self.assertIn('error', json.loads(text))
+
+    def test_eviction(self):
+        now = [0.0]
+        cache = service.RenderCache(max_entries=2, max_bytes=10, ttl=60,
+                                    clock=lambda: now[0])
+        cache.put('a', b'1234')
+        cache.put('b', b'1234')
+        self.assertEqual(b'1234', cache.get('a'))
+        cache.put('c', b'1234')
+        self.assertIsNone(cache.get('b'))
+        cache.put('d', b'123456')
+        self.assertEqual(['c', 'd'], list(cache._entries))
+        cache.put('e', b'12345678901')
+        self.assertIsNone(cache.get('e'))
+        now[0] = 61
+        self.assertIsNone(cache.get('d'))
+        metrics = cache.metrics()
+        self.assertEqual((2, 1, 1, 4), (metrics['evictions'],
+                                        metrics['expirations'],
+                                        metrics['entries'],
+                                        metrics['bytes']))
+
+
+class TestCli(unittest.TestCase):
+    CSV = ('hostname,flavor,image,region,group\n'
+           'web1,performance1-1,ubuntu,IAD,web\n'
+           'web2,performance1-1,ubuntu,IAD,web\n'
+           'db1,performance1-2,centos,DFW,\n')
+
+    def run_cli(self, args, text):
+        out = io.StringIO()
+        status = cli.main(args, stdin=io.StringIO(text), stdout=out)
+        return status, out.getvalue()
+
+    def test_csv_groups(self):
+        status, text = self.run_cli(
+            ['-m', 'CloudServer', '-i', 'csv', '--map', 'name=hostname',
+             '--group-by', 'region'], self.CSV)
+        self.assertEqual(0, status)
+        book = ansible.Playbook()
+        for region, servers in (('IAD', ['web1', 'web2']), ('DFW', ['db1'])):
+            play = ansible.Play('Provision: %s' % region, hosts='localhost')
+            for server in servers:
+                if server == 'db1':
+                    module = rackspace.CloudServer(
+                        server, 'performance1-2', 'centos', region=region)
+                else:
+                    module = rackspace.CloudServer(
+                        server, 'performance1-1', 'ubuntu', region=region,
+                        group='web')
+                play.add_task(ansible.Task(module, True))
+            book.add_play(play)
+        self.assertEqual(book.to_yaml(), text)
+
+    def test_jsonl(self):
+        rows = '\n'.join(json.dumps(row) for row in [
+            {'domain_name': 'example.com', 'fqdn': 'a.example.com',
+             'data': '10.0.0.1', 'ttl': 300},
+            {'domain_name': 'example.com', 'fqdn': 'b.example.com',
+             'data': '10.0.0.2', 'ttl': 300}])
+        status, text = self.run_cli(['-m', 'rax_dns_record', '--play-size',
+                                     '1', '--task-arg', 'register=dns',
+                                     '-f', 'json'], rows)
+        self.assertEqual(0, status)
+        plays = json.loads(text)
+        self.assertEqual(2, len(plays))
+        task = plays[1]['tasks'][0]
+        self.assertEqual('dns', task['register'])
+        self.assertEqual(300, task['local_action']['ttl'])
+        self.assertEqual('b.example.com', task['local_action']['name'])
+
+    def test_bad_row(self):
+        err = io.StringIO()
+        stderr, sys.stderr = sys.stderr, err
+        try:
+            status, text = self.run_cli(['-m', 'CloudServer'],
+                                        '{"name": "web1"}\n')
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(1, status)
+        self.assertEqual('', text)
+        self.assertIn('line 1', err.getvalue())
+        with self.assertRaises(ValueError):
+            cli.module_class('NoSuchModule')
+
+    def test_streams(self):
+        mapper = cli.RowMapper(rackspace.CloudServer)
+
+        def rows():
+            for i in range(3):
+                yield i + 1, {'name': 'web%d' % i, 'flavor': 'f',
+                              'image': 'i'}
+                # Each row's task is written before the next is read
+                self.assertEqual(i + 1, out.getvalue().count('- name: C'))
+        out = io.StringIO()
+        self.assertEqual(3, cli.stream(rows(), mapper, out))
+
+    def test_failed_stream_aborts(self):
+        path = os.path.join(tempfile.mkdtemp(), 'site.yml')
+        rows = [(1, {'name': 'web0', 'flavor': 'f', 'image': 'i'}),
+                (2, {'name': 'web1'})]
+        mapper = cli.RowMapper(rackspace.CloudServer)
+        self.assertRaises(ValueError, cli.stream, rows, mapper, path)
+        self.assertFalse(os.path.exists(path))
+        out = io.StringIO()
+        with ansible.PlaybookWriter(out, format='json') as writer:
+            writer.add_play(ansible.Play('Done'))
+        self.assertEqual([{'name': 'Done'}], json.loads(out.getvalue()))
+        out = io.StringIO()
+        with self.assertRaises(KeyError):
+            with ansible.PlaybookWriter(out, format='json') as writer:
+                writer.add_play(ansible.Play('Partial'))
+                raise KeyError('stop')
+        self.assertRaises(ValueError, json.loads, out.getvalue())
+
+
+class TestDiff(unittest.TestCase):
+    def book(self, flavors=None, order=None, extra=False):
+        flavors = flavors or {}
+        play = ansible.Play('Build', hosts='localhost')
+        for i in order or range(4):
+            play.add_task(ansible.Task(rackspace.CloudServer(
+                'web%d' % i, flavors.get(i, 'performance1-1'), 'ubuntu'),
+                True, register='web%d' % i))
+        if extra:
+            play.add_task(ansible.Task(rackspace.CloudDnsRecord(
+                'example.com', 'www.example.com', '10.0.0.1'), True))
+        book = ansible.Playbook()
+        book.add_play(play)
+        book.add_play(ansible.Play('Bootstrap', hosts='web'))
+        return book
+
+    def test_unchanged(self):
+        result = datemike.diff(self.book(), self.book(order=[3, 1, 0, 2]))
+        self.assertFalse(result)
+        self.assertEqual(4, result.summary()['tasks_unchanged'])
+        self.assertEqual('', str(result))
+
+    def test_changes(self):
+        result = datemike.diff(self.book(extra=True),
+                               self.book({2: 'performance1-2'}, [0, 2, 3]))
+        self.assertTrue(result)
+        play = result.plays[0]
+        self.assertEqual(['web1', 'www.example.com'],
+                         [t['local_action']['name'] for t in play.removed])
+        change, = play.changed
+        self.assertEqual({'name': 'web2'}, dict(change.key))
+        self.assertEqual({'flavor': ('performance1-1', 'performance1-2')},
+                         dict(change.args))
+        self.assertFalse(result.plays[1])
+        self.assertIn("flavor: 'performance1-1' -> 'performance1-2'",
+                      str(result))
+
+    def test_plays_and_keys(self):
+        old = self.book()
+        new = self.book()
+        new._plays[1].add_host('db')
+        new.add_play(ansible.Play('Deploy', hosts='web'))
+        result = delta.diff(old, new)
+        self.assertEqual(['Deploy'], [p['name'] for p in result.added])
+        self.assertEqual({'hosts': ('web', ['web', 'db'])},
+                         dict(result.plays[1].keys))
+        task = old._plays[0].as_obj()['tasks'][0]
+        changed = OrderedDict(task)
+        changed['when'] = 'new'
+        result = delta.diff([{'name': 'p', 'tasks': [task]}],
+                            [{'name': 'p', 'tasks': [changed]}])
+        self.assertEqual({'when': (delta.MISSING, 'new')},
+                         dict(result.plays[0].changed[0].keys))
+        json.dumps(result.as_obj())
+        copy = [{'name': 'Copy', 'copy': {'dest': '/etc/motd',
+                                          'owner': 'a'}},
+                {'name': 'Ping', 'ping': None}]
+        result = delta.diff([{'name': 'p', 'tasks': copy}], [{
+            'name': 'p', 'tasks': [{'name': 'Copy', 'copy': {
+                'dest': '/etc/motd', 'owner': 'b'}}]}])
+        self.assertEqual({'owner': ('a', 'b')},
+                         dict(result.plays[0].changed[0].args))
+        self.assertEqual(['Ping'],
+                         [t['name'] for t in result.plays[0].removed])
+
+    def test_loop_tasks(self):
+        books = []
+        for last in ('web2', 'web3'):
+            play = ansible.Play('Build', hosts='localhost')
+            play.add_task(ansible.Task(rackspace.CloudServer(
+                name, 'performance1-1', 'ubuntu'))
+                for name in ('web0', 'web1', last))
+            play.optimize()
+            books.append([play.as_obj()])
+        result = delta.diff(*books)
+        play = result.plays[0]
+        self.assertEqual(([], []), (play.added, play.removed))
+        self.assertEqual({'with_items': (['web0', 'web1', 'web2'],
+                                         ['web0', 'web1', 'web3'])},
+                         dict(play.changed[0].keys))
+
+    def test_files(self):
+        tmp = tempfile.mkdtemp()
+        old, new = self.book(), self.book({0: 'performance1-2'})
+        old.to_yaml_file(os.path.join(tmp, 'old.yml'))
+        new.to_json_file(os.path.join(tmp, 'new.json'))
+        result = delta.diff(os.path.join(tmp, 'old.yml'),
+                            os.path.join(tmp, 'new.json'))
+        self.assertEqual(1, result.summary()['tasks_changed'])
+        self.assertEqual(result.as_obj(), delta.diff(old, new).as_obj())
+        self.assertEqual(0, delta.main([os.path.join(tmp, 'old.yml')] * 2))
+
+
+class TestPlanner(unittest.TestCase):
+    def setUp(self):
+        self.book = ansible.Playbook()
+        create = ansible.Play('Create', hosts='localhost')
+        create.add_task(ansible.Task(rackspace.CloudServer(
+            'web', 'performance1-1', 'ubuntu', count=40, group='web'), True,
+            register='rax'))
+        create.add_task(ansible.Task(rackspace.CloudServersAddHosts('web'),
+                                     True, with_items='rax.success'))
+        self.bootstrap = ansible.Play('Bootstrap', hosts='web')
+        self.bootstrap.add_task(ansible.Task(Ping(), with_items=[1, 2, 3]))
+        self.bootstrap.add_task(ansible.Task(Ping()))
+        self.book.add_play(create)
+        self.book.add_play(self.bootstrap)
+
+    def test_host_counts(self):
+        self.assertEqual([1, 40], planner.host_counts(self.book._plays))
+        play = ansible.Play('Hosts', hosts='db1')
+        play.add_host(['db2', 'db3'])
+        self.assertEqual([3], planner.host_counts([play]))
+        create = ansible.Play('Create', hosts='localhost')
+        create.add_task(ansible.Task(rackspace.CloudServer(
+            'web', 'performance1-1', 'ubuntu', group='web'),
+            with_items=[1, 2, 3], register='rax'))
+        create.add_task(ansible.Task(rackspace.CloudServersAddHosts('web'),
+                                     True, with_items='rax.success'))
+        self.assertEqual([1, 3], planner.host_counts(
+            [create, ansible.Play('Web', hosts='web')]))
+
+    def test_plan(self):
+        idle = planner.plan(3, 4, forks=5)
+        self.assertEqual(('linear', None, None, 40.0),
+                         (idle.strategy, idle.serial, idle.throttle,
+                          idle.seconds))
+        busy = planner.plan(40, 4, forks=20)
+        self.assertEqual(('free', None, 80.0),
+                         (busy.strategy, busy.throttle, busy.seconds))
+        limited = planner.plan(40, 4, forks=20, rate=1, task_seconds=10)
+        self.assertEqual((10, 160.0), (limited.throttle, limited.seconds))
+        rolling = planner.plan(40, 4, forks=5, rolling=True)
+        self.assertEqual(([1, 5], 'linear'),
+                         (rolling.serial, rolling.strategy))
+        self.assertEqual((1 + 8) * 40.0, rolling.seconds)
+        self.assertRaises(ValueError, planner.plan, 1, 1, forks=0)
+
+    def test_apply(self):
+        plans = self.book.plan(forks=20, rate=2, task_seconds=5)
+        self.assertEqual([2, 4], [p.tasks for p in plans])
+        self.assertEqual(OrderedDict([('strategy', 'free'),
+                                      ('throttle', 10)]),
+                         plans[1].play_args())
+        play = self.bootstrap.as_obj()
+        self.assertEqual(['name', 'hosts', 'strategy', 'throttle', 'tasks'],
+                         list(play))
+        self.assertEqual({}, plans[0].play_args())
+        plan = self.bootstrap.plan(hosts=2, apply=False)
+        self.assertEqual('linear', plan.strategy)
+        self.assertEqual('free', self.bootstrap.as_obj()['strategy'])
+
+    def test_replan(self):
+        play = self.bootstrap
+        play.plan(hosts=100, forks=20, rate=0.5)
+        self.assertEqual(('free', 5), (play.as_obj()['strategy'],
+                                       play.as_obj()['throttle']))
+        play.plan(hosts=3)
+        self.assertEqual(['name', 'hosts', 'tasks'], list(play.as_obj()))
+        play.plan(hosts=100, forks=20, rate=0.5)
+        play.plan(hosts=3, rolling=True)
+        self.assertEqual(OrderedDict([('serial', [1, 3])]),
+                         OrderedDict((k, v) for k, v in play.as_obj().items()
+                                     if k in planner.PLAY_KEYWORDS))
+        self.assertNotIn('strategy', play.to_yaml())
+
+
+class TestStats(unittest.TestCase):
+    def build(self):
+        play = ansible.Play('Servers')
+        play.add_task(ansible.Task(rackspace.CloudServer(
+            'web%d' % i, 'performance1-1', 'ubuntu')) for i in range(3))
+        play.add_task(ansible.Task(Ping(), local_action=True))
+        book = ansible.Playbook()
+        book.add_play(play)
+        return book.to_yaml()
+
+    def test_collect(self):
+        with stats.collect() as report:
+            self.build()
+        counters = report.as_dict()
+        self.assertEqual(['construct', 'make_dict', 'task', 'task_dict',
+                          'add_task', 'add_play', 'to_yaml', 'pretty_yaml'],
+                         list(counters))
+        self.assertEqual(4, counters['construct']['calls'])
+        self.assertEqual(3, counters['construct']['classes']['CloudServer']
+                         ['calls'])
+        self.assertEqual(1, counters['task_dict']['classes']['Ping']['calls'])
+        self.assertNotIn('classes', counters['add_task'])
+        self.assertEqual(counters, json.loads(report.to_json()))
+
+    def test_subclasses(self):
+        play = ansible.Play('Servers')
+        play.add_task(ansible.Task(rackspace.CloudServer(
+            'web%d' % i, 'performance1-1', 'ubuntu')) for i in range(3))
+        play.optimize()
+        raw = ansible.RawTask({'shell': 'echo hi'})
+        play.add_task(raw)
+        make_dict = ansible.LoopTask.__dict__['_make_dict']
+        self.assertEqual('auto', utils.default_engine)
+        with stats.collect() as report:
+            raw.invalidate()
+            play.to_yaml()
+        counters = report.as_dict()
+        self.assertEqual(1, counters['pretty_yaml']['calls'])
+        self.assertEqual(['CloudServer', 'RawTask'],
+                         sorted(counters['task_dict']['classes']))
+        self.assertIs(make_dict, ansible.LoopTask.__dict__['_make_dict'])
+
+    def test_disable_restores(self):
+        init = rackspace.CloudServer.__dict__['__init__']
+        with stats.collect(allocations=True) as report:
+            self.assertIsNot(init, rackspace.CloudServer.__dict__['__init__'])
+            utils.pretty_yaml({'a': 1})
+        self.assertIs(init, rackspace.CloudServer.__dict__['__init__'])
+        self.assertGreater(report.as_dict()['pretty_yaml']['allocated'], 0)
+        self.assertIsNone(stats.disable())
+        self.build()
+        self.assertEqual(['pretty_yaml'], list(report.as_dict()))
+
+
+class TestLazyImports(unittest.TestCase):
+    def test_import_skips_yaml(self):
+        code = ('import sys, datemike; '
+                'from datemike.providers.rackspace import CloudServer; '
+                'print(sorted(m for m in ("yaml", "multiprocessing", '
+                '"datemike.delta", "tempfile", "hashlib", "json") '
+                'if m in sys.modules))')
+        out = subprocess.check_output([sys.executable, '-c', code],
+                                      cwd=ROOT)
+        self.assertEqual('[]', out.decode('utf-8').strip())
+
+    def test_representer_is_private(self):
+        self.assertEqual(utils.pretty_yaml(OrderedDict(a=1),
+                                           engine='pyyaml'), 'a: 1\n')
+        self.assertIsNot(utils.order_rep,
+                         yaml.Dumper.yaml_representers.get(OrderedDict))
+
+    def test_provider_registry(self):
+        self.assertEqual(sorted(rackspace.__all__),
+                         sorted(providers.CLASSES))
+        self.assertIs(rackspace.CloudServer, providers.CloudServer)
+        self.assertIs(rackspace, providers.provider('rackspace'))
+        self.assertIn('CloudDns', dir(providers))
+        self.assertRaises(AttributeError, getattr, providers, 'Missing')
+
+
+class ReferenceDumper(yaml.Dumper):
+    pass
+
+ReferenceDumper.add_representer(OrderedDict, utils.order_rep)
+
+
+COPY_MODULE = """#!/usr/bin/python
+DOCUMENTATION = \'\'\'
+---
+module: copy
+short_description: Copies files to remote locations.
+options:
+  src:
+    description: Local path to a file to copy
+    required: false
+  dest:
+    required: true
+  backup:
+    default: "no"
+    choices: [ "yes", "no" ]
+  force:
+    default: "yes"
+    aliases: [ "thirsty" ]
+\'\'\'
+"""
+
+UFW_MODULE = '''DOCUMENTATION = r"""
+module: ufw
+short_description: Manage firewall with UFW
+options:
+  rule:
+    type: str
+  to_port:
+    aliases: [ port ]
+"""
+'''
+
+
+class TestSchema(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        files = {
+            ('library', 'files', 'copy'): COPY_MODULE,
+            ('ansible_collections', 'community', 'general', 'plugins',
+             'modules', 'ufw.py'): UFW_MODULE,
+            ('library', 'files', 'undocumented.py'): 'print(1)\n',
+        }
+        for parts, text in files.items():
+            path = os.path.join(self.tmp, *parts)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(text)
+        self.path = os.path.join(self.tmp, 'modules.json')
+        schema.build_index(self.tmp, self.path)
+        self.modules = schema.load_index(self.path)
+
+    def test_index(self):
+        self.assertEqual(['community.general.ufw', 'copy'],
+                         list(self.modules))
+        self.assertIs(self.modules, schema.load_index(self.path))
+        self.assertIs(self.modules.copy, self.modules['copy'])
+
+    def test_module_class(self):
+        copy = self.modules.copy
+        self.assertEqual('Copy', copy.__name__)
+        self.assertEqual(('src', 'dest', 'backup', 'force'), copy.options)
+        module = copy('/etc/motd', src='motd', thirsty=False)
+        self.assertEqual({'copy': {'dest': '/etc/motd', 'src': 'motd',
+                                   'force': False}},
+                         dict(module.as_obj()))
+        self.assertFalse(hasattr(module, '__dict__'))
+        task = ansible.Task(module)
+        self.assertEqual('Copies files to remote locations.',
+                         task.as_obj()['name'])
+        ufw = self.modules['community.general.ufw'](port='22')
+        self.assertEqual({'community.general.ufw': {'to_port': '22'}},
+                         dict(ufw.as_obj()))
+
+    def test_bad_arguments(self):
+        copy = self.modules.copy
+        self.assertRaises(TypeError, copy)
+        self.assertRaises(TypeError, copy, '/a', '/b')
+        self.assertRaises(TypeError, copy, '/a', owner='root')
+        self.assertRaises(TypeError, copy, '/a', dest='/b')
+        self.assertRaises(AttributeError, getattr, self.modules, 'file')
+
+    def test_format_checked(self):
+        with open(self.path, 'w') as f:
+            json.dump({'format': 0, 'modules': {}}, f)
+        os.utime(self.path, (0, 0))
+        self.assertRaises(ValueError, schema.load_index, self.path)
+
+
+class TestYamlEngines(unittest.TestCase):
+    def reference(self, value):
+        return yaml.dump(value, Dumper=ReferenceDumper, indent=2,
+                         allow_unicode=True, default_flow_style=False)
+
+    def test_engines_match_reference(self):
+        play = ansible.Play('Engines', gather_facts=False)
+        for i in range(20):
+            play.add_task(ansible.Task(rackspace.CloudDnsRecord(
+                'example.com', 'host%d.example.com' % i, '10.0.0.%d' % i,
+                credentials='~/.rackspace_cloud_credentials', ttl=300
+            ), register='dns'))
+        play.add_host(['localhost', '127.0.0.1'])
+        book = ansible.Playbook()
+        book.add_play(play)
+        expected = self.reference(book.as_obj())
+        for engine in utils.ENGINES:
+            self.assertEqual(expected,
+                             utils.pretty_yaml(book.as_obj(), engine=engine),
+                             'engine %s output differs' % engine)
+        self.assertIsNotNone(utils.fast_yaml(book.as_obj()))
+
+    def test_auto_falls_back(self):
+        shared = {'a': 1}
+        values = [
+            'scalar',
+            [shared, shared],
+            {'key': 'multi\nline'},
+            {'': 'empty key', 'x' * 130: 'long key'},
+            {'wrapped': 'word ' * 30},
+            {'tab': 'a\tb', 'unicode': u'caf\xe9 \U0001F600'},
+            OrderedDict([('b', 1.5), ('a', (1, 2))]),
+        ]
+        for value in values:
+            self.assertEqual(self.reference(value),
+                             utils.pretty_yaml(value, engine='auto'))
+
+    def test_fast_quoting(self):
+        value = OrderedDict([
+            ('plain', 'performance1-1'),
+            ('template', '{{ item.name }}'),
+            ('bool_like', 'yes'),
+            ('int_like', '123'),
+            ('quote', "it's"),
+            ('empty', ''),
+            ('none', None),
+            ('nested', [[], {}, [1, [True]]]),
+        ])
+        self.assertIsNotNone(utils.fast_yaml(value))
+        self.assertEqual(self.reference(value), utils.fast_yaml(value))
+
+    def test_set_engine(self):
+        self.assertRaises(ValueError, utils.set_engine, 'nope')
+        utils.set_engine('pyyaml')
+        try:
+            self.assertEqual(utils.default_engine, 'pyyaml')
+        finally:
+            utils.set_engine('auto')
+
+
 def main():
     TestAnsible.run()
 